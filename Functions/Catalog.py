@@ -0,0 +1,216 @@
+"""
+THIS SCRIPT BUILDS AND QUERIES A CATALOG OF POINT CLOUD FILES FROM THEIR HEADERS ONLY
+
+Only the LAS header and VLRs (or the schema.json of a .pcstore) are read, no point is decoded.
+The catalog is a SQLite database with one row per file:
+
+    path, directory, name, format, version, point_format, point_count,
+    min_x, min_y, min_z, max_x, max_y, max_z, creation_date, extra_bytes (JSON list),
+    tree_id (number at the end of the file name, as written by step 04), mtime
+
+E.G: python Catalog.py catalog.sqlite single_trees/ --jobs 8
+     TREES = Catalog.query_catalog("catalog.sqlite", directory="single_trees/")
+"""
+import json
+import os
+import sqlite3
+
+CATALOG_COLUMNS = [
+    ("path", "TEXT PRIMARY KEY"),
+    ("directory", "TEXT"),
+    ("name", "TEXT"),
+    ("format", "TEXT"),
+    ("version", "TEXT"),
+    ("point_format", "INTEGER"),
+    ("point_count", "INTEGER"),
+    ("min_x", "REAL"),
+    ("min_y", "REAL"),
+    ("min_z", "REAL"),
+    ("max_x", "REAL"),
+    ("max_y", "REAL"),
+    ("max_z", "REAL"),
+    ("creation_date", "TEXT"),
+    ("extra_bytes", "TEXT"),
+    ("tree_id", "INTEGER"),
+    ("mtime", "REAL"),
+]
+
+POINT_CLOUD_EXTENSIONS = (".las", ".laz", ".pcstore")
+
+
+"""
+SCAN THE HEADERS OF A LIST OF FILES
+
+MANDATORY: paths - files or directories (every .las, .laz and .pcstore inside is scanned)
+OPTIONAL: n_jobs - number of threads reading headers at the same time
+          E.G: RECORDS = Catalog.scan_headers(["tile_georef.las", "single_trees/"], n_jobs=8)
+
+Returns one dict per file with the CATALOG_COLUMNS keys, in the order of the paths.
+"""
+
+
+def scan_headers(paths, n_jobs=1):
+    from multiprocessing.pool import ThreadPool
+
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        if os.path.isdir(path) and not path.rstrip("/\\").endswith(".pcstore"):
+            files.extend(
+                sorted(
+                    os.path.join(path, name)
+                    for name in os.listdir(path)
+                    if name.lower().endswith(POINT_CLOUD_EXTENSIONS)
+                )
+            )
+        else:
+            files.append(path)
+
+    if n_jobs == 1 or len(files) < 2:
+        return [scan_header(f) for f in files]
+    with ThreadPool(min(n_jobs, len(files))) as pool:
+        return pool.map(scan_header, files)
+
+
+def scan_header(path):
+    path = os.path.abspath(path).rstrip("/\\")
+    record = {
+        "path": path,
+        "directory": os.path.dirname(path),
+        "name": os.path.basename(path),
+        "tree_id": _tree_id(os.path.basename(path)),
+        "mtime": os.path.getmtime(path),
+    }
+
+    if path.endswith(".pcstore"):
+        import PointStore
+
+        schema = PointStore.read_schema(path)
+        mins = schema.get("mins") or [None] * 3
+        maxs = schema.get("maxs") or [None] * 3
+        record.update(
+            format="pcstore",
+            version=str(schema["version"]),
+            point_format=None,
+            point_count=schema["count"],
+            creation_date=None,
+            extra_bytes=json.dumps(schema["ExtraBytes_name"]),
+        )
+    else:
+        import laspy
+
+        with laspy.open(path) as reader:
+            header = reader.header
+        mins, maxs = header.mins.tolist(), header.maxs.tolist()
+        record.update(
+            format="laz" if header.are_points_compressed else "las",
+            version=str(header.version),
+            point_format=header.point_format.id,
+            point_count=header.point_count,
+            creation_date=None if header.creation_date is None else header.creation_date.isoformat(),
+            extra_bytes=json.dumps(list(header.point_format.extra_dimension_names)),
+        )
+
+    record.update(
+        min_x=mins[0], min_y=mins[1], min_z=mins[2], max_x=maxs[0], max_y=maxs[1], max_z=maxs[2]
+    )
+    return record
+
+
+def _tree_id(name):
+    # SAME RULE AS THE WORKFLOW SCRIPTS: NUMBER AFTER THE LAST "_" OF THE FILE NAME
+    try:
+        return int(name.split(".")[0].split("_")[-1])
+    except ValueError:
+        return None
+
+
+"""
+WRITE THE RECORDS TO A SQLITE CATALOG - FILES ALREADY IN THE CATALOG ARE REPLACED
+
+MANDATORY: catalog (path of the .sqlite file), records (output of scan_headers)
+"""
+
+
+def write_catalog(catalog, records):
+    names = [name for name, _ in CATALOG_COLUMNS]
+    with sqlite3.connect(catalog) as connection:
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (%s)"
+            % ", ".join(f"{name} {kind}" for name, kind in CATALOG_COLUMNS)
+        )
+        connection.executemany(
+            "INSERT OR REPLACE INTO files (%s) VALUES (%s)"
+            % (", ".join(names), ", ".join("?" * len(names))),
+            [[record[name] for name in names] for record in records],
+        )
+    connection.close()
+
+
+"""
+QUERY THE CATALOG
+
+MANDATORY: catalog
+OPTIONAL: directory - only the files of this directory
+          bbox - [xmin, ymin, xmax, ymax], only the files whose bounds intersect it
+          formats - list of formats, e.g. ["laz", "pcstore"]
+          min_points - only the files with at least this number of points
+          E.G: for TREE in Catalog.query_catalog(catalog, directory=input_las_dir):
+                   LAZCONTENT = ReadLaz.ReadLaz(TREE["path"], DLLPATH)
+
+Returns a list of dicts (one per file, sorted by path) with the CATALOG_COLUMNS keys
+and extra_bytes decoded to a list.
+"""
+
+
+def query_catalog(catalog, directory=None, bbox=None, formats=None, min_points=0):
+    conditions = ["point_count >= ?"]
+    params = [min_points]
+    if directory is not None:
+        conditions.append("directory = ?")
+        params.append(os.path.abspath(directory).rstrip("/\\"))
+    if bbox is not None:
+        conditions.append("max_x >= ? AND min_x <= ? AND max_y >= ? AND min_y <= ?")
+        params.extend([bbox[0], bbox[2], bbox[1], bbox[3]])
+    if formats is not None:
+        conditions.append("format IN (%s)" % ", ".join("?" * len(formats)))
+        params.extend(formats)
+
+    with sqlite3.connect(catalog) as connection:
+        connection.row_factory = sqlite3.Row
+        rows = connection.execute(
+            "SELECT * FROM files WHERE %s ORDER BY path" % " AND ".join(conditions), params
+        ).fetchall()
+    connection.close()
+
+    records = [dict(row) for row in rows]
+    for record in records:
+        record["extra_bytes"] = json.loads(record["extra_bytes"])
+    return records
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description="Build or update a SQLite catalog of LAS/LAZ/.pcstore files from their headers"
+    )
+    parser.add_argument("catalog", help="SQLite file of the catalog")
+    parser.add_argument("paths", nargs="+", help="files or directories to scan")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="threads reading headers")
+    args = parser.parse_args()
+
+    t1_start = time.perf_counter()
+    records = scan_headers(args.paths, args.jobs)
+    write_catalog(args.catalog, records)
+    print(
+        "%d files, %d points added to %s in %.1f [sec]"
+        % (
+            len(records),
+            sum(record["point_count"] for record in records),
+            args.catalog,
+            time.perf_counter() - t1_start,
+        )
+    )
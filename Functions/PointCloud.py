@@ -0,0 +1,335 @@
+"""
+THIS SCRIPT CONTAINS THE POINT CLOUD CONTAINER RETURNED BY READLAZ AND BY THE PROCESSING FUNCTIONS
+
+A PointCloud holds one array per point field (columns) and the extra bytes as a single
+(NEB, NP) float32 block whose rows are named by ExtraBytes_name (as returned by ReadLaz).
+When extra is None the extra bytes listed in ExtraBytes_name are plain columns (as returned
+by the memory-mapped readers).
+lazy maps column names to functions that decode them (e.g. from a memory-mapped file). A lazy
+column is decoded the first time it is used and then kept as a plain column.
+Every field and every extra bytes row is available as an attribute, e.g. pc.x,
+pc.intensity or pc.Reflectance, so the container can be used wherever the old
+ATRIBUTES/TREE/RESAMPLE classes were used (hasattr, getattr, setattr and dir work the same way).
+
+E.G: TREE = PointCloud.from_attributes(LAZCONTENT, EXTRA, ExtraBytes_name).take(P)
+     TREE, EXTRA_TREE = TREE, TREE.extra
+
+Field presence (present_fields), bounds and min/max/nonzero (stats) are computed the first
+time they are asked for and cached, so reading a cloud makes no extra pass over the data.
+Assigning a field drops its cached values.
+
+QUANTIZED MODE (opt-in, see quantize): x, y and z are kept as int32 columns X, Y, Z with
+quantization = (scales, offsets), like in a LAS file, i.e. x = X * scale + offset.
+pc.x still works but decodes a float64 copy each time, the processing functions use the
+integer grid (box_mask) or float32 local coordinates (local_xyz) instead.
+Assigning pc.x re-encodes the values on the grid.
+
+"""
+import numpy as np
+
+# STANDARD FIELDS CARRIED BY THE PROCESSING FUNCTIONS
+POINT_FIELDS = [
+    "x",
+    "y",
+    "z",
+    "return_number",
+    "number_of_returns",
+    "intensity",
+    "scan_direction_flag",
+    "edge_of_flight_line",
+    "classification",
+    "scan_angle_rank",
+    "user_data",
+    "gps_time",
+    "rgb",
+]
+
+
+class PointCloud:
+    __slots__ = (
+        "columns", "extra", "ExtraBytes_name", "name", "header_bounds", "quantization", "lazy", "_stats", "_extra_owned",
+    )
+
+    def __init__(
+        self, columns=None, extra=None, ExtraBytes_name=None, name=None, header_bounds=None, quantization=None,
+        lazy=None,
+    ):
+        object.__setattr__(self, "columns", dict(columns or {}))
+        object.__setattr__(self, "lazy", dict(lazy or {}))
+        object.__setattr__(self, "extra", extra)
+        object.__setattr__(self, "ExtraBytes_name", list(ExtraBytes_name or []))
+        object.__setattr__(self, "name", name)
+        # (mins, maxs) OF X, Y, Z GIVEN BY THE FILE HEADER, USED BY bounds WITHOUT A PASS
+        object.__setattr__(self, "header_bounds", header_bounds)
+        object.__setattr__(self, "quantization", quantization)
+        object.__setattr__(self, "_stats", {})
+        # THE BLOCK MAY BE SHARED WITH THE CALLER UNTIL IT IS COPIED (SEE __setattr__)
+        object.__setattr__(self, "_extra_owned", False)
+
+    """
+    WRAP AN OBJECT WITH POINT FIELDS (E.G. THE OUTPUT OF READLAZ) AND ITS EXTRA BYTES MATRIX
+
+    The arrays are not copied. Only the fields of POINT_FIELDS are taken from LAZCONTENT,
+    the extra bytes come from EXTRA (NEB, NP) in the order of ExtraBytes_name.
+    EXTRA stays shared with the caller: assigning an extra bytes name (pc.Reflectance = ...)
+    copies the block first, so the caller's EXTRA is never modified.
+    A quantized LAZCONTENT stays quantized (X, Y, Z are taken instead of x, y, z).
+    """
+
+    @classmethod
+    def from_attributes(cls, LAZCONTENT, EXTRA=None, ExtraBytes_name=None):
+        quantization = getattr(LAZCONTENT, "quantization", None)
+        columns = {}
+        for field in POINT_FIELDS:
+            if quantization is not None and field in ("x", "y", "z"):
+                field = field.upper()
+            if hasattr(LAZCONTENT, field):
+                columns[field] = getattr(LAZCONTENT, field)
+
+        if ExtraBytes_name is not None and len(ExtraBytes_name) > 0:
+            EXTRA = np.asarray(EXTRA, dtype=np.float32)
+        else:
+            EXTRA = None
+            ExtraBytes_name = []
+
+        return cls(columns, EXTRA, ExtraBytes_name, quantization=quantization)
+
+    def __getattr__(self, name):
+        # ONLY CALLED WHEN NAME IS NOT A SLOT
+        if name in PointCloud.__slots__:
+            raise AttributeError(name)
+        if name in self.columns:
+            return self.columns[name]
+        if name in self.lazy:
+            self.columns[name] = self.lazy.pop(name)()
+            return self.columns[name]
+        if self.quantization is not None and name in ("x", "y", "z"):
+            k = "xyz".index(name)
+            scales, offsets = self.quantization
+            return self.columns[name.upper()] * scales[k] + offsets[k]
+        if self.extra is not None and name in self.ExtraBytes_name:
+            return self.extra[self.ExtraBytes_name.index(name)]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self._stats.pop(name, None)
+        self._stats.pop("present_fields", None)
+        if name in ("x", "y", "z"):
+            object.__setattr__(self, "header_bounds", None)
+            self._stats.pop("bounds", None)
+        self.lazy.pop(name, None)
+        if name in PointCloud.__slots__:
+            object.__setattr__(self, name, value)
+            if name == "extra":
+                object.__setattr__(self, "_extra_owned", False)
+        elif self.quantization is not None and name in ("x", "y", "z"):
+            k = "xyz".index(name)
+            self.columns[name.upper()] = _encode(value, self.quantization[0][k], self.quantization[1][k])
+        elif self.extra is not None and name in self.ExtraBytes_name and name not in self.columns:
+            # COPY ON WRITE: THE BLOCK GIVEN TO THE CONSTRUCTOR OR A VIEW OF ANOTHER BLOCK IS
+            # COPIED ONCE, BEFORE ITS FIRST ROW IS REPLACED
+            if not self._extra_owned:
+                object.__setattr__(self, "extra", np.array(self.extra, dtype=np.float32))
+                object.__setattr__(self, "_extra_owned", True)
+            self.extra[self.ExtraBytes_name.index(name)] = value
+        else:
+            self.columns[name] = value
+
+    def __delattr__(self, name):
+        self._stats.pop(name, None)
+        self._stats.pop("present_fields", None)
+        if name in self.columns or name in self.lazy:
+            self.columns.pop(name, None)
+            self.lazy.pop(name, None)
+        else:
+            object.__delattr__(self, name)
+
+    def __dir__(self):
+        names = list(self.columns) + list(self.lazy) + ["ExtraBytes_name"]
+        if self.extra is not None:
+            names = names + self.ExtraBytes_name
+        if self.quantization is not None:
+            names = [name for name in names if name not in ("X", "Y", "Z")] + ["x", "y", "z"]
+        return sorted(set(names))
+
+    def __len__(self):
+        if self.quantization is not None:
+            return len(self.columns["X"])
+        if "x" in self.columns or "x" in self.lazy:
+            return len(self.x)
+        # A PROJECTION WITHOUT x (E.G. fields=["intensity"]): THE LENGTH OF ANY OTHER FIELD
+        for values in self.columns.values():
+            return len(values)
+        if self.extra is not None:
+            return self.extra.shape[1]
+        for name in list(self.lazy):
+            return len(getattr(self, name))
+        return 0
+
+    def __repr__(self):
+        return f"PointCloud({len(self)} points, fields={list(self.columns)}, extra={self.ExtraBytes_name})"
+
+    """
+    GATHER THE POINTS GIVEN BY AN INDEX ARRAY (take) OR A BOOLEAN ARRAY (mask)
+
+    Every column is gathered with one fancy-index operation and the extra bytes block
+    with a single one for all its rows. The output is a new PointCloud, lazy columns are
+    decoded first.
+    """
+
+    def take(self, indices):
+        for name in list(self.lazy):
+            getattr(self, name)
+        columns = {name: values[indices] for name, values in self.columns.items()}
+        extra = None if self.extra is None else self.extra[:, indices]
+        CLOUD = PointCloud(columns, extra, self.ExtraBytes_name, self.name, quantization=self.quantization)
+        # A FANCY INDEX GIVES A NEW BLOCK, A SLICE A VIEW THAT IS COPIED ON WRITE
+        object.__setattr__(CLOUD, "_extra_owned", extra is not None and not np.may_share_memory(extra, self.extra))
+        return CLOUD
+
+    def mask(self, mask):
+        return self.take(np.flatnonzero(mask))
+
+    """
+    CACHED STATISTICS
+
+    field_names - every field and extra bytes name (no pass over the data)
+    present_fields - the fields with at least one non-zero value
+    bounds - (mins, maxs) of x, y, z, from the header when the reader gave them
+    stats(name) - {"min", "max", "nonzero"} of one field
+    """
+
+    @property
+    def field_names(self):
+        return [name for name in dir(self) if name != "ExtraBytes_name"]
+
+    @property
+    def present_fields(self):
+        if "present_fields" not in self._stats:
+            present = []
+            for name in self.field_names:
+                if name in self._stats:
+                    nonzero = self._stats[name]["nonzero"] > 0
+                else:
+                    nonzero = bool(np.any(getattr(self, name)))
+                if nonzero:
+                    present.append(name)
+            self._stats["present_fields"] = present
+        return self._stats["present_fields"]
+
+    @property
+    def bounds(self):
+        if self.header_bounds is not None:
+            return self.header_bounds
+        if "bounds" not in self._stats:
+            names, scales, offsets = ("x", "y", "z"), 1.0, 0.0
+            if self.quantization is not None:
+                names, (scales, offsets) = ("X", "Y", "Z"), self.quantization
+            mins = np.array([self.stats(name)["min"] for name in names]) * scales + offsets
+            maxs = np.array([self.stats(name)["max"] for name in names]) * scales + offsets
+            self._stats["bounds"] = (mins, maxs)
+        return self._stats["bounds"]
+
+    def stats(self, name):
+        if name not in self._stats:
+            values = getattr(self, name)
+            if len(values) == 0:
+                self._stats[name] = {"min": None, "max": None, "nonzero": 0}
+            else:
+                self._stats[name] = {
+                    "min": values.min(),
+                    "max": values.max(),
+                    "nonzero": np.count_nonzero(values),
+                }
+        return self._stats[name]
+
+    """
+    QUANTIZED MODE
+
+    quantize(scales, offsets) - store x, y, z as int32 X, Y, Z (in place). The default offsets
+                                are the floor of the lower bounds, so a plot of up to
+                                2147 km fits in int32 with millimetre scales
+    dequantize() - back to float64 x, y, z
+    local_xyz(origin) - float32 coordinates relative to origin (default: the floor of the
+                        lower bounds, so the values stay small) and the origin
+    box_mask(lower, upper) - lower < xyz < upper, compared on the integer grid when quantized
+    translate(shift) - xyz - shift, only the offsets change when quantized
+    """
+
+    def quantize(self, scales=(0.001, 0.001, 0.001), offsets=None):
+        if self.quantization is not None:
+            return self
+        scales = np.broadcast_to(np.asarray(scales, dtype=np.float64), (3,)).copy()
+        if offsets is None:
+            offsets = np.floor(self.bounds[0])
+        offsets = np.asarray(offsets, dtype=np.float64)
+        for k, name in enumerate(("x", "y", "z")):
+            self.columns[name.upper()] = _encode(getattr(self, name), scales[k], offsets[k])
+            del self.columns[name]
+        object.__setattr__(self, "quantization", (scales, offsets))
+        return self
+
+    def dequantize(self):
+        if self.quantization is None:
+            return self
+        scales, offsets = self.quantization
+        for k, name in enumerate(("x", "y", "z")):
+            self.columns[name] = self.columns.pop(name.upper()) * scales[k] + offsets[k]
+        object.__setattr__(self, "quantization", None)
+        return self
+
+    def local_xyz(self, origin=None, dtype=np.float32):
+        if origin is None:
+            origin = np.floor(self.bounds[0])
+        origin = np.asarray(origin, dtype=np.float64)
+
+        local = []
+        for k, name in enumerate(("x", "y", "z")):
+            if self.quantization is None:
+                local.append((getattr(self, name) - origin[k]).astype(dtype))
+                continue
+            # INTEGER SHIFT ON THE GRID, THEN THE SUB-UNIT REMAINDER OF THE ORIGIN
+            scale, offset = self.quantization[0][k], self.quantization[1][k]
+            shift = int(np.round((origin[k] - offset) / scale))
+            remainder = shift * scale + offset - origin[k]
+            values = np.multiply(self.columns[name.upper()] - np.int32(shift), scale, dtype=dtype)
+            if remainder != 0:
+                values += dtype(remainder)
+            local.append(values)
+        return local[0], local[1], local[2], origin
+
+    def box_mask(self, lower, upper):
+        lower = np.asarray(lower, dtype=np.float64)
+        upper = np.asarray(upper, dtype=np.float64)
+        inside = np.ones(len(self), dtype=bool)
+        for k, name in enumerate(("x", "y", "z")):
+            if np.isinf(lower[k]) and np.isinf(upper[k]):
+                continue
+            if self.quantization is None:
+                values, low, high = getattr(self, name), lower[k], upper[k]
+            else:
+                scale, offset = self.quantization[0][k], self.quantization[1][k]
+                values = self.columns[name.upper()]
+                low, high = (lower[k] - offset) / scale, (upper[k] - offset) / scale
+            inside &= (values > low) & (values < high)
+        return inside
+
+    def translate(self, shift):
+        shift = np.asarray(shift, dtype=np.float64)
+        if self.quantization is not None:
+            scales, offsets = self.quantization
+            object.__setattr__(self, "quantization", (scales, offsets - shift))
+            object.__setattr__(self, "header_bounds", None)
+            self._stats.pop("bounds", None)
+        else:
+            self.x = self.x - shift[0]
+            self.y = self.y - shift[1]
+            self.z = self.z - shift[2]
+        return self
+
+
+def _encode(values, scale, offset):
+    values = np.round((np.asarray(values, dtype=np.float64) - offset) / scale)
+    if len(values) > 0 and (values.min() < np.iinfo(np.int32).min or values.max() > np.iinfo(np.int32).max):
+        raise ValueError("Coordinates do not fit in int32 with this scale and offset")
+    return values.astype(np.int32)
@@ -0,0 +1,298 @@
+"""
+THIS SCRIPT READS AND WRITES THE COLUMNAR INTERMEDIATE STORE USED BETWEEN THE WORKFLOW STEPS
+
+A store is a directory (NAME.pcstore) with one file per column and a schema.json:
+
+    NAME.pcstore/schema.json   count, offsets, bounds, ExtraBytes_name, dtype and compression of each column
+    NAME.pcstore/x.bin         raw little-endian values (memory-mapped when read)
+    NAME.pcstore/x.zlib        zlib frames, one per written chunk (decompressed when read)
+
+x, y and z are stored with the offsets already added (the coordinates a LAZ file would hold),
+the standard fields with the dtypes returned by ReadLaz and the extra bytes as float32.
+Nothing is quantized, so a store keeps the full float64 coordinates.
+
+ReadLaz.ReadLaz and WriteLaz.WriteLaz use the store when the path ends with STORE_SUFFIX, so
+the workflow steps read and write it with the same calls they use for LAS/LAZ files.
+
+E.G: WriteLaz.WriteLaz("tile_georef.pcstore", DLLPATH, MainContent, offsets, EXTRA)
+     LAZCONTENT = ReadLaz.ReadLaz("tile_georef.pcstore", DLLPATH)
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+from PointCloud import PointCloud
+from ReadLaz import LAZ_FIELDS, check_fields
+
+STORE_SUFFIX = ".pcstore"
+SCHEMA_NAME = "schema.json"
+COMPRESSIONS = (None, "zlib")
+
+
+def is_store(path):
+    return str(path).rstrip("/\\").endswith(STORE_SUFFIX)
+
+
+"""
+WRITE A STORE CHUNK BY CHUNK
+
+MANDATORY: outputStore, offsets
+OPTIONAL: ExtraBytes_name
+          compression - None (raw, memory-mapped on read), "zlib" or a dict with the
+                        compression of each column, e.g. {"gps_time": "zlib"}
+          E.G: with PointStore.StoreWriter(outputStore, offsets, ExtraBytes_name) as writer:
+                   for chunk, EXTRA in chunks:
+                       writer.write_chunk(chunk, EXTRA)
+
+The standard fields stored are the ones present in the first chunk, every chunk must have them.
+Repeated extra bytes names are stored once, like in LazWriter.
+The columns are written to a temporary directory next to outputStore, which replaces the
+previous store only when the writer is closed without an error. If the with block raises,
+the temporary directory is removed and the previous store is left as it was.
+"""
+
+
+class StoreWriter:
+    def __init__(self, outputStore, offsets, ExtraBytes_name=[], compression=None):
+        self.path = str(outputStore).rstrip("/\\")
+        self.offsets = np.asarray(offsets, dtype=np.float32).astype(np.float64)
+        self.compression = compression
+        self.extra_rows = []
+        for i, name in enumerate(ExtraBytes_name):
+            if name in (row_name for _, row_name in self.extra_rows):
+                print(f"Extra bytes {name} is repeated, only the first one is stored")
+                continue
+            self.extra_rows.append((i, name))
+        self.columns = None
+        self.files = {}
+        self.npoints = 0
+        self.mins = np.full(3, np.inf)
+        self.maxs = np.full(3, -np.inf)
+        self.t1_start = time.perf_counter()
+
+        if os.path.isdir(self.path) and not os.path.exists(os.path.join(self.path, SCHEMA_NAME)):
+            raise ValueError(f"{self.path} exists and is not a point store")
+        parent, name = os.path.split(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+        self.tmp = tempfile.mkdtemp(prefix=name + ".", suffix=".tmp", dir=parent)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        if self.files is None:
+            return
+        for f in self.files.values():
+            f.close()
+        self.files = None
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _column_compression(self, name):
+        if isinstance(self.compression, dict):
+            compression = self.compression.get(name)
+        else:
+            compression = self.compression
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}, use one of {COMPRESSIONS}")
+        return compression
+
+    def _open_columns(self, ATTRIBUTES):
+        self.columns = {}
+        for name, dtype in LAZ_FIELDS.items():
+            if hasattr(ATTRIBUTES, name):
+                self.columns[name] = {"dtype": np.dtype(dtype).newbyteorder("<").str}
+        for _, name in self.extra_rows:
+            self.columns[name] = {"dtype": np.dtype(np.float32).newbyteorder("<").str}
+
+        for name, column in self.columns.items():
+            column["compression"] = self._column_compression(name)
+            extension = ".bin" if column["compression"] is None else ".zlib"
+            column["file"] = name + extension
+            column["frames"] = []
+            self.files[name] = open(os.path.join(self.tmp, column["file"]), "wb")
+
+    def _write_column(self, name, values):
+        column = self.columns[name]
+        data = np.ascontiguousarray(values, dtype=column["dtype"]).tobytes()
+        if column["compression"] == "zlib":
+            data = zlib.compress(data)
+            column["frames"].append(len(data))
+        self.files[name].write(data)
+
+    def write_chunk(self, ATTRIBUTES, Value=[]):
+        if self.columns is None:
+            self._open_columns(ATTRIBUTES)
+
+        size = len(ATTRIBUTES.x)
+        for k, name in enumerate(("x", "y", "z")):
+            values = np.asarray(getattr(ATTRIBUTES, name), dtype=np.float64) + self.offsets[k]
+            if size > 0:
+                self.mins[k] = min(self.mins[k], values.min())
+                self.maxs[k] = max(self.maxs[k], values.max())
+            self._write_column(name, values)
+        for name in self.columns:
+            if name in ("x", "y", "z") or name in (row_name for _, row_name in self.extra_rows):
+                continue
+            self._write_column(name, getattr(ATTRIBUTES, name))
+        for i, name in self.extra_rows:
+            self._write_column(name, Value[i])
+
+        self.npoints += size
+
+    def close(self):
+        if self.files is None:
+            return
+        if self.columns is None:
+            # NOTHING WAS WRITTEN - STORE AN EMPTY CLOUD WITH THE COORDINATES ONLY
+            self._open_columns(PointCloud({"x": None, "y": None, "z": None}))
+        for f in self.files.values():
+            f.close()
+        self.files = None
+
+        schema = {
+            "version": 1,
+            "count": self.npoints,
+            "offsets": self.offsets.tolist(),
+            "mins": self.mins.tolist() if self.npoints > 0 else None,
+            "maxs": self.maxs.tolist() if self.npoints > 0 else None,
+            "ExtraBytes_name": [name for _, name in self.extra_rows],
+            "columns": self.columns,
+        }
+        with open(os.path.join(self.tmp, SCHEMA_NAME), "w") as f:
+            json.dump(schema, f, indent=1)
+
+        # THE PREVIOUS STORE IS ONLY REMOVED ONCE THE NEW ONE IS COMPLETE
+        if os.path.isdir(self.path):
+            old = self.tmp + ".old"
+            os.rename(self.path, old)
+            os.rename(self.tmp, self.path)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.rename(self.tmp, self.path)
+
+        print("\n Writing Elapsed time: %.1f [sec]" % (time.perf_counter() - self.t1_start))
+        print("POINTS WRITTEN: ", self.npoints)
+
+
+"""
+WRITE A WHOLE POINT CLOUD TO A STORE - SAME ARGUMENTS AS WriteLaz.WriteLaz
+"""
+
+
+def write_store(outputStore, ATTRIBUTES, offsets, Value=[], compression=None):
+    with StoreWriter(outputStore, offsets, ATTRIBUTES.ExtraBytes_name, compression) as writer:
+        writer.write_chunk(ATTRIBUTES, Value)
+
+
+"""
+READ A STORE
+
+MANDATORY: inputStore
+OPTIONAL: fields - list of standard fields and extra bytes to return (default: all of them),
+                   unknown names raise ValueError (see ReadLaz.check_fields)
+          bbox, polygon - same window filters as ReadLaz.read_window (bounds included)
+
+Raw columns are returned as read-only memory maps, so reading costs almost nothing until the
+values are used. Standard fields missing from the store are returned as zeros, like the LAZ
+readers do. Extra bytes are plain columns listed in ExtraBytes_name.
+"""
+
+
+def read_schema(inputStore):
+    with open(os.path.join(str(inputStore), SCHEMA_NAME)) as f:
+        return json.load(f)
+
+
+def _read_column(inputStore, column, count):
+    path = os.path.join(str(inputStore), column["file"])
+    dtype = np.dtype(column["dtype"])
+    if column["compression"] is None:
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+    values = np.empty(count, dtype=dtype)
+    position = 0
+    with open(path, "rb") as f:
+        for frame in column["frames"]:
+            chunk = np.frombuffer(zlib.decompress(f.read(frame)), dtype=dtype)
+            values[position : position + len(chunk)] = chunk
+            position += len(chunk)
+    return values
+
+
+def read_store(inputStore, fields=None, bbox=None, polygon=None):
+    t1_start = time.perf_counter()
+    schema = read_schema(inputStore)
+    count = schema["count"]
+    columns = schema["columns"]
+    check_fields(fields, schema["ExtraBytes_name"])
+
+    ATRIBUTES = PointCloud()
+    for name, dtype in LAZ_FIELDS.items():
+        if fields is not None and name not in fields:
+            continue
+        if name in columns:
+            values = _read_column(inputStore, columns[name], count)
+        else:
+            values = np.zeros(count, dtype=dtype)
+        setattr(ATRIBUTES, name, values)
+
+    ExtraBytes_name = [
+        name for name in schema["ExtraBytes_name"] if fields is None or name in fields
+    ]
+    for name in ExtraBytes_name:
+        setattr(ATRIBUTES, name, _read_column(inputStore, columns[name], count))
+    ATRIBUTES.ExtraBytes_name = ExtraBytes_name
+    if schema.get("mins") is not None:
+        ATRIBUTES.header_bounds = (np.array(schema["mins"]), np.array(schema["maxs"]))
+
+    if bbox is not None or polygon is not None:
+        ATRIBUTES = ATRIBUTES.mask(_window_mask(inputStore, columns, count, bbox, polygon))
+
+    print("\n Store reading Elapsed time: %.1f [sec]" % (time.perf_counter() - t1_start))
+    print("LAZ CONTENT:", ATRIBUTES.field_names)
+    print("LAZ EXTRA BYTES: ExtraBytes_name", ExtraBytes_name)
+    return ATRIBUTES
+
+
+def _window_mask(inputStore, columns, count, bbox=None, polygon=None):
+    X = _read_column(inputStore, columns["x"], count)
+    Y = _read_column(inputStore, columns["y"], count)
+    Z = _read_column(inputStore, columns["z"], count)
+
+    inside = np.ones(count, dtype=bool)
+    if bbox is not None:
+        bbox = np.asarray(bbox, dtype=np.float64)
+        if len(bbox) == 4:
+            inside &= (X >= bbox[0]) & (X <= bbox[2]) & (Y >= bbox[1]) & (Y <= bbox[3])
+        elif len(bbox) == 6:
+            inside &= (
+                (X >= bbox[0]) & (X <= bbox[3])
+                & (Y >= bbox[1]) & (Y <= bbox[4])
+                & (Z >= bbox[2]) & (Z <= bbox[5])
+            )
+        else:
+            raise ValueError("bbox must have 4 or 6 values")
+    if polygon is not None:
+        from matplotlib.path import Path
+
+        polygon = np.asarray(polygon, dtype=np.float64)
+        inside &= (
+            (X >= polygon[:, 0].min()) & (X <= polygon[:, 0].max())
+            & (Y >= polygon[:, 1].min()) & (Y <= polygon[:, 1].max())
+        )
+        if np.any(inside):
+            inside[inside] = Path(polygon).contains_points(np.column_stack((X[inside], Y[inside])))
+    return inside
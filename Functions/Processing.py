@@ -66,6 +66,15 @@ OPTIONAL: Extra, ExtraBytes_name
 def add_extra_bytes(las_content, extra_bytes_names):
     import numpy as np
     
+    # EXTRA BYTES READ AS ONE BLOCK (ReadLaz): THE BLOCK ITSELF OR A SINGLE GATHER OF ITS ROWS
+    extra = getattr(las_content, "extra", None)
+    if extra is not None and all(name in las_content.ExtraBytes_name for name in extra_bytes_names):
+        rows = [las_content.ExtraBytes_name.index(name) for name in extra_bytes_names]
+        print(f"Your extrabytes: {*extra_bytes_names,}")
+        if rows == list(range(len(extra))):
+            return extra
+        return extra[rows]
+
     # create empty extrabytes_array based on number of extra bytes and size of already existing bytes
     extra_bytes_array = np.empty(
         (len(extra_bytes_names), len(las_content.x)), dtype=np.float32
@@ -85,66 +94,12 @@ def add_extra_bytes(las_content, extra_bytes_names):
 
 def Resample(LAZCONTENT, useroption, PCD, EXTRA=[], ExtraBytes_name=[]):
     import numpy as np
+    from PointCloud import PointCloud
 
     size = len(LAZCONTENT.x)
 
-    class RESAMPLE:
-        pass
-
     if useroption == 1:
-        if hasattr(LAZCONTENT, "x") == True:
-            x = LAZCONTENT.x[np.arange(0, size, PCD)]
-            setattr(RESAMPLE, "x", x)
-        if hasattr(LAZCONTENT, "y") == True:
-            y = LAZCONTENT.y[np.arange(0, size, PCD)]
-            setattr(RESAMPLE, "y", y)
-        if hasattr(LAZCONTENT, "z") == True:
-            z = LAZCONTENT.z[np.arange(0, size, PCD)]
-            setattr(RESAMPLE, "z", z)
-        if hasattr(LAZCONTENT, "return_number") == True:
-            rn = LAZCONTENT.return_number[np.arange(0, size, PCD)]
-            setattr(RESAMPLE, "return_number", rn)
-        if hasattr(LAZCONTENT, "number_of_returns") == True:
-            nr = LAZCONTENT.number_of_returns[np.arange(0, size, PCD)]
-            setattr(RESAMPLE, "number_of_returns", nr)
-        if hasattr(LAZCONTENT, "intensity") == True:
-            intensity = LAZCONTENT.intensity[np.arange(0, size, PCD)]
-            setattr(RESAMPLE, "intensity", intensity)
-        if hasattr(LAZCONTENT, "scan_direction_flag") == True:
-            scan_direction_flag = LAZCONTENT.scan_direction_flag[
-                np.arange(0, size, PCD)
-            ]
-            setattr(RESAMPLE, "scan_direction_flag", scan_direction_flag)
-        if hasattr(LAZCONTENT, "edge_of_flight_line") == True:
-            edge_of_flight_line = LAZCONTENT.edge_of_flight_line[
-                np.arange(0, size, PCD)
-            ]
-            setattr(RESAMPLE, "edge_of_flight_line", edge_of_flight_line)
-        if hasattr(LAZCONTENT, "classification") == True:
-            classification = LAZCONTENT.classification[np.arange(0, size, PCD)]
-            setattr(RESAMPLE, "classification", classification)
-        if hasattr(LAZCONTENT, "scan_angle_rank") == True:
-            scan_angle_rank = LAZCONTENT.scan_angle_rank[np.arange(0, size, PCD)]
-            setattr(RESAMPLE, "scan_angle_rank", scan_angle_rank)
-        if hasattr(LAZCONTENT, "user_data") == True:
-            user_data = LAZCONTENT.user_data[np.arange(0, size, PCD)]
-            setattr(RESAMPLE, "user_data", user_data)
-        if hasattr(LAZCONTENT, "gps_time") == True:
-            gps_time = LAZCONTENT.gps_time[np.arange(0, size, PCD)]
-            setattr(RESAMPLE, "gps_time", gps_time)
-        if hasattr(LAZCONTENT, "rgb") == True:
-            rgb = LAZCONTENT.rgb[np.arange(0, size, PCD)]
-            setattr(RESAMPLE, "rgb", rgb)
-        if len(ExtraBytes_name) > 0:
-            number_attributes = len(EXTRA)
-            NP = len(x)
-            EXTRA_R = np.empty((number_attributes, NP), dtype=np.float32)
-            for i in range(number_attributes):
-                default = EXTRA[i]
-                default = default[np.arange(0, size, PCD)]
-                EXTRA_R[i] = default
-                setattr(RESAMPLE, ExtraBytes_name[i], default)
-            setattr(RESAMPLE, "ExtraBytes_name", ExtraBytes_name)
+        indices = np.arange(0, size, PCD)
 
     if useroption == 2 or useroption == 3 or useroption == 4:
         # CHECKING USER OPTIONS >> INPUT PCD
@@ -158,59 +113,12 @@ def Resample(LAZCONTENT, useroption, PCD, EXTRA=[], ExtraBytes_name=[]):
         if useroption == 4:
             indices = PCD
 
-        # REDUCE CLOUD
-        if hasattr(LAZCONTENT, "x") == True:
-            x = LAZCONTENT.x[indices]
-            setattr(RESAMPLE, "x", x)
-        if hasattr(LAZCONTENT, "y") == True:
-            y = LAZCONTENT.y[indices]
-            setattr(RESAMPLE, "y", y)
-        if hasattr(LAZCONTENT, "z") == True:
-            z = LAZCONTENT.z[indices]
-            setattr(RESAMPLE, "z", z)
-        if hasattr(LAZCONTENT, "return_number") == True:
-            rn = LAZCONTENT.return_number[indices]
-            setattr(RESAMPLE, "return_number", rn)
-        if hasattr(LAZCONTENT, "number_of_returns") == True:
-            nr = LAZCONTENT.number_of_returns[indices]
-            setattr(RESAMPLE, "number_of_returns", nr)
-        if hasattr(LAZCONTENT, "intensity") == True:
-            intensity = LAZCONTENT.intensity[indices]
-            setattr(RESAMPLE, "intensity", intensity)
-        if hasattr(LAZCONTENT, "scan_direction_flag") == True:
-            scan_direction_flag = LAZCONTENT.scan_direction_flag[indices]
-            setattr(RESAMPLE, "scan_direction_flag", scan_direction_flag)
-        if hasattr(LAZCONTENT, "edge_of_flight_line") == True:
-            edge_of_flight_line = LAZCONTENT.edge_of_flight_line[indices]
-            setattr(RESAMPLE, "edge_of_flight_line", edge_of_flight_line)
-        if hasattr(LAZCONTENT, "classification") == True:
-            classification = LAZCONTENT.classification[indices]
-            setattr(RESAMPLE, "classification", classification)
-        if hasattr(LAZCONTENT, "scan_angle_rank") == True:
-            scan_angle_rank = LAZCONTENT.scan_angle_rank[indices]
-            setattr(RESAMPLE, "scan_angle_rank", scan_angle_rank)
-        if hasattr(LAZCONTENT, "user_data") == True:
-            user_data = LAZCONTENT.user_data[indices]
-            setattr(RESAMPLE, "user_data", user_data)
-        if hasattr(LAZCONTENT, "gps_time") == True:
-            gps_time = LAZCONTENT.gps_time[indices]
-            setattr(RESAMPLE, "gps_time", gps_time)
-        if hasattr(LAZCONTENT, "rgb") == True:
-            rgb = LAZCONTENT.rgb[indices]
-            setattr(RESAMPLE, "rgb", rgb)
-        if len(ExtraBytes_name) > 0:
-            number_attributes = len(EXTRA)
-            NP = len(x)
-            EXTRA_R = np.empty((number_attributes, NP), dtype=np.float32)
-            for i in range(number_attributes):
-                default = EXTRA[i]
-                default = default[indices]
-                EXTRA_R[i] = default
-                setattr(RESAMPLE, ExtraBytes_name[i], default)
-            setattr(RESAMPLE, "ExtraBytes_name", ExtraBytes_name)
+    # REDUCE CLOUD - ALL FIELDS AND EXTRA BYTES IN ONE GATHER
+    CLOUD = PointCloud.from_attributes(LAZCONTENT, EXTRA, ExtraBytes_name)
+    RESAMPLE = CLOUD.take(indices)
 
     if len(ExtraBytes_name) > 0:
-        return RESAMPLE, EXTRA_R
+        return RESAMPLE, RESAMPLE.extra
 
     if len(ExtraBytes_name) == 0:
         return RESAMPLE
@@ -225,6 +133,17 @@ MANDATORY: LAZCONTENT, PCD
 OPTIONAL: Extra, ExtraBytes_name
           IF EXTRABYTES CREATE A GENERAL ARRAY AND SET THE NUMBER OF POINTS
           E.G:TESTE, EXTRA=Processing.Resample(LAZCONTENT, PCD, Extra, ExtraBytes_name)
+          selection - "kdtree" (default): the points nearest to the voxel means are searched in a
+                      KD-tree of the whole cloud
+                      "voxel": the point of each voxel nearest to its mean is found while the means
+                      are computed, no KD-tree (npoints=1 only). The neighbouring voxels are
+                      searched too, so the points are the ones of "kdtree" (up to equal distances)
+          E.G: TESTE, EXTRA=Processing.Spatial_sample(LAZCONTENT, "neighbour", 1, 0.1, 1, Extra, ExtraBytes_name, selection="voxel")
+          n_jobs - number of threads. With n_jobs > 1 the plot is split in XY tiles of whole voxels
+                   processed on a thread pool (the tiles share the input arrays, and the points of
+                   the neighbouring tiles within 2 voxels are searched too). The output is the one
+                   of n_jobs=1. With npoints > 1 the whole cloud is processed at once
+          E.G: TESTE, EXTRA=Processing.Spatial_sample(LAZCONTENT, "neighbour", 1, 0.1, 1, Extra, ExtraBytes_name, n_jobs=8)
 
 REQUIREMENTS: Numba and pykdtree
 
@@ -232,221 +151,459 @@ REQUIREMENTS: Numba and pykdtree
 
 
 def Spatial_sample(
-    LAZCONTENT, useroption, pts_min, vs, npoints, EXTRA, ExtraBytes_name, n_jobs=1
+    LAZCONTENT, useroption, pts_min, vs, npoints, EXTRA, ExtraBytes_name, n_jobs=1, selection="kdtree"
 ):
     import numba_algorithms as na
     from pykdtree.kdtree import KDTree
     import time
     import numpy as np
+    from PointCloud import PointCloud
+
+    # ALL FIELDS AND EXTRA BYTES, GATHERED IN ONE PASS FOR THE SELECTED POINTS
+    CLOUD = PointCloud.from_attributes(LAZCONTENT, EXTRA, ExtraBytes_name)
+    if hasattr(LAZCONTENT, "Amplitude"):
+        CLOUD.intensity = LAZCONTENT.Amplitude
+
+    # QUANTIZED CLOUDS ARE RESAMPLED ON FLOAT32 COORDINATES RELATIVE TO THEIR OFFSETS
+    if CLOUD.quantization is not None:
+        x, y, z, origin = CLOUD.local_xyz()
+    else:
+        x, y, z, origin = LAZCONTENT.x, LAZCONTENT.y, LAZCONTENT.z, None
 
     # CREATE GRID CELL
     start = time.perf_counter()
-    fields = [
-        f
-        for f in dir(LAZCONTENT)
-        if not callable(getattr(LAZCONTENT, f)) and not f.startswith("__")
-    ]
+    ATRIBUTE = _voxel_attribute(LAZCONTENT, z)
+
+    if selection not in ("voxel", "kdtree"):
+        raise ValueError(f'Unknown selection {selection}, use "kdtree" or "voxel"')
+    if selection == "voxel" and npoints != 1 and (useroption == "neighbour" or useroption == "mean"):
+        raise ValueError('selection="voxel" gives one point per voxel, use npoints=1')
+
+    # XY TILES OF THE VOXEL GRID ON n_jobs THREADS, SAME OUTPUT AS ONE JOB (BUT FOR KD-TREE TIES)
+    tiled = n_jobs > 1 and (useroption == "dist" or npoints == 1)
+    if tiled:
+        neighbour_indices, means, MeanReflec = _spatial_sample_tiles(
+            x, y, z, ATRIBUTE, vs, pts_min, useroption, selection, n_jobs
+        )
+        print(f"{n_jobs} jobs: voxels resampled by tiles, took {time.perf_counter()-start:.2f} s")
+
+    # THE VOXEL SELECTION FINDS THE POINT CLOSEST TO EACH MEAN WHILE THE MEANS ARE COMPUTED
+    elif useroption == "neighbour" or useroption == "mean":
+        if selection == "voxel":
+            means, MeanReflec, neighbour_indices = na.compute_grid_means(
+                x, y, z, ATRIBUTE, vs, pts_min, return_nearest=True
+            )
+        else:
+            means, MeanReflec = na.compute_grid_means(x, y, z, ATRIBUTE, vs, pts_min)
+        print(f"Grid means computed, took {time.perf_counter()-start:.2f} s")
+        # print(d)
+        # ESTIMATED TIME = 7min for 42G las file
+
+        if selection == "kdtree":
+            start = time.perf_counter()
+            # Large leafsize since only one query is done
+            tree = KDTree(np.vstack([x, y, z]).T, leafsize=256)
+
+            print(f"Neighbor setup complete, took {time.perf_counter()-start:.2f} s")
+            start = time.perf_counter()
+            _, neighbour_indices = tree.query(np.asarray(means, dtype=x.dtype), k=npoints)
+
+            if npoints > 1:
+                neighbour_indices = neighbour_indices.flatten()
+
+            del tree
+            print(f"Neighbor search complete, took {time.perf_counter()-start:.2f} s")
+
+    if useroption == "neighbour" or useroption == "mean":
+        DATA_MEAN = means if origin is None else means + origin
+        del means
+        SPATIAL_RESAMPLE = _resample_output(
+            CLOUD, neighbour_indices, useroption, ExtraBytes_name,
+            MeanReflec if npoints == 1 else None, DATA_MEAN,
+        )
+        del MeanReflec
+
+    # ESTIMATED TIME = 463s - 7 MIN
+    if useroption == "dist":
+        # FIRST POINT OF EVERY VOXEL WITH MORE THAN pts_min POINTS
+        if not tiled:
+            idgrid = na.voxel_keys(x, y, z, vs)
+            _, unique_indices, unique_counts = np.unique(
+                idgrid, return_index=True, return_counts=True
+            )
+            neighbour_indices = unique_indices[unique_counts > pts_min]
+
+        SPATIAL_RESAMPLE = CLOUD.take(neighbour_indices)
+
+    if len(ExtraBytes_name) > 0:
+        return SPATIAL_RESAMPLE, SPATIAL_RESAMPLE.extra
+
+    if len(ExtraBytes_name) == 0:
+        return SPATIAL_RESAMPLE
+
+
+"""
+TILES OF Spatial_sample
+
+The voxel keys of the whole cloud are computed once, then every XY tile of whole voxels
+(about 4 tiles per job) is resampled by a thread of the pool, on the points of the tile and of
+the neighbouring voxels within 2 voxels: the point nearest to a voxel mean is never farther
+than the voxel diagonal. The voxels of each tile are concatenated in key order, so the output
+is the one of the whole cloud. Only with selection="kdtree" the tree of a tile may pick another
+point when two are as close to a voxel mean.
+
+OUTPUT: indices of the points kept, means and MeanReflec of their voxels (None for "dist")
+"""
+
+
+def _spatial_sample_tiles(x, y, z, ATRIBUTE, vs, pts_min, useroption, selection, n_jobs):
+    from multiprocessing.pool import ThreadPool
+    import numpy as np
+    import numba_algorithms as na
+    from pykdtree.kdtree import KDTree
+
+    # THE NUMBA THREAD COUNT IS PER THREAD, THE TILES USE THE DEFAULT ONE OF THE POOL THREADS
+    with na.num_threads(n_jobs):
+        keys, bins = na.voxel_keys(x, y, z, vs, return_bins=True)
+        nx, ny = len(bins[0]), len(bins[1])
+        side = int(np.ceil(np.sqrt(4 * n_jobs)))
+        tx, ty = max(1, -(-nx // side)), max(1, -(-ny // side))
+        order, starts = na.voxel_tiles(keys, max(nx, 1), max(ny, 1), tx, ty)
+    halo = 0 if useroption == "dist" else 2
+
+    def resample_tile(t):
+        points = na.tile_points(order, starts, keys, max(nx, 1), max(ny, 1), tx, ty, t, halo)
+        unique_keys, chosen, means, MeanReflec = _resample_voxels(
+            keys[points], bins, x[points], y[points], z[points], ATRIBUTE[points],
+            pts_min, useroption, selection, nogil=True,
+        )
+        # ONLY THE VOXELS OF THE TILE, THE OTHERS BELONG TO THE NEIGHBOURING TILES
+        inside = na.voxel_tile(unique_keys, max(nx, 1), max(ny, 1), tx, ty) == t
+        if useroption == "dist":
+            return unique_keys[inside], points[chosen[inside]], None, None
+        return unique_keys[inside], points[chosen[inside]], means[inside], MeanReflec[inside]
+
+    with ThreadPool(n_jobs) as pool:
+        results = pool.map(resample_tile, range(len(starts) - 1))
+
+    key_order = np.argsort(np.concatenate([result[0] for result in results]))
+    indices = np.concatenate([result[1] for result in results])[key_order]
+    if useroption == "dist":
+        return indices, None, None
+    means = np.concatenate([result[2] for result in results])[key_order]
+    MeanReflec = np.concatenate([result[3] for result in results])[key_order]
+    return indices, means, MeanReflec
+
+
+# POINTS KEPT, WITH THE MEAN REFLECTANCE AND THE MEAN COORDINATES ("mean") OF THEIR VOXELS
+def _resample_output(CLOUD, indices, useroption, ExtraBytes_name, MeanReflec=None, DATA_MEAN=None):
+    import numpy as np
+
+    SPATIAL_RESAMPLE = CLOUD.take(indices)
+
+    # EXTRA MAY BE THE BLOCK OF LAZCONTENT, SO THE MEAN REFLECTANCE IS SCATTERED IN A
+    # SCRATCH ROW (THE LAST MEAN WINS WHEN TWO VOXELS SHARE THEIR NEAREST POINT)
+    if MeanReflec is not None:
+        for k in range(len(ExtraBytes_name)):
+            if ExtraBytes_name[k] == "Reflectance":
+                ROW = np.empty(len(CLOUD), dtype=np.float32)
+                ROW[indices] = MeanReflec
+                SPATIAL_RESAMPLE.extra[k] = ROW[indices]
+
+    if useroption == "mean":
+        SPATIAL_RESAMPLE.x = DATA_MEAN[:, 0]
+        SPATIAL_RESAMPLE.y = DATA_MEAN[:, 1]
+        SPATIAL_RESAMPLE.z = DATA_MEAN[:, 2]
+    return SPATIAL_RESAMPLE
+
+
+# ATTRIBUTE AVERAGED IN THE VOXELS: Reflectance, reflectance, intensity OR z (FIRST ONE PRESENT)
+def _voxel_attribute(LAZCONTENT, z):
+    import numpy as np
+
+    fields = [f for f in dir(LAZCONTENT) if not f.startswith("__")]
+    fields = [f for f in fields if f in ("x", "y", "z") or not callable(getattr(LAZCONTENT, f))]
 
     LAZ_fields = ["Reflectance", "reflectance", "intensity", "z"]
     LAZ_fields = np.array(LAZ_fields)
     fields = np.array(fields)
 
     if len(np.where(fields == LAZ_fields[3])[0]) > 0:
-        ATRIBUTE = LAZCONTENT.z
+        ATRIBUTE = z
     if len(np.where(fields == LAZ_fields[2])[0]) > 0:
         ATRIBUTE = LAZCONTENT.intensity
     if len(np.where(fields == LAZ_fields[1])[0]) > 0:
         ATRIBUTE = LAZCONTENT.reflectance
     if len(np.where(fields == LAZ_fields[0])[0]) > 0:
         ATRIBUTE = LAZCONTENT.Reflectance
+    return ATRIBUTE
 
-    means, MeanReflec = na.compute_grid_means(
-        LAZCONTENT.x, LAZCONTENT.y, LAZCONTENT.z, ATRIBUTE, vs, pts_min
-    )
-    DATA_MEAN = means
-    print(f"Grid means computed, took {time.perf_counter()-start:.2f} s")
-    # print(d)
-    # ESTIMATED TIME = 7min for 42G las file
 
-    if useroption == "neighbour" or useroption == "mean":
-        start = time.perf_counter()
-        # Large leafsize since only one query is done
-        tree = KDTree(
-            np.vstack([LAZCONTENT.x, LAZCONTENT.y, LAZCONTENT.z]).T, leafsize=256
-        )
+# ONE POINT PER VOXEL OF THE POINTS GIVEN BY THEIR VOXEL KEYS (AND THE BINS OF voxel_keys)
+# OUTPUT: keys of the voxels kept, index of their point, means and MeanReflec (None for "dist")
+def _resample_voxels(keys, bins, x, y, z, ATRIBUTE, pts_min, useroption, selection, nogil=False):
+    import numpy as np
+    import numba_algorithms as na
+    from pykdtree.kdtree import KDTree
 
-        print(f"Neighbor setup complete, took {time.perf_counter()-start:.2f} s")
-        start = time.perf_counter()
-        _, neighbour_indices = tree.query(means, k=npoints)
+    if useroption == "dist":
+        unique_keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+        valid = counts > pts_min
+        return unique_keys[valid], first[valid], None, None
 
-        if npoints > 1:
-            neighbour_indices = neighbour_indices.flatten()
+    result = na.grid_means(
+        keys, bins, x, y, z, ATRIBUTE, pts_min, return_nearest=selection == "voxel", nogil=nogil
+    )
+    unique_keys, means, MeanReflec = result[:3]
+    if selection == "voxel":
+        nearest = result[3]
+    else:
+        tree = KDTree(np.vstack([x, y, z]).T, leafsize=256)
+        _, nearest = tree.query(np.asarray(means, dtype=x.dtype), k=1)
+    return unique_keys, nearest, means, MeanReflec
 
-        if npoints == 1:
-            for k in range(len(ExtraBytes_name)):
-                if ExtraBytes_name[k] == "Reflectance":
-                    EXTRA[k][neighbour_indices] = MeanReflec
 
-        del means, tree, MeanReflec
-        print(f"Neighbor search complete, took {time.perf_counter()-start:.2f} s")
+"""
+PROCESSING: LOD PYRAMID - Spatial_sample (npoints=1) AT SEVERAL VOXEL SIZES FROM ONE SORT OF THE POINTS
 
-        class SPATIAL_RESAMPLE:
-            pass
+MANDATORY: LAZCONTENT, useroption, pts_min, voxel_sizes (increasing, each one a whole multiple of the previous one)
+           E.G: LEVELS = Processing.Spatial_sample_pyramid(LAZCONTENT, "neighbour", 1, [0.05, 0.1, 0.4], Extra, ExtraBytes_name)
+                for vs, (TESTE, EXTRA) in zip([0.05, 0.1, 0.4], LEVELS):
 
-        if useroption == "neighbour":
-            lx = len(LAZCONTENT.x[neighbour_indices])
-            setattr(SPATIAL_RESAMPLE, "x", LAZCONTENT.x[neighbour_indices])
-            setattr(SPATIAL_RESAMPLE, "y", LAZCONTENT.y[neighbour_indices])
-            setattr(SPATIAL_RESAMPLE, "z", LAZCONTENT.z[neighbour_indices])
-
-        if useroption == "mean":
-            lx = len(DATA_MEAN[:, 0])
-            setattr(SPATIAL_RESAMPLE, "x", DATA_MEAN[:, 0])
-            setattr(SPATIAL_RESAMPLE, "y", DATA_MEAN[:, 1])
-            setattr(SPATIAL_RESAMPLE, "z", DATA_MEAN[:, 2])
-
-        if hasattr(LAZCONTENT, "return_number"):
-            rn = LAZCONTENT.return_number[neighbour_indices]
-            setattr(SPATIAL_RESAMPLE, "return_number", rn)
-
-        if hasattr(LAZCONTENT, "number_of_returns"):
-            nr = LAZCONTENT.number_of_returns[neighbour_indices]
-            setattr(SPATIAL_RESAMPLE, "number_of_returns", nr)
-
-        if hasattr(LAZCONTENT, "intensity"):
-            intensity = LAZCONTENT.intensity[neighbour_indices]
-            setattr(SPATIAL_RESAMPLE, "intensity", intensity)
-
-        if hasattr(LAZCONTENT, "Amplitude"):
-            intensity = LAZCONTENT.Amplitude[neighbour_indices]
-            setattr(SPATIAL_RESAMPLE, "intensity", intensity)
-
-        if hasattr(LAZCONTENT, "scan_direction_flag"):
-            scan_direction_flag = LAZCONTENT.scan_direction_flag[neighbour_indices]
-            setattr(SPATIAL_RESAMPLE, "scan_direction_flag", scan_direction_flag)
-
-        if hasattr(LAZCONTENT, "edge_of_flight_line"):
-            edge_of_flight_line = LAZCONTENT.edge_of_flight_line[neighbour_indices]
-            setattr(SPATIAL_RESAMPLE, "edge_of_flight_line", edge_of_flight_line)
-
-        if hasattr(LAZCONTENT, "classification"):
-            classification = LAZCONTENT.classification[neighbour_indices]
-            setattr(SPATIAL_RESAMPLE, "classification", classification)
-
-        if hasattr(LAZCONTENT, "scan_angle_rank"):
-            scan_angle_rank = LAZCONTENT.scan_angle_rank[neighbour_indices]
-            setattr(SPATIAL_RESAMPLE, "scan_angle_rank", scan_angle_rank)
-
-        if hasattr(LAZCONTENT, "user_data"):
-            user_data = LAZCONTENT.user_data[neighbour_indices]
-            setattr(SPATIAL_RESAMPLE, "user_data", user_data)
-
-        if hasattr(LAZCONTENT, "gps_time"):
-            gps_time = LAZCONTENT.gps_time[neighbour_indices]
-            setattr(SPATIAL_RESAMPLE, "gps_time", gps_time)
-
-        if hasattr(LAZCONTENT, "rgb"):
-            rgb = LAZCONTENT.rgb[neighbour_indices]
-            setattr(SPATIAL_RESAMPLE, "rgb", rgb)
-
-        if ExtraBytes_name:
-            number_attributes = len(EXTRA)
-            NP = lx
-            EXTRA_R = np.empty((number_attributes, NP), dtype=np.float32)
-            for i in range(number_attributes):
-                default = EXTRA[i][neighbour_indices]
-                default = np.reshape(default, (len(default),))
-                EXTRA_R[i] = default
-                setattr(SPATIAL_RESAMPLE, ExtraBytes_name[i], default)
-        setattr(SPATIAL_RESAMPLE, "ExtraBytes_name", ExtraBytes_name)
+OPTIONAL: EXTRA, ExtraBytes_name, selection - see Spatial_sample
 
-    # ESTIMATED TIME = 463s - 7 MIN
-    if useroption == "dist":
-        from scipy import stats
+OUTPUT: list with the output of Spatial_sample for every voxel size
 
-        binsx = np.arange(min(LAZCONTENT.x), max(LAZCONTENT.x), vs)
-        binsy = np.arange(min(LAZCONTENT.y), max(LAZCONTENT.y), vs)
-        binsz = np.arange(min(LAZCONTENT.z), max(LAZCONTENT.z), vs)
+The points are sorted once, at the finest voxel size, and every coarser level is derived from the
+finer one (numba_algorithms.voxel_pyramid). The finest level is the one of Spatial_sample. The
+coarser voxels are made of whole finer voxels, so compared with a separate Spatial_sample run a
+point lying on a voxel edge may fall in the other voxel and the means may differ in the last bits.
+With selection="kdtree" a single KD-tree is built for all the levels.
 
-        # BinnedStatisticResult: statistic, bin_edges, binnumber
-        resx = stats.binned_statistic(LAZCONTENT.x, None, "count", binsx)
-        resy = stats.binned_statistic(LAZCONTENT.y, None, "count", binsy)
-        resz = stats.binned_statistic(LAZCONTENT.z, None, "count", binsz)
+REQUIREMENTS: Numba and pykdtree
 
-        idx = resx.binnumber - 1
-        nx = len(binsx)
-        idy = resy.binnumber - 1
-        ny = len(binsy)
-        idz = resz.binnumber - 1
-        nz = len(binsz)
+"""
 
-        # CREATE GRID CELL
-        idgrid = idx + (idy * nx) + (idz * nx * ny)
-        _, unique_indices, unique_counts = np.unique(
-            idgrid, return_index=True, return_counts=True
-        )
-        P = unique_indices[unique_counts > pts_min]
 
-        class SPATIAL_RESAMPLE:
-            pass
+def Spatial_sample_pyramid(
+    LAZCONTENT, useroption, pts_min, voxel_sizes, EXTRA=None, ExtraBytes_name=[], selection="kdtree"
+):
+    import time
+    import numpy as np
+    import numba_algorithms as na
+    from pykdtree.kdtree import KDTree
+    from PointCloud import PointCloud
+
+    if useroption not in ("neighbour", "mean", "dist"):
+        raise ValueError(f'Unknown useroption {useroption}, use "neighbour", "mean" or "dist"')
+    if selection not in ("voxel", "kdtree"):
+        raise ValueError(f'Unknown selection {selection}, use "kdtree" or "voxel"')
 
-        x = LAZCONTENT.x[P]
-        y = LAZCONTENT.y[P]
-        z = LAZCONTENT.z[P]
-        setattr(SPATIAL_RESAMPLE, "x", x)
-        setattr(SPATIAL_RESAMPLE, "y", y)
-        setattr(SPATIAL_RESAMPLE, "z", z)
-
-        if hasattr(LAZCONTENT, "return_number") == True:
-            rn = LAZCONTENT.return_number[P]
-            setattr(SPATIAL_RESAMPLE, "return_number", rn)
-        if hasattr(LAZCONTENT, "number_of_returns") == True:
-            nr = LAZCONTENT.number_of_returns[P]
-            setattr(SPATIAL_RESAMPLE, "number_of_returns", nr)
-        if hasattr(LAZCONTENT, "intensity") == True:
-            intensity = LAZCONTENT.intensity[P]
-            setattr(SPATIAL_RESAMPLE, "intensity", intensity)
-        if hasattr(LAZCONTENT, "Amplitude") == True:
-            intensity = LAZCONTENT.Amplitude[P]
-            setattr(SPATIAL_RESAMPLE, "intensity", intensity)
-        if hasattr(LAZCONTENT, "scan_direction_flag") == True:
-            scan_direction_flag = LAZCONTENT.scan_direction_flag[P]
-            setattr(SPATIAL_RESAMPLE, "scan_direction_flag", scan_direction_flag)
-        if hasattr(LAZCONTENT, "edge_of_flight_line") == True:
-            edge_of_flight_line = LAZCONTENT.edge_of_flight_line[P]
-            setattr(SPATIAL_RESAMPLE, "edge_of_flight_line", edge_of_flight_line)
-        if hasattr(LAZCONTENT, "classification") == True:
-            classification = LAZCONTENT.classification[P]
-            setattr(SPATIAL_RESAMPLE, "classification", classification)
-        if hasattr(LAZCONTENT, "scan_angle_rank") == True:
-            scan_angle_rank = LAZCONTENT.scan_angle_rank[P]
-            setattr(SPATIAL_RESAMPLE, "scan_angle_rank", scan_angle_rank)
-        if hasattr(LAZCONTENT, "user_data") == True:
-            user_data = LAZCONTENT.user_data[P]
-            setattr(SPATIAL_RESAMPLE, "user_data", user_data)
-        if hasattr(LAZCONTENT, "gps_time") == True:
-            gps_time = LAZCONTENT.gps_time[P]
-            setattr(SPATIAL_RESAMPLE, "gps_time", gps_time)
-        if hasattr(LAZCONTENT, "rgb") == True:
-            rgb = LAZCONTENT.rgb[P]
-            setattr(SPATIAL_RESAMPLE, "rgb", rgb)
+    CLOUD = PointCloud.from_attributes(LAZCONTENT, EXTRA, ExtraBytes_name)
+    if hasattr(LAZCONTENT, "Amplitude"):
+        CLOUD.intensity = LAZCONTENT.Amplitude
+
+    # QUANTIZED CLOUDS ARE RESAMPLED ON FLOAT32 COORDINATES RELATIVE TO THEIR OFFSETS
+    if CLOUD.quantization is not None:
+        x, y, z, origin = CLOUD.local_xyz()
+    else:
+        x, y, z, origin = LAZCONTENT.x, LAZCONTENT.y, LAZCONTENT.z, None
+    ATRIBUTE = _voxel_attribute(LAZCONTENT, z)
 
+    LEVELS = []
+    tree = None
+    start = time.perf_counter()
+    for vs, level in zip(voxel_sizes, na.voxel_pyramid(x, y, z, ATRIBUTE, voxel_sizes)):
+        bins, unique_keys, counts, xyz_sums, att_sums, order, starts = level
+        valid, means, MeanReflec = na.voxel_means(counts, xyz_sums, att_sums, pts_min)
+
+        if useroption == "dist":
+            # FIRST POINT OF EVERY VOXEL WITH MORE THAN pts_min POINTS
+            indices = np.minimum.reduceat(order, starts)[valid]
+            SPATIAL_RESAMPLE = CLOUD.take(indices)
+        else:
+            if selection == "voxel":
+                indices = np.empty(len(means), dtype=np.int64)
+                na.voxel_nearest(
+                    order, starts, unique_keys, bins[0], bins[1], bins[2],
+                    x, y, z, means, np.flatnonzero(valid), indices,
+                )
+            else:
+                if tree is None:
+                    # Large leafsize since only one query is done per level
+                    tree = KDTree(np.vstack([x, y, z]).T, leafsize=256)
+                _, indices = tree.query(np.asarray(means, dtype=x.dtype), k=1)
+            DATA_MEAN = means if origin is None else means + origin
+            SPATIAL_RESAMPLE = _resample_output(
+                CLOUD, indices, useroption, ExtraBytes_name, MeanReflec, DATA_MEAN
+            )
+
+        print(f"Level vs={vs}: {len(indices)} points, took {time.perf_counter()-start:.2f} s")
+        start = time.perf_counter()
         if len(ExtraBytes_name) > 0:
-            number_attributes = len(EXTRA)
-            NP = len(x)
-            EXTRA_R = np.empty((number_attributes, NP), dtype=np.float32)
-            for i in range(number_attributes):
-                default = EXTRA[i]
-                default = default[P]
-                EXTRA_R[i] = default
-                setattr(SPATIAL_RESAMPLE, ExtraBytes_name[i], default)
-        setattr(SPATIAL_RESAMPLE, "ExtraBytes_name", ExtraBytes_name)
+            LEVELS.append((SPATIAL_RESAMPLE, SPATIAL_RESAMPLE.extra))
+        else:
+            LEVELS.append(SPATIAL_RESAMPLE)
+    return LEVELS
 
-    if len(ExtraBytes_name) > 0:
-        return SPATIAL_RESAMPLE, EXTRA_R
 
-    if len(ExtraBytes_name) == 0:
-        return SPATIAL_RESAMPLE
+"""
+PROCESSING: OUT-OF-CORE SPATIAL RESAMPLE - Spatial_sample (npoints=1) FOR FILES LARGER THAN THE MEMORY
+
+MANDATORY: inputLas, outputLas, offsets (of the output file, as WriteLaz), useroption, pts_min, vs
+           E.G: Processing.Spatial_sample_out_of_core(inputLas, outputLas, offsets, "neighbour", 1, 0.1)
+
+OPTIONAL: ExtraBytes_name - extra bytes written to the output, in this order (default: the ones of the file)
+          fields - standard fields read and written (default: all of them)
+          tile_size - side of the XY tiles [m], rounded to whole voxels
+          chunk_points - number of points read at a time
+          scratch - path of the temporary tile store (default: outputLas + ".tiles.pcstore"),
+                    removed at the end
+          n_threads - threads of the LAZ decompression/compression and of numba
+          selection - see Spatial_sample
+
+The voxel grid is built from the bounds of the file header, so no pass is needed to find them.
+Pass 1 streams the file (ReadLaz.iter_chunks) and appends every chunk, sorted by XY tile of
+whole voxels, to a raw PointStore. Pass 2 reads one tile at a time from the memory-mapped store,
+with the voxels of the neighbouring tiles within 2 voxels, resamples it like Spatial_sample and
+writes its points with WriteLaz.open_writer. The memory used is set by chunk_points and
+tile_size, not by the size of the plot. Same points as Spatial_sample (up to equal distances),
+written tile by tile.
+
+REQUIREMENTS: Numba, pykdtree and laspy
+
+"""
+
+
+def Spatial_sample_out_of_core(
+    inputLas, outputLas, offsets, useroption, pts_min, vs, ExtraBytes_name=None, fields=None,
+    tile_size=20.0, chunk_points=10_000_000, scratch=None, n_threads=1, selection="kdtree",
+):
+    import numba_algorithms as na
+
+    with na.num_threads(n_threads):
+        _spatial_sample_out_of_core(
+            inputLas, outputLas, offsets, useroption, pts_min, vs, ExtraBytes_name, fields,
+            tile_size, chunk_points, scratch, n_threads, selection,
+        )
+
+
+def _spatial_sample_out_of_core(
+    inputLas, outputLas, offsets, useroption, pts_min, vs, ExtraBytes_name, fields,
+    tile_size, chunk_points, scratch, n_threads, selection,
+):
+    import json
+    import shutil
+    import time
+    import numpy as np
+    import numba_algorithms as na
+    import Catalog
+    import PointStore
+    import ReadLaz
+    import WriteLaz
+
+    if useroption not in ("neighbour", "mean", "dist"):
+        raise ValueError(f'Unknown useroption {useroption}, use "neighbour", "mean" or "dist"')
+    if selection not in ("voxel", "kdtree"):
+        raise ValueError(f'Unknown selection {selection}, use "kdtree" or "voxel"')
+    if scratch is None:
+        scratch = str(outputLas).rstrip("/\\") + ".tiles" + PointStore.STORE_SUFFIX
+    offsets = np.asarray(offsets, dtype=np.float32)
+    start = time.perf_counter()
+
+    # VOXEL GRID OF THE WHOLE PLOT FROM THE HEADER BOUNDS
+    header = Catalog.scan_header(inputLas)
+    mins = np.array([header["min_x"], header["min_y"], header["min_z"]], dtype=np.float64)
+    maxs = np.array([header["max_x"], header["max_y"], header["max_z"]], dtype=np.float64)
+    if ExtraBytes_name is None:
+        ExtraBytes_name = json.loads(header["extra_bytes"])
+    bins = [na.voxel_bins(mins[k], maxs[k], vs) for k in range(3)]
+    nx, ny = max(len(bins[0]), 1), max(len(bins[1]), 1)
+    tile = max(1, int(round(tile_size / vs)))
+    ntx, nty = -(-nx // tile), -(-ny // tile)
+
+    def voxel_keys(x, y, z):
+        index = [na.voxel_index(values, mins[k], vs, bins[k]) for k, values in enumerate((x, y, z))]
+        return index[0] + index[1] * nx + index[2] * (nx * ny)
+
+    # PASS 1 - EVERY CHUNK SORTED BY TILE, ranges[c, t]:ranges[c, t + 1] ARE ITS POINTS OF TILE t
+    read_fields = None
+    if fields is not None:
+        read_fields = list(fields) + list(ExtraBytes_name)
+    ranges = []
+    npoints = 0
+    with PointStore.StoreWriter(scratch, [0, 0, 0], ExtraBytes_name) as bucket:
+        for chunk in ReadLaz.iter_chunks(inputLas, chunk_points, n_threads, fields=read_fields):
+            for k, name in enumerate("xyz"):
+                values = getattr(chunk, name)
+                if len(values) > 0 and (values.min() < mins[k] or values.max() > maxs[k]):
+                    raise ValueError(f"The points of {inputLas} are outside the bounds of its header")
+            keys = voxel_keys(chunk.x, chunk.y, chunk.z)
+            order, starts = na.voxel_tiles(keys, nx, ny, tile, tile)
+            chunk = chunk.take(order)
+            bucket.write_chunk(chunk, [getattr(chunk, name) for name in ExtraBytes_name])
+            ranges.append(npoints + starts)
+            npoints += len(order)
+    ranges = np.array(ranges, dtype=np.int64).reshape(-1, ntx * nty + 1)
+    print(f"Pass 1: {npoints} points in {ntx * nty} tiles, took {time.perf_counter()-start:.2f} s")
+
+    # PASS 2 - ONE TILE AT A TIME
+    start = time.perf_counter()
+    STORE = PointStore.read_store(scratch, read_fields)
+    halo = 0 if useroption == "dist" else 2
+    try:
+        with WriteLaz.open_writer(outputLas, offsets, ExtraBytes_name, n_threads) as writer:
+            for t in range(ntx * nty):
+                if not np.any(ranges[:, t + 1] > ranges[:, t]):
+                    continue
+                tix, tiy = t % ntx, t // ntx
+                neighbours = [
+                    a + b * ntx
+                    for b in range(max(tiy - 1, 0), min(tiy + 1, nty - 1) + 1)
+                    for a in range(max(tix - 1, 0), min(tix + 1, ntx - 1) + 1)
+                    if halo > 0 or a + b * ntx == t
+                ]
+                points = np.sort(np.concatenate([
+                    np.arange(ranges[c, s], ranges[c, s + 1]) for s in neighbours for c in range(len(ranges))
+                ]))
+                # ONLY x, y, z OF THE 3 x 3 BLOCK ARE READ TO FIND THE POINTS NEAR THE TILE
+                keys = voxel_keys(STORE.x[points], STORE.y[points], STORE.z[points])
+                ix, iy = keys % nx, (keys // nx) % ny
+                near = (
+                    (ix >= tix * tile - halo) & (ix < (tix + 1) * tile + halo)
+                    & (iy >= tiy * tile - halo) & (iy < (tiy + 1) * tile + halo)
+                )
+                TILE, keys = STORE.take(points[near]), keys[near]
+                if hasattr(TILE, "Amplitude"):
+                    TILE.intensity = TILE.Amplitude
+
+                unique_keys, chosen, means, MeanReflec = _resample_voxels(
+                    keys, bins, TILE.x, TILE.y, TILE.z, _voxel_attribute(TILE, TILE.z),
+                    pts_min, useroption, selection,
+                )
+                # ONLY THE VOXELS OF THE TILE, THE OTHERS BELONG TO THE NEIGHBOURING TILES
+                inside = na.voxel_tile(unique_keys, nx, ny, tile, tile) == t
+                RESAMPLE = TILE.take(chosen[inside])
+                EXTRA = np.array([getattr(RESAMPLE, name) for name in ExtraBytes_name], dtype=np.float32)
+                if useroption != "dist":
+                    for k in range(len(ExtraBytes_name)):
+                        if ExtraBytes_name[k] == "Reflectance":
+                            ROW = np.empty(len(TILE), dtype=np.float32)
+                            ROW[chosen[inside]] = MeanReflec[inside]
+                            EXTRA[k] = ROW[chosen[inside]]
+                    if useroption == "mean":
+                        RESAMPLE.x = means[inside, 0]
+                        RESAMPLE.y = means[inside, 1]
+                        RESAMPLE.z = means[inside, 2]
+
+                RESAMPLE.x = RESAMPLE.x - offsets[0]
+                RESAMPLE.y = RESAMPLE.y - offsets[1]
+                RESAMPLE.z = RESAMPLE.z - offsets[2]
+                writer.write_chunk(RESAMPLE, EXTRA)
+    finally:
+        del STORE
+        shutil.rmtree(scratch, ignore_errors=True)
+    print(f"Pass 2: tiles resampled, took {time.perf_counter()-start:.2f} s")
 
 
 """ 
@@ -455,164 +612,121 @@ PROCESSING: RECTIFY OBLIQUE POINT CLOUD FOR A NORMALIZED LOCAL SYSTEMS ALIGN TO
 
 INPUT: COORDINATES (LAZCONTENT.x, LAZCONTENT.y, LAZCONTENT.z) AND TRANSFORMATION PARAMETERS (Class)
         Transformation is a class that contains the rigid body transformation (rotation in degrees and translation in meters) to normalize the point cloud
+OPTIONAL: block_points - number of points rotated by each matrix product
 
 OUTPUT: RECTIFIED COORDINATES
 
 """
 
 
-def RectifLaz(x, y, z, transformation):
-    import math
-    import numpy as np
+def RectifLaz(x, y, z, transformation, block_points=1_000_000):
+    Rot, T = RECTIFY_MATRIX(transformation)
+    return _apply_rectify(x, y, z, Rot, T, block_points)
 
-    w = transformation.w * math.pi / 180
-    fi = transformation.fi * math.pi / 180
-    k = transformation.k * math.pi / 180
 
-    aX = transformation.x
-    aY = transformation.y
-    aZ = transformation.z
-
-    Rotfi = np.empty((3, 3), dtype="float32")
-    Rotfi[0, 0] = math.cos(fi)
-    Rotfi[0, 1] = 0
-    Rotfi[0, 2] = math.sin(fi)
-    Rotfi[1, 0] = 0
-    Rotfi[1, 1] = 1
-    Rotfi[1, 2] = 0
-    Rotfi[2, 0] = -math.sin(fi)
-    Rotfi[2, 1] = 0
-    Rotfi[2, 2] = math.cos(fi)
-
-    Rotw = np.empty((3, 3), dtype="float32")
-    Rotw[0, 0] = 1
-    Rotw[0, 1] = 0
-    Rotw[0, 2] = 0
-    Rotw[1, 0] = 0
-    Rotw[1, 1] = math.cos(w)
-    Rotw[1, 2] = -math.sin(w)
-    Rotw[2, 0] = 0
-    Rotw[2, 1] = math.sin(w)
-    Rotw[2, 2] = math.cos(w)
-
-    Rotk = np.empty((3, 3), dtype="float32")
-    Rotk[0, 0] = math.cos(k)
-    Rotk[0, 1] = -math.sin(k)
-    Rotk[0, 2] = 0
-    Rotk[1, 0] = math.sin(k)
-    Rotk[1, 1] = math.cos(k)
-    Rotk[1, 2] = 0
-    Rotk[2, 0] = 0
-    Rotk[2, 1] = 0
-    Rotk[2, 2] = 1
-
-    x1 = []
-    y1 = []
-    z1 = []
-
-    for X in zip(x, y, z):
-        # PASSIVE ROTATION
-        X = Rotw.dot(X)
-        X = Rotfi.dot(X)
-        X = Rotk.dot(X)
-        # ADD TRANSLATION TO AVOID NEGATIVE VALUES
-        x1.append(X[0] + aX)
-        y1.append(X[1] + aY)
-        z1.append(X[2] + aZ)
+def _apply_rectify(x, y, z, Rot, T, block_points=1_000_000):
+    import numpy as np
 
-    x1 = np.array(x1, dtype=np.float64)
-    y1 = np.array(y1, dtype=np.float64)
-    z1 = np.array(z1, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+    x1 = np.empty(len(x), dtype=np.float64)
+    y1 = np.empty(len(x), dtype=np.float64)
+    z1 = np.empty(len(x), dtype=np.float64)
+
+    # ONE MATMUL PER BLOCK OF POINTS, THE BLOCK KEEPS THE TEMPORARY (3, N) ARRAY SMALL
+    for start in range(0, len(x), block_points):
+        B = slice(start, start + block_points)
+        X = Rot @ np.vstack((x[B], y[B], z[B]))
+        # ADD TRANSLATION TO AVOID NEGATIVE VALUES
+        np.add(X[0], T[0], out=x1[B])
+        np.add(X[1], T[1], out=y1[B])
+        np.add(X[2], T[2], out=z1[B])
 
     return x1, y1, z1
 
 
-def _run_in_parallel(params):
-    xyz, Rotw, Rotfi, Rotk, aX, aY, aZ = params
-    x1 = []
-    y1 = []
-    z1 = []
-    for X in xyz:
-        # PASSIVE ROTATION
-        X = Rotw.dot(X)
-        X = Rotfi.dot(X)
-        X = Rotk.dot(X)
-        # ADD TRANSLATION TO AVOID NEGATIVE VALUES
-        x1.append(X[0] + aX)
-        y1.append(X[1] + aY)
-        z1.append(X[2] + aZ)
-    return x1, y1, z1
+"""
+ROTATION AND TRANSLATION OF RectifLaz
+
+The three passive rotations (Rw first, then Rfi, then Rk) are composed once in float64,
+so every point is transformed by a single matrix: X1 = Rk.Rfi.Rw.X + [x, y, z]
+
+OUTPUT: Rot (3, 3) and T (3,)
+"""
+
 
-def rectify_point_cloud_parallel(x, y, z, transformation, num_cores=1):
+def RECTIFY_MATRIX(transformation):
     import math
     import numpy as np
-    from multiprocessing import Pool
-    from itertools import chain
 
     w = transformation.w * math.pi / 180
     fi = transformation.fi * math.pi / 180
     k = transformation.k * math.pi / 180
 
-    aX = transformation.x
-    aY = transformation.y
-    aZ = transformation.z
-
-    Rotfi = np.empty((3, 3), dtype="float32")
-    Rotfi[0, 0] = math.cos(fi)
-    Rotfi[0, 1] = 0
-    Rotfi[0, 2] = math.sin(fi)
-    Rotfi[1, 0] = 0
-    Rotfi[1, 1] = 1
-    Rotfi[1, 2] = 0
-    Rotfi[2, 0] = -math.sin(fi)
-    Rotfi[2, 1] = 0
-    Rotfi[2, 2] = math.cos(fi)
-
-    Rotw = np.empty((3, 3), dtype="float32")
-    Rotw[0, 0] = 1
-    Rotw[0, 1] = 0
-    Rotw[0, 2] = 0
-    Rotw[1, 0] = 0
-    Rotw[1, 1] = math.cos(w)
-    Rotw[1, 2] = -math.sin(w)
-    Rotw[2, 0] = 0
-    Rotw[2, 1] = math.sin(w)
-    Rotw[2, 2] = math.cos(w)
-
-    Rotk = np.empty((3, 3), dtype="float32")
-    Rotk[0, 0] = math.cos(k)
-    Rotk[0, 1] = -math.sin(k)
-    Rotk[0, 2] = 0
-    Rotk[1, 0] = math.sin(k)
-    Rotk[1, 1] = math.cos(k)
-    Rotk[1, 2] = 0
-    Rotk[2, 0] = 0
-    Rotk[2, 1] = 0
-    Rotk[2, 2] = 1
-
-    coordinates = list(zip(x, y, z))
-    coordinates = np.array_split(coordinates, num_cores)
-
-    aX_params = [aX] * len(coordinates)
-    aY_params = [aY] * len(coordinates)
-    aZ_params = [aZ] * len(coordinates)
-    Rotw_params = [Rotw] * len(coordinates)
-    Rotfi_params = [Rotfi] * len(coordinates)
-    Rotk_params = [Rotk] * len(coordinates)
-
-    call_args = zip(coordinates, Rotw_params, Rotfi_params, Rotk_params, aX_params, aY_params, aZ_params)
-
-    pool = Pool(num_cores)
-    results = pool.map(_run_in_parallel, call_args)
-    pool.close()
-    x1 = list(chain(*[t[0] for t in results]))
-    x1 = np.array(x1, dtype=np.float64)
-
-    y1 = list(chain(*[t[1] for t in results]))
-    y1 = np.array(y1, dtype=np.float64)
-
-    z1 = list(chain(*[t[2] for t in results]))
-    z1 = np.array(z1, dtype=np.float64)
+    Rotw = np.array(
+        [[1, 0, 0], [0, math.cos(w), -math.sin(w)], [0, math.sin(w), math.cos(w)]]
+    )
+    Rotfi = np.array(
+        [[math.cos(fi), 0, math.sin(fi)], [0, 1, 0], [-math.sin(fi), 0, math.cos(fi)]]
+    )
+    Rotk = np.array(
+        [[math.cos(k), -math.sin(k), 0], [math.sin(k), math.cos(k), 0], [0, 0, 1]]
+    )
+
+    Rot = Rotk @ Rotfi @ Rotw
+    T = np.array([transformation.x, transformation.y, transformation.z], dtype=np.float64)
+    return Rot, T
+
+
+"""
+PARALLEL RectifLaz - SAME INPUT AND OUTPUT
+
+The points are transformed by numba threads (numba_algorithms.rigid_transform), each thread
+on its own slice of the arrays, so no point is copied or sent to another process.
+
+OPTIONAL: num_cores - number of threads
+          in_place - write the result into x, y, z instead of new arrays, they must be writeable
+                     C-contiguous float64 arrays (TypeError otherwise)
+          E.G: x1, y1, z1 = Processing.rectify_point_cloud_parallel(x, y, z, transformation, int(config["cores"]))
+"""
+
+
+def rectify_point_cloud_parallel(x, y, z, transformation, num_cores=1, in_place=False):
+    Rot, T = RECTIFY_MATRIX(transformation)
+    return apply_affine(x, y, z, Rot, T, num_cores, in_place)
+
+
+"""
+AFFINE TRANSFORMATION X1 = Rot.X + T OF EVERY POINT WITH THE NUMBA THREADS
+
+Used by rectify_point_cloud_parallel, HELMERT3D and TransformChain.
+"""
+
+
+def apply_affine(x, y, z, Rot, T, num_cores=1, in_place=False):
+    import numpy as np
+    import numba_algorithms as na
+
+    if in_place:
+        # ANY CONVERSION WOULD WRITE INTO A COPY AND LEAVE THE CALLER'S ARRAYS UNCHANGED
+        for values in (x, y, z):
+            if not (
+                isinstance(values, np.ndarray) and values.dtype == np.float64
+                and values.flags.c_contiguous and values.flags.writeable
+            ):
+                raise TypeError("in_place needs x, y, z as writeable C-contiguous float64 arrays")
+        x1, y1, z1 = x, y, z
+    else:
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        z = np.asarray(z, dtype=np.float64)
+        x1, y1, z1 = np.empty_like(x), np.empty_like(y), np.empty_like(z)
+
+    Rot = np.ascontiguousarray(Rot, dtype=np.float64)
+    T = np.ascontiguousarray(T, dtype=np.float64)
+    with na.num_threads(num_cores):
+        na.rigid_transform(x, y, z, Rot, T, x1, y1, z1)
 
     return x1, y1, z1
 
@@ -630,108 +744,59 @@ OUTPUT:X, Y, Z at ETRS89-TM35FIN reference system
 """
 
 
-def HELMERT3D(LAZCONTENT, MatchPoints):
-    import numpy as np
+def HELMERT3D(LAZCONTENT, MatchPoints, num_cores=1, in_place=False, parameters_file=None):
+    AFIM_I, T = HELMERT3D_PARAMETERS(MatchPoints, parameters_file)
+
+    # 3D-TRANSFORMATION ISO: X1 = AFIM_I.(X - T) = AFIM_I.X - AFIM_I.T
+    print("RUNNING CLOUD TRANSFORMATION")
+    return apply_affine(
+        LAZCONTENT.x, LAZCONTENT.y, LAZCONTENT.z, AFIM_I, -AFIM_I.dot(T), num_cores, in_place
+    )
 
-    Lb = MatchPoints[
-        0
-    ]  # NP.ARRAY WITH THE lOCAL POINT COORDINATES MASURED IN THE POINT CLOUD
-    Ref = MatchPoints[1]  # NP.ARRAY WITH THE POINT COORDINATES IN THE REFERENCE SYSTEM
-
-    # BUNDLE ADJUSTMENT PARAMETERS
-    n = int(len(MatchPoints[0]) / 3)
-    Ne = n * 3
-    A = np.zeros((Ne, 12), dtype=float)
-    i = 0
-    AFIM = np.zeros((3, 3), dtype=float)
-
-    for k in range(n):
-        A[i][0] = Ref[i]
-        A[i][1] = Ref[i + 1]
-        A[i][2] = Ref[i + 2]
-        A[i][3] = 0
-        A[i][4] = 0
-        A[i][5] = 0
-        A[i][6] = 0
-        A[i][7] = 0
-        A[i][8] = 0
-        A[i][9] = 1
-        A[i][10] = 0
-        A[i][11] = 0
-        # TRANSLATION
-        j = i + 1
-        A[j][0] = 0
-        A[j][1] = 0
-        A[j][2] = 0
-        A[j][3] = Ref[i]
-        A[j][4] = Ref[i + 1]
-        A[j][5] = Ref[i + 2]
-        A[j][6] = 0
-        A[j][7] = 0
-        A[j][8] = 0
-        A[j][9] = 0
-        A[j][10] = 1
-        A[j][11] = 0
-        # TRANSLATION
-        j = j + 1
-        A[j][0] = 0
-        A[j][1] = 0
-        A[j][2] = 0
-        A[j][3] = 0
-        A[j][4] = 0
-        A[j][5] = 0
-        A[j][6] = Ref[i]
-        A[j][7] = Ref[i + 1]
-        A[j][8] = Ref[i + 2]
-        A[j][9] = 0
-        A[j][10] = 0
-        A[j][11] = 1
-        # TRANSLATION
-        i = i + 3
-
-    N = np.transpose(A).dot(A)
-    U = np.transpose(A).dot(Lb)
-    NI = np.linalg.inv(N)
-    X = NI.dot(U)
-
-    # Point Cloud
-    # a=X[0]; b=X[1]; c=X[2]; d=X[3]; e=X[4]; f=X[5]; g=X[6]; h=X[7]; i=X[8];
-    AFIM[0][0] = X[0]
-    AFIM[0][1] = X[1]
-    AFIM[0][2] = X[2]
-
-    AFIM[1][0] = X[3]
-    AFIM[1][1] = X[4]
-    AFIM[1][2] = X[5]
-
-    AFIM[2][0] = X[6]
-    AFIM[2][1] = X[7]
-    AFIM[2][2] = X[8]
 
-    AFIM_I = np.linalg.inv(AFIM)
-    print("DONE - ISOGONAL PARAMETERS ESTIMATION")
+"""
+HELMERT3D PARAMETERS ONLY - THE TRANSFORMATION APPLIED BY HELMERT3D IS X1 = AFIM_I.(X - T)
 
-    x1 = []
-    y1 = []
-    z1 = []
-    # 3D-TRANSFORMATION ISO
-    x = LAZCONTENT.x - X[9]
-    y = LAZCONTENT.y - X[10]
-    z = LAZCONTENT.z - X[11]
+INPUT: MATCH POINTS OR CONTROL POINTS IN BOTH CLOUDS (SAME AS HELMERT3D)
+OPTIONAL: parameters_file - .npz cache of the parameters, reused while the match points are the same
+OUTPUT: AFIM_I (3, 3), T (3,)
+"""
 
-    print("RUNNING CLOUD TRANSFORMATION")
-    for P in zip(x, y, z):
-        ##3D TRANSFORMATION
-        P_fid = AFIM_I.dot(P)
-        x1.append(P_fid[0])
-        y1.append(P_fid[1])
-        z1.append(P_fid[2])
 
-    x1 = np.array(x1, dtype=np.float64)
-    y1 = np.array(y1, dtype=np.float64)
-    z1 = np.array(z1, dtype=np.float64)
+def HELMERT3D_PARAMETERS(MatchPoints, parameters_file=None):
+    import os
+    import numpy as np
+
+    MatchPoints = np.asarray(MatchPoints)
+    if parameters_file is not None and os.path.exists(parameters_file):
+        with np.load(parameters_file) as cache:
+            if np.array_equal(cache["MatchPoints"], MatchPoints):
+                print("HELMERT3D PARAMETERS READ FROM", parameters_file)
+                return cache["AFIM_I"], cache["T"]
+
+    Lb = MatchPoints[0].astype(np.float64)  # lOCAL POINT COORDINATES MASURED IN THE POINT CLOUD
+    Ref = MatchPoints[1].astype(np.float64).reshape(-1, 3)  # COORDINATES IN THE REFERENCE SYSTEM
+
+    # DESIGN MATRIX: 3 ROWS PER POINT, Lb = AFIM.(Ref - center) + T + AFIM.center
+    # PARAMETERS: AFIM ROW BY ROW (0-8) AND THE TRANSLATION (9-11)
+    # THE CENTRED REFERENCE COORDINATES KEEP THE SOLVE ACCURATE WITH GLOBAL COORDINATES
+    n = len(Ref)
+    center = Ref.mean(axis=0)
+    A = np.zeros((n, 3, 12), dtype=float)
+    for r in range(3):
+        A[:, r, 3 * r : 3 * r + 3] = Ref - center
+        A[:, r, 9 + r] = 1
+    X = np.linalg.lstsq(A.reshape(3 * n, 12), Lb, rcond=None)[0]
+
+    AFIM = X[0:9].reshape(3, 3)
+    AFIM_I = np.linalg.inv(AFIM)
+    T = X[9:12] - AFIM.dot(center)
+    print("DONE - ISOGONAL PARAMETERS ESTIMATION")
 
-    return x1, y1, z1
+    if parameters_file is not None:
+        np.savez(parameters_file, AFIM_I=AFIM_I, T=T, MatchPoints=MatchPoints)
+
+    return AFIM_I, T
 
 
 """ 
@@ -841,6 +906,7 @@ def ClippingTree(
 ):
     import numpy as np
     from matplotlib.path import Path
+    from PointCloud import PointCloud
     from scipy.spatial import Voronoi
 
     # CHECKING USER OPTIONS
@@ -852,7 +918,13 @@ def ClippingTree(
     ):
         print("Please informe a valid clipping option")
 
-    if (len(BOX_COORD) > 0) and (len(BOX_ANGLES) == 0):
+    # QUANTIZED CLOUDS ARE CLIPPED ON THEIR INTEGER GRID, WITHOUT DECODING X, Y, Z
+    quantized = getattr(LAZCONTENT, "quantization", None) is not None
+
+    if (len(BOX_COORD) > 0) and (len(BOX_ANGLES) == 0) and quantized:
+        P = np.flatnonzero(LAZCONTENT.box_mask(BOX_COORD[0:3], BOX_COORD[3:6]))
+
+    if (len(BOX_COORD) > 0) and (len(BOX_ANGLES) == 0) and not quantized:
         P = np.where(
             (LAZCONTENT.x > BOX_COORD[0])
             & (LAZCONTENT.y > BOX_COORD[1])
@@ -875,13 +947,19 @@ def ClippingTree(
         P = np.array(P[:][0])
 
     if (len(BOX_COORD) > 0) and (len(BOX_ANGLES) > 0):
+        if quantized:
+            INSIDE = LAZCONTENT.box_mask(BOX_COORD[0:3], BOX_COORD[3:6])
+        else:
+            INSIDE = (
+                (LAZCONTENT.x > BOX_COORD[0])
+                & (LAZCONTENT.y > BOX_COORD[1])
+                & (LAZCONTENT.z > BOX_COORD[2])
+                & (LAZCONTENT.x < BOX_COORD[3])
+                & (LAZCONTENT.y < BOX_COORD[4])
+                & (LAZCONTENT.z < BOX_COORD[5])
+            )
         P = np.where(
-            (LAZCONTENT.x > BOX_COORD[0])
-            & (LAZCONTENT.y > BOX_COORD[1])
-            & (LAZCONTENT.z > BOX_COORD[2])
-            & (LAZCONTENT.x < BOX_COORD[3])
-            & (LAZCONTENT.y < BOX_COORD[4])
-            & (LAZCONTENT.z < BOX_COORD[5])
+            INSIDE
             & (LAZCONTENT.Theta > BOX_ANGLES[0])
             & (LAZCONTENT.Phi > BOX_ANGLES[1])
             & (LAZCONTENT.Range > BOX_ANGLES[2])
@@ -892,9 +970,12 @@ def ClippingTree(
         P = np.array(P[:][0])
 
     if (len(BOX_COORD) == 0) and (len(BOX_ANGLES) == 0) and (len(CYLINDER) > 0):
-        Dx = LAZCONTENT.x - CYLINDER[0]
-        Dy = LAZCONTENT.y - CYLINDER[1]
-        Dz = LAZCONTENT.z - CYLINDER[2]
+        if quantized:
+            Dx, Dy, Dz, _ = LAZCONTENT.local_xyz(CYLINDER[0:3])
+        else:
+            Dx = LAZCONTENT.x - CYLINDER[0]
+            Dy = LAZCONTENT.y - CYLINDER[1]
+            Dz = LAZCONTENT.z - CYLINDER[2]
         DIST = np.sqrt((Dx * Dx) + (Dy * Dy))
         P = np.where((DIST < CYLINDER[3]) & (Dz < 50))
         P = np.array(P[:][0])
@@ -942,10 +1023,13 @@ def ClippingTree(
         # tree in trees, has the voronoi cell of the first element of polygon etc.
         del i, x, y, xvalues, yvalues, xref, yref, if_edge
 
+        if quantized:
+            x, y, _, origin = LAZCONTENT.local_xyz()
+        else:
+            x, y, origin = LAZCONTENT.x.flatten(), LAZCONTENT.y.flatten(), np.zeros(3)
+        points = np.vstack((x, y)).T
         for i in range(len(polygon)):
-            p = Path(polygon[i])
-            x, y = LAZCONTENT.x.flatten(), LAZCONTENT.y.flatten()
-            points = np.vstack((x, y)).T
+            p = Path(polygon[i] - origin[0:2])
             grid = p.contains_points(points)
             P.append(grid)
             Tree_Name.append(VORONOI[0][i, 2])
@@ -954,65 +1038,15 @@ def ClippingTree(
         Tree_Name = np.array(Tree_Name)
 
     # SAVING TREE POINT CLOUD
-    if len(VORONOI) == 0:
-
-        class TREE:
-            pass
-
-        x = LAZCONTENT.x[P]
-        setattr(TREE, "x", x)
-        y = LAZCONTENT.y[P]
-        setattr(TREE, "y", y)
-        z = LAZCONTENT.z[P]
-        setattr(TREE, "z", z)
-
-        if hasattr(LAZCONTENT, "return_number"):
-            rn = LAZCONTENT.return_number[P]
-            setattr(TREE, "return_number", rn)
-        if hasattr(LAZCONTENT, "number_of_returns"):
-            nr = LAZCONTENT.number_of_returns[P]
-            setattr(TREE, "number_of_returns", nr)
-        if hasattr(LAZCONTENT, "intensity"):
-            intensity = LAZCONTENT.intensity[P]
-            setattr(TREE, "intensity", intensity)
-        if hasattr(LAZCONTENT, "Amplitude"):
-            intensity = LAZCONTENT.Amplitude[P]
-            setattr(TREE, "intensity", intensity)
-        if hasattr(LAZCONTENT, "scan_direction_flag"):
-            scan_direction_flag = LAZCONTENT.scan_direction_flag[P]
-            setattr(TREE, "scan_direction_flag", scan_direction_flag)
-        if hasattr(LAZCONTENT, "edge_of_flight_line"):
-            edge_of_flight_line = LAZCONTENT.edge_of_flight_line[P]
-            setattr(TREE, "edge_of_flight_line", edge_of_flight_line)
-        if hasattr(LAZCONTENT, "classification"):
-            classification = LAZCONTENT.classification[P]
-            setattr(TREE, "classification", classification)
-        if hasattr(LAZCONTENT, "scan_angle_rank"):
-            scan_angle_rank = LAZCONTENT.scan_angle_rank[P]
-            setattr(TREE, "scan_angle_rank", scan_angle_rank)
-        if hasattr(LAZCONTENT, "user_data"):
-            user_data = LAZCONTENT.user_data[P]
-            setattr(TREE, "user_data", user_data)
-        if hasattr(LAZCONTENT, "gps_time"):
-            gps_time = LAZCONTENT.gps_time[P]
-            setattr(TREE, "gps_time", gps_time)
-        if hasattr(LAZCONTENT, "rgb"):
-            rgb = LAZCONTENT.rgb[P]
-            setattr(TREE, "rgb", rgb)
+    CLOUD = PointCloud.from_attributes(LAZCONTENT, Extra, ExtraBytes_name)
+    if hasattr(LAZCONTENT, "Amplitude"):
+        CLOUD.intensity = LAZCONTENT.Amplitude
 
-        if len(ExtraBytes_name) > 0:
-            number_attributes = len(Extra)
-            NP = len(x)
-            EXTRA_TREE = np.empty((number_attributes, NP), dtype=np.float32)
-            for i in range(number_attributes):
-                default = Extra[i]
-                default = default[P]
-                EXTRA_TREE[i] = default
-                setattr(TREE, ExtraBytes_name[i], default)
-            setattr(TREE, "ExtraBytes_name", ExtraBytes_name)
+    if len(VORONOI) == 0:
+        TREE = CLOUD.take(P)
 
         if len(ExtraBytes_name) > 0:
-            return TREE, EXTRA_TREE
+            return TREE, TREE.extra
         else:
             return TREE
 
@@ -1022,66 +1056,12 @@ def ClippingTree(
         j = 0
 
         for PP in P:
-
-            class TREE:
-                pass
-
-            x = LAZCONTENT.x[PP]
-            setattr(TREE, "x", x)
-            y = LAZCONTENT.y[PP]
-            setattr(TREE, "y", y)
-            z = LAZCONTENT.z[PP]
-            setattr(TREE, "z", z)
-            setattr(TREE, "name", Tree_Name[j])  # Tree_Name is not defined in all cases, be carefull 
+            TREE = CLOUD.mask(PP)
+            TREE.name = Tree_Name[j]  # Tree_Name is not defined in all cases, be carefull 
             j = j + 1
 
-            if hasattr(LAZCONTENT, "return_number"):
-                rn = LAZCONTENT.return_number[PP]
-                setattr(TREE, "return_number", rn)
-            if hasattr(LAZCONTENT, "number_of_returns"):
-                nr = LAZCONTENT.number_of_returns[PP]
-                setattr(TREE, "number_of_returns", nr)
-            if hasattr(LAZCONTENT, "intensity"):
-                intensity = LAZCONTENT.intensity[PP]
-                setattr(TREE, "intensity", intensity)
-            if hasattr(LAZCONTENT, "Amplitude"):
-                intensity = LAZCONTENT.Amplitude[PP]
-                setattr(TREE, "intensity", intensity)
-            if hasattr(LAZCONTENT, "scan_direction_flag"):
-                scan_direction_flag = LAZCONTENT.scan_direction_flag[PP]
-                setattr(TREE, "scan_direction_flag", scan_direction_flag)
-            if hasattr(LAZCONTENT, "edge_of_flight_line"):
-                edge_of_flight_line = LAZCONTENT.edge_of_flight_line[PP]
-                setattr(TREE, "edge_of_flight_line", edge_of_flight_line)
-            if hasattr(LAZCONTENT, "classification"):
-                classification = LAZCONTENT.classification[PP]
-                setattr(TREE, "classification", classification)
-            if hasattr(LAZCONTENT, "scan_angle_rank"):
-                scan_angle_rank = LAZCONTENT.scan_angle_rank[PP]
-                setattr(TREE, "scan_angle_rank", scan_angle_rank)
-            if hasattr(LAZCONTENT, "user_data"):
-                user_data = LAZCONTENT.user_data[PP]
-                setattr(TREE, "user_data", user_data)
-            if hasattr(LAZCONTENT, "gps_time"):
-                gps_time = LAZCONTENT.gps_time[PP]
-                setattr(TREE, "gps_time", gps_time)
-            if hasattr(LAZCONTENT, "rgb"):
-                rgb = LAZCONTENT.rgb[PP]
-                setattr(TREE, "rgb", rgb)
-
             if len(ExtraBytes_name) > 0:
-                number_attributes = len(ExtraBytes_name)
-                NP = len(x)
-                EXTRA_TREE = np.empty((number_attributes, NP), dtype=np.float32)
-
-                for i in range(number_attributes):
-                    default = Extra[i]
-                    default = default[PP]
-                    EXTRA_TREE[i] = default
-                    setattr(TREE, ExtraBytes_name[i], default)
-
-                setattr(TREE, "ExtraBytes_name", ExtraBytes_name)
-                TREE_EXTRA_VORONOI.append(EXTRA_TREE)
+                TREE_EXTRA_VORONOI.append(TREE.extra)
 
             TREE_VORONOI.append(TREE)
 
@@ -1115,50 +1095,35 @@ def COMPUTE_EXTRA_PARAMETERS(
 ):
     import math
     import numpy as np
+    import numba_algorithms as na
 
     print("FOR NEW PARAMETERS RUNNING")
-    aux11 = (LAZCONTENT.x) ** 2
-    aux12 = (LAZCONTENT.y) ** 2
-    aux13 = (LAZCONTENT.z) ** 2
-    Range = np.sqrt(aux11 + aux12 + aux13)
-    
-    phi = np.arctan2(LAZCONTENT.y, LAZCONTENT.x)
-    IDX1 = phi < 0
-    phi[IDX1] = 2 * math.pi + phi[IDX1]
-
-    IDX2 = phi < (phiStart * math.pi / 180)
-    phi[IDX2] = phiStart * math.pi / 180
-
-    IDX3 = phi > (phiStop * math.pi / 180)
-    phi[IDX3] = phiStop * math.pi / 180
-    
-    del IDX1, IDX2, IDX3, aux11, aux12, aux13
-
-    theta = np.arccos((LAZCONTENT.z) / Range)
-    IDX1 = theta < (thetaStart * math.pi / 180)
-    theta[IDX1] = thetaStart * math.pi / 180
-    IDX2 = theta > (thetaStop * math.pi / 180)
-    theta[IDX2] = thetaStop * math.pi / 180
-    
-    del IDX1, IDX2
-
     NP = len(LAZCONTENT.x)
-    NEB = len(EXTRA) + 3
-    EXTRA_TREE = np.empty((NEB, NP), dtype=np.float32)
     k = len(EXTRA)
+    NEB = k + 3
 
-    for n in range(k):
-        EXTRA_TREE[n] = EXTRA[n]
-
-    EXTRA_TREE[k] = np.array(Range)
-    EXTRA_TREE[k + 1] = np.array(theta) * 180 / math.pi
-    EXTRA_TREE[k + 2] = np.array(phi) * 180 / math.pi
+    # THE NEW PARAMETERS ARE WRITTEN STRAIGHT INTO THE LAST THREE ROWS OF THE OUTPUT BLOCK
+    EXTRA_TREE = np.empty((NEB, NP), dtype=np.float32)
+    if k > 0:
+        EXTRA_TREE[:k] = EXTRA
+    na.range_theta_phi(
+        np.asarray(LAZCONTENT.x, dtype=np.float64),
+        np.asarray(LAZCONTENT.y, dtype=np.float64),
+        np.asarray(LAZCONTENT.z, dtype=np.float64),
+        thetaStart * math.pi / 180,
+        thetaStop * math.pi / 180,
+        phiStart * math.pi / 180,
+        phiStop * math.pi / 180,
+        EXTRA_TREE[k],
+        EXTRA_TREE[k + 1],
+        EXTRA_TREE[k + 2],
+    )
 
-    setattr(LAZCONTENT, "Range", Range)
-    setattr(LAZCONTENT, "Theta", np.array(theta) * 180 / math.pi)
-    setattr(LAZCONTENT, "Phi", np.array(phi) * 180 / math.pi)
+    # VIEWS OF THE ROWS, NOT COPIES
+    setattr(LAZCONTENT, "Range", EXTRA_TREE[k])
+    setattr(LAZCONTENT, "Theta", EXTRA_TREE[k + 1])
+    setattr(LAZCONTENT, "Phi", EXTRA_TREE[k + 2])
 
-    del Range, theta, phi
     return LAZCONTENT, EXTRA_TREE
 
 
@@ -1173,66 +1138,23 @@ MANDATORY: LAZCONTENT - TREE POINT CLOUD
 
 def Ground_Normalize(LAZCONTENT, offsets, th, Extra=[], ExtraBytes_name=[]):
     import numpy as np
+    from PointCloud import PointCloud
 
     th = offsets[2] + th
-    P = LAZCONTENT.z > th
-
-    X = LAZCONTENT.x[P] - offsets[0]
-    Y = LAZCONTENT.y[P] - offsets[1]
-    Z = LAZCONTENT.z[P] - offsets[2]
+    if getattr(LAZCONTENT, "quantization", None) is not None:
+        P = LAZCONTENT.box_mask([-np.inf, -np.inf, th], [np.inf, np.inf, np.inf])
+    else:
+        P = LAZCONTENT.z > th
 
-    class TREE:
-        x = X
-        y = Y
-        z = Z
-
-    if hasattr(LAZCONTENT, "return_number"):
-        rn = LAZCONTENT.return_number[P]
-        setattr(TREE, "return_number", rn)
-    if hasattr(LAZCONTENT, "number_of_returns"):
-        nr = LAZCONTENT.number_of_returns[P]
-        setattr(TREE, "number_of_returns", nr)
-    if hasattr(LAZCONTENT, "intensity"):
-        intensity = LAZCONTENT.intensity[P]
-        setattr(TREE, "intensity", intensity)
+    CLOUD = PointCloud.from_attributes(LAZCONTENT, Extra, ExtraBytes_name)
     if hasattr(LAZCONTENT, "Amplitude"):
-        intensity = LAZCONTENT.Amplitude[P]
-        setattr(TREE, "intensity", intensity)
-    if hasattr(LAZCONTENT, "scan_direction_flag"):
-        scan_direction_flag = LAZCONTENT.scan_direction_flag[P]
-        setattr(TREE, "scan_direction_flag", scan_direction_flag)
-    if hasattr(LAZCONTENT, "edge_of_flight_line"):
-        edge_of_flight_line = LAZCONTENT.edge_of_flight_line[P]
-        setattr(TREE, "edge_of_flight_line", edge_of_flight_line)
-    if hasattr(LAZCONTENT, "classification"):
-        classification = LAZCONTENT.classification[P]
-        setattr(TREE, "classification", classification)
-    if hasattr(LAZCONTENT, "scan_angle_rank"):
-        scan_angle_rank = LAZCONTENT.scan_angle_rank[P]
-        setattr(TREE, "scan_angle_rank", scan_angle_rank)
-    if hasattr(LAZCONTENT, "user_data"):
-        user_data = LAZCONTENT.user_data[P]
-        setattr(TREE, "user_data", user_data)
-    if hasattr(LAZCONTENT, "gps_time"):
-        gps_time = LAZCONTENT.gps_time[P]
-        setattr(TREE, "gps_time", gps_time)
-    if hasattr(LAZCONTENT, "rgb"):
-        rgb = LAZCONTENT.rgb[P]
-        setattr(TREE, "rgb", rgb)
+        CLOUD.intensity = LAZCONTENT.Amplitude
 
-    if len(ExtraBytes_name) > 0:
-        number_attributes = len(Extra)
-        NP = len(X)
-        EXTRA_TREE = np.empty((number_attributes, NP), dtype=np.float32)
-        for i in range(number_attributes):
-            default = Extra[i]
-            default = default[P]
-            EXTRA_TREE[i] = default
-            setattr(TREE, ExtraBytes_name[i], default)
-        setattr(TREE, "ExtraBytes_name", ExtraBytes_name)
+    # ONLY THE OFFSETS CHANGE FOR A QUANTIZED CLOUD
+    TREE = CLOUD.mask(P).translate(offsets)
 
     if len(ExtraBytes_name) > 0:
-        return TREE, EXTRA_TREE
+        return TREE, TREE.extra
     else:
         return TREE
 
@@ -1260,9 +1182,24 @@ REQUIREMENTS: scipy (https://scipy.org/) and numpy
 
 
 def Stastitic_voxel(LAZCONTENT, useroption, pts_min, vs, ATRIBUTE=[]):
+    if getattr(LAZCONTENT, "quantization", None) is not None:
+        from PointCloud import PointCloud
+
+        # QUANTIZED CLOUD: VOXELS OF THE FLOAT32 LOCAL COORDINATES, SHIFTED BACK AFTERWARDS
+        x, y, z, origin = LAZCONTENT.local_xyz()
+        VOXEL = Stastitic_voxel(PointCloud({"x": x, "y": y, "z": z}), useroption, pts_min, vs, ATRIBUTE)
+        if useroption == "Centroid":
+            VOXEL.x, VOXEL.y, VOXEL.z = VOXEL.x + origin[0], VOXEL.y + origin[1], VOXEL.z + origin[2]
+        if useroption == "Density":
+            VOXEL.GridX = VOXEL.GridX + origin[0]
+            VOXEL.GridY = VOXEL.GridY + origin[1]
+            VOXEL.GridZ = VOXEL.GridZ + origin[2]
+        return VOXEL
+
     if useroption == "Atributes":
         from scipy import stats
         import numpy as np
+        import numba_algorithms as na
 
         binsx = np.arange(min(LAZCONTENT.x), max(LAZCONTENT.x), vs)
         binsy = np.arange(min(LAZCONTENT.y), max(LAZCONTENT.y), vs)
@@ -1283,13 +1220,8 @@ def Stastitic_voxel(LAZCONTENT, useroption, pts_min, vs, ATRIBUTE=[]):
         # CREATE GRID CELL
         idgrid = idx + (idy * nx) + (idz * nx * ny)
 
-        summx = np.zeros(nx * ny * nz)
-        count = np.zeros(nx * ny * nz)
-        NP = len(LAZCONTENT.x)
-
-        for i in range(NP):
-            summx[idgrid[i]] = summx[idgrid[i]] + ATRIBUTE[i]
-            count[idgrid[i]] = count[idgrid[i]] + 1
+        # SUMS AND COUNTS OF THE OCCUPIED VOXELS ONLY (IN INCREASING idgrid ORDER)
+        _, count, _, summx = na.voxel_reduce(idgrid, att=np.asarray(ATRIBUTE))
 
         nonzeros = np.where(count > pts_min)
         SA = summx[nonzeros] / count[nonzeros]
@@ -1303,6 +1235,7 @@ def Stastitic_voxel(LAZCONTENT, useroption, pts_min, vs, ATRIBUTE=[]):
     if useroption == "Centroid":
         from scipy import stats
         import numpy as np
+        import numba_algorithms as na
 
         binsx = np.arange(min(LAZCONTENT.x), max(LAZCONTENT.x), vs)
         binsy = np.arange(min(LAZCONTENT.y), max(LAZCONTENT.y), vs)
@@ -1322,22 +1255,16 @@ def Stastitic_voxel(LAZCONTENT, useroption, pts_min, vs, ATRIBUTE=[]):
 
         # CREATE GRID CELL
         idgrid = idx + (idy * nx) + (idz * nx * ny)
-        summx = np.zeros(nx * ny * nz)
-        summy = np.zeros(nx * ny * nz)
-        summz = np.zeros(nx * ny * nz)
-        count = np.zeros(nx * ny * nz)
-        NP = len(LAZCONTENT.x)
-
-        for i in range(NP):
-            summx[idgrid[i]] = summx[idgrid[i]] + LAZCONTENT.x[i]
-            summy[idgrid[i]] = summy[idgrid[i]] + LAZCONTENT.y[i]
-            summz[idgrid[i]] = summz[idgrid[i]] + LAZCONTENT.z[i]
-            count[idgrid[i]] = count[idgrid[i]] + 1
+
+        # SUMS AND COUNTS OF THE OCCUPIED VOXELS ONLY (IN INCREASING idgrid ORDER)
+        _, count, summ, _ = na.voxel_reduce(
+            idgrid, np.asarray(LAZCONTENT.x), np.asarray(LAZCONTENT.y), np.asarray(LAZCONTENT.z)
+        )
 
         nonzeros = np.where(count > pts_min)
-        x1 = summx[nonzeros] / count[nonzeros]
-        y1 = summy[nonzeros] / count[nonzeros]
-        z1 = summz[nonzeros] / count[nonzeros]
+        x1 = summ[nonzeros][:, 0] / count[nonzeros]
+        y1 = summ[nonzeros][:, 1] / count[nonzeros]
+        z1 = summ[nonzeros][:, 2] / count[nonzeros]
         # output=count[nonzeros]
 
         class VOXEL:
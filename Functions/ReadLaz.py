@@ -32,22 +32,126 @@ SOFTWARE.
 from ctypes import *
 import numpy as np
 import time
-import gc
+import weakref
+from PointCloud import PointCloud
 
-def ReadLaz(inputLas, DLLPATH, n_threads=1):
+# FIELDS AND DTYPES RETURNED BY THE DLL - THE CHUNKED READER RETURNS THE SAME ONES
+LAZ_FIELDS = {
+    "x": np.float64,
+    "y": np.float64,
+    "z": np.float64,
+    "intensity": np.float32,
+    "return_number": np.int32,
+    "number_of_returns": np.int32,
+    "edge_of_flight_line": np.int32,
+    "scan_direction_flag": np.int32,
+    "classification": np.float32,
+    "scan_angle_rank": np.short,
+    "point_source_ID": np.short,
+    "gps_time": np.float32,
+}
+
+# LASPY NAMES FOR THE FIELDS THAT ARE NAMED DIFFERENTLY IN THE DLL
+LASPY_NAMES = {"point_source_ID": "point_source_id"}
+
+
+"""
+READ A LAS/LAZ FILE
+
+MANDATORY: inputLas, DLLPATH (may be None with the laspy backend)
+OPTIONAL: backend - "ctypes" (read with the DLL), "laspy" (read with laspy and the
+                    multi-threaded lazrs decompressor), "memmap" (uncompressed LAS only, see
+                    _read_memmap) or "auto" (memmap for uncompressed LAS, otherwise the DLL when
+                    DLLPATH exists and laspy when it does not). All backends return the same
+                    fields and dtypes
+                    E.G: ReadLaz.ReadLaz(inputLas, None, backend="laspy")
+          n_threads - more than one thread calls Read_Parallel (ctypes backend)
+          zero_copy - return views of the buffers allocated by the DLL instead of copies
+          free_buffers - call freeme on the buffers of x, y, z, return_number, number_of_returns,
+                         intensity and the extra bytes once the last array using them is released
+                         (see _CBuffers). freeme used to crash because it was called while arrays
+                         still pointed to the buffers. False leaks them, as the old reader did.
+                         edge_of_flight_line, scan_direction_flag, classification, scan_angle_rank,
+                         user_data, point_source_ID and gps_time are not handled by freeme and are
+                         always leaked
+          fields - list of standard fields and extra bytes to return (default: all of them).
+                   Names that are neither a standard field nor an extra bytes of the file raise ValueError
+                   E.G: ReadLaz.ReadLaz(inputLas, DLLPATH, fields=["x", "y", "z", "Reflectance"])
+          bbox - [xmin, ymin, zmin, xmax, ymax, zmax] or [xmin, ymin, xmax, ymax]
+          polygon - (N, 2) array with the xy vertices of a polygon
+                    With bbox or polygon only the chunks of the file that intersect the window
+                    are decompressed (see build_chunk_index) and only the points inside it are returned
+          quantized - keep x, y, z as int32 X, Y, Z with the scales and offsets of the file
+                      (see PointCloud, quantized mode). laspy, memmap and window reads take
+                      the integers of the file directly, the DLL and the store are quantized
+                      after reading with millimetre scales
+A path ending with .pcstore is read from the columnar intermediate store (see PointStore),
+whatever the backend.
+"""
+
+
+def ReadLaz(
+    inputLas, DLLPATH, n_threads=1, zero_copy=False, fields=None, bbox=None, polygon=None, backend="ctypes",
+    quantized=False, free_buffers=True,
+):
+    import PointStore
+
+    if PointStore.is_store(inputLas):
+        ATRIBUTES = PointStore.read_store(inputLas, fields, bbox, polygon)
+        return _quantize(ATRIBUTES) if quantized else ATRIBUTES
+
+    if bbox is not None or polygon is not None:
+        return read_window(inputLas, bbox, polygon, fields, n_threads, quantized)
+
+    backend = resolve_backend(backend, DLLPATH, inputLas)
+    if backend not in READ_BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, use one of {list(READ_BACKENDS)} or auto")
+    return READ_BACKENDS[backend](inputLas, DLLPATH, n_threads, zero_copy, fields, quantized, free_buffers)
+
+
+def _quantize(ATRIBUTES):
+    # ONLY WHEN THE THREE COORDINATES WERE READ
+    if all(name in ATRIBUTES.columns for name in ("x", "y", "z")):
+        ATRIBUTES.quantize()
+    return ATRIBUTES
+
+
+"""
+I/O BACKENDS
+
+READ_BACKENDS maps the backend names to the functions that read a whole file. Every
+function takes (inputLas, DLLPATH, n_threads, zero_copy, fields, quantized, free_buffers) and
+returns the same ATRIBUTES class. resolve_backend turns "auto" into one of them, inputLas is only given
+when reading.
+"""
+
+
+def resolve_backend(backend, DLLPATH, inputLas=None):
+    import os
+
+    if backend == "auto":
+        if inputLas is not None and _is_uncompressed_las(inputLas):
+            return "memmap"
+        if DLLPATH is not None and os.path.exists(DLLPATH):
+            return "ctypes"
+        return "laspy"
+    return backend
+
+
+def _is_uncompressed_las(inputLas):
+    import laspy
+
+    with laspy.open(inputLas) as reader:
+        return not reader.header.are_points_compressed
+
+
+def _read_ctypes(inputLas, DLLPATH, n_threads=1, zero_copy=False, fields=None, quantized=False, free_buffers=True):
     t1_start = time.perf_counter()
     t2_start = time.process_time()
 
     #INSERT FILE TO BE READ
     FILE_NAME=inputLas
-    ExtraBytes_name=[]; x_arr=[];  y_arr=[]; z_arr=[];
-    return_number_arr=[]; number_of_returns_arr=[]; intensity_arr=[]; classification_arr=[]; 
-    edge_of_flight_line_arr=[]; scan_direction_flag_arr=[]; scan_angle_rank_arr=[]; user_data_arr=[]; point_source_ID_arr=[]; gps_time_arr=[]; 
-    number_attributes=[];
-    
-    x_arr_F=[];  y_arr_F=[]; z_arr_F=[];
-    return_number_arr_F=[]; number_of_returns_arr_F=[]; intensity_arr_F=[]; classification_arr_F=[]; number_attributes_F=[];
-    edge_of_flight_line_arr_F=[]; scan_direction_flag_arr_F=[]; scan_angle_rank_arr_F=[]; user_data_arr_F=[]; point_source_ID_arr_F=[]; gps_time_arr_F=[]; 
+    ExtraBytes_name=[]
     
     #LOADING C FUNCTION TO READ WITH LASZIP
     libCalc=CDLL(DLLPATH)
@@ -61,6 +165,12 @@ def ReadLaz(inputLas, DLLPATH, n_threads=1):
 
     
     FREEMEMO = libCalc.freeme
+    FREEMEMO.argtypes = [POINTER(c_double), POINTER(c_double), POINTER(c_double), #X,Y,Z
+                 POINTER(c_int), POINTER(c_int), #RETURN NUMBER AND NUMBER OF RETURN
+                 POINTER(c_float), #intensity
+                 POINTER(POINTER(c_float)), POINTER(c_char_p), #EXTRA BYTES AND THEIR NAMES
+                 c_int]
+    FREEMEMO.restype = None
 
     #DECLARING NUMPY ARRAYS
     #void Data(char* name, double*&x, double*&y, double*&z, int *&return_number,  int *&number_of_returns ,float *&intensity);
@@ -110,89 +220,543 @@ def ReadLaz(inputLas, DLLPATH, n_threads=1):
                  byref(scan_angle_rank),byref(user_data),
                  byref(point_source_ID),byref(gps_time),                
                  byref(pm), byref(attributes_names), extra, n_threads)
-    
-    
-    
-
-    x_arr=np.ctypeslib.as_array((c_double*npoints).from_address(addressof(x.contents)))
-    y_arr=np.ctypeslib.as_array((c_double*npoints).from_address(addressof(y.contents)))
-    z_arr=np.ctypeslib.as_array((c_double*npoints).from_address(addressof(z.contents)))
-    intensity_arr=np.ctypeslib.as_array((c_float*npoints).from_address(addressof(intensity.contents)))
-    return_number_arr=np.ctypeslib.as_array((c_int*npoints).from_address(addressof(return_number.contents)))
-    number_of_returns_arr=np.ctypeslib.as_array((c_int*npoints).from_address(addressof(number_of_returns.contents)))
-    edge_of_flight_line_arr=np.ctypeslib.as_array((c_int*npoints).from_address(addressof(edge_of_flight_line.contents)))
-    scan_direction_flag_arr=np.ctypeslib.as_array((c_int*npoints).from_address(addressof(scan_direction_flag.contents)))
-    classification_arr=np.ctypeslib.as_array((c_float*npoints).from_address(addressof(classification.contents)))    
-    scan_angle_rank_arr=np.ctypeslib.as_array((c_short*npoints).from_address(addressof(scan_angle_rank.contents)))
-    #user_data
-    point_source_ID_arr=np.ctypeslib.as_array((c_short*npoints).from_address(addressof(point_source_ID.contents)))
-    gps_time_arr=np.ctypeslib.as_array((c_float*npoints).from_address(addressof(gps_time.contents)))
     number_attributes=extra.value
     
+    # WITH zero_copy THE RETURNED ARRAYS ARE VIEWS OF THE C BUFFERS, OTHERWISE THEY ARE COPIED.
+    # freeme IS CALLED ONCE THE LAST ARRAY USING THE BUFFERS IS GONE (OR BEFORE RETURNING WHEN
+    # THEY WERE COPIED), UNLESS free_buffers IS FALSE
+    owner = _CBuffers(FREEMEMO if free_buffers else None, x, y, z, return_number, number_of_returns,
+                      intensity, pm, attributes_names, number_attributes)
+
+    def as_array(pointer, ctype):
+        array = _c_array(pointer, ctype, npoints, owner)
+        if zero_copy:
+            return array
+        return np.array(array)
     
-    x_arr_F=np.array(x_arr); y_arr_F=np.array(y_arr); z_arr_F=np.array(z_arr);
-    return_number_arr_F=np.array(return_number_arr); number_of_returns_arr_F=np.array(number_of_returns_arr); intensity_arr_F=np.array(intensity_arr); classification_arr_F=np.array(classification_arr);
-    edge_of_flight_line_arr_F=np.array(edge_of_flight_line_arr); scan_direction_flag_arr_F=np.array(scan_direction_flag_arr); 
-    scan_angle_rank_arr_F=np.array(scan_angle_rank_arr); point_source_ID_arr_F=np.array(point_source_ID_arr); gps_time_arr_F=np.array(gps_time_arr);
-    #user_data_arr_F=np.array(scan_angle_rank_arr); 
-   
+    ATRIBUTES = PointCloud()
     
-    class ATRIBUTES:
-        
-        pass
+    # ONLY THE REQUESTED FIELDS ARE COPIED (OR EXPOSED WITH zero_copy)
+    def add_field(name, pointer, ctype):
+        if fields is None or name in fields:
+            setattr (ATRIBUTES, name, as_array(pointer, ctype) )
         
-    setattr (ATRIBUTES, 'x', x_arr_F )        
-    setattr (ATRIBUTES, 'y', y_arr_F )  
-    setattr (ATRIBUTES, 'z', z_arr_F ) 
-    setattr (ATRIBUTES, 'intensity', intensity_arr_F ) 
-    setattr (ATRIBUTES, 'return_number', return_number_arr_F ) 
-    setattr (ATRIBUTES, 'number_of_returns', number_of_returns_arr_F ) 
-    setattr (ATRIBUTES, 'edge_of_flight_line', edge_of_flight_line_arr_F )
-    setattr (ATRIBUTES, 'scan_direction_flag', scan_direction_flag_arr_F )
-    setattr (ATRIBUTES, 'classification', classification_arr_F )
-    setattr (ATRIBUTES, 'scan_angle_rank', scan_angle_rank_arr_F )
-    setattr (ATRIBUTES, 'point_source_ID', point_source_ID_arr_F )
-    setattr (ATRIBUTES, 'gps_time', gps_time_arr_F )
-    
-    default=[]; default_F=[]; 
+    add_field('x', x, c_double)
+    add_field('y', y, c_double)
+    add_field('z', z, c_double)
+    add_field('intensity', intensity, c_float)
+    add_field('return_number', return_number, c_int)
+    add_field('number_of_returns', number_of_returns, c_int)
+    add_field('edge_of_flight_line', edge_of_flight_line, c_int)
+    add_field('scan_direction_flag', scan_direction_flag, c_int)
+    add_field('classification', classification, c_float)
+    add_field('scan_angle_rank', scan_angle_rank, c_short)
+    #user_data
+    add_field('point_source_ID', point_source_ID, c_short)
+    add_field('gps_time', gps_time, c_float)
+    
+    check_fields(fields, [attributes_names[i].decode('utf-8') for i in range(number_attributes)])
+
     if number_attributes > 0:
+       rows = []
        for i in range (number_attributes):
-           ExtraBytes_name.append(attributes_names[i].decode('utf-8'))
-           default=np.ctypeslib.as_array((c_float*npoints).from_address(addressof(pm[i].contents)))
-           default_F=np.array(default); 
-           setattr (ATRIBUTES, ExtraBytes_name[i], default_F )
-           del default, default_F
+           name = attributes_names[i].decode('utf-8')
+           if fields is None or name in fields:
+               ExtraBytes_name.append(name)
+               rows.append(i)
        setattr (ATRIBUTES, 'ExtraBytes_name', ExtraBytes_name)    
+       if zero_copy:
+           for i, name in zip(rows, ExtraBytes_name):
+               add_field(name, pm[i], c_float)
+       else:
+           # EXTRA BYTES COPIED STRAIGHT INTO ONE (NEB, NP) BLOCK
+           ATRIBUTES.extra = _extra_block(
+               [_c_array(pm[i], c_float, npoints, owner) for i in rows], npoints
+           )
+    
+    if not zero_copy:
+        owner.release()
+    del owner
+    
+    if quantized:
+        _quantize(ATRIBUTES)
                    
     
+    _print_summary(ATRIBUTES, ExtraBytes_name, t1_start, t2_start)
+    
+    return ATRIBUTES
+
+
+def _read_laspy(inputLas, DLLPATH=None, n_threads=1, zero_copy=False, fields=None, quantized=False, free_buffers=False):
+    import laspy
+
+    t1_start = time.perf_counter()
+    t2_start = time.process_time()
+
+    with laspy.open(
+        inputLas,
+        laz_backend=laspy.LazBackend.LazrsParallel,
+        decompression_selection=_decompression_selection(fields),
+    ) as reader:
+        check_fields(fields, reader.header.point_format.extra_dimension_names)
+        ExtraBytes_name = [
+            name
+            for name in reader.header.point_format.extra_dimension_names
+            if fields is None or name in fields
+        ]
+        points = reader.read_points(-1)
+        header_bounds = (reader.header.mins, reader.header.maxs)
+
+    ATRIBUTES = _points_to_atributes(points, ExtraBytes_name, fields, quantized)
+    ATRIBUTES.header_bounds = header_bounds
+    del points
+
+    _print_summary(ATRIBUTES, ExtraBytes_name, t1_start, t2_start)
+
+    return ATRIBUTES
+
+
+"""
+MEMORY-MAPPED UNCOMPRESSED LAS
+
+The point records of an uncompressed LAS file are mapped with np.memmap, so reading is
+instant and only the data that is used is paged in from disk. The output is a PointCloud:
+    - x, y, z, the standard fields and the extra bytes are lazy columns (see PointCloud),
+      decoded the first time they are used with the same dtypes as the other backends
+      (float32 for the extra bytes, which are separate columns instead of one block)
+    - with quantized the int32 X, Y, Z of the file are kept as views, with its scales and offsets
+The X, Y, Z views are read only, assign new arrays instead of modifying them in place.
+
+MANDATORY: inputLas
+OPTIONAL: fields, quantized
+          E.G: LAZCONTENT=ReadLaz.ReadLaz(inputLas, None, backend="memmap")
+"""
+
+
+def _read_memmap(inputLas, DLLPATH=None, n_threads=1, zero_copy=False, fields=None, quantized=False, free_buffers=False):
+    import laspy
+
+    t1_start = time.perf_counter()
+    t2_start = time.process_time()
+
+    with laspy.open(inputLas) as reader:
+        header = reader.header
+    if header.are_points_compressed:
+        raise ValueError(f"{inputLas} is compressed, only uncompressed LAS can be memory-mapped")
+
+    point_format = header.point_format
+    check_fields(fields, point_format.extra_dimension_names)
+    data = np.memmap(
+        inputLas,
+        dtype=point_format.dtype(),
+        mode="r",
+        offset=header.offset_to_point_data,
+        shape=(header.point_count,),
+    )
+    points = laspy.ScaleAwarePointRecord(data, point_format, header.scales, header.offsets)
+    dimensions = set(point_format.dimension_names)
+
+    ExtraBytes_name = [
+        name
+        for name in point_format.extra_dimension_names
+        if fields is None or name in fields
+    ]
+    ATRIBUTES = PointCloud(ExtraBytes_name=ExtraBytes_name, header_bounds=(header.mins, header.maxs))
+
+    # THE SCALED INTEGERS OF THE FILE ARE KEPT WHEN THE THREE COORDINATES ARE READ
+    quantized = quantized and (fields is None or all(name in fields for name in ("x", "y", "z")))
+    if quantized:
+        ATRIBUTES.quantization = (np.asarray(header.scales, dtype=np.float64), np.asarray(header.offsets, dtype=np.float64))
+
+    def decode(name, dtype):
+        if name in ("x", "y", "z"):
+            return lambda: np.asarray(getattr(points, name), dtype=dtype)
+        return lambda: np.asarray(points[LASPY_NAMES.get(name, name)], dtype=dtype)
+
+    # THE EXTRA BYTES ARE DECODED TO FLOAT32 (SCALED WHEN THE FILE GIVES SCALES), LIKE THE OTHER BACKENDS
+    for name in ExtraBytes_name:
+        ATRIBUTES.lazy[name] = decode(name, np.float32)
+
+    for name, dtype in LAZ_FIELDS.items():
+        if fields is not None and name not in fields:
+            continue
+        if quantized and name in ("x", "y", "z"):
+            ATRIBUTES.columns[name.upper()] = data[name.upper()]
+        elif name in ("x", "y", "z") or LASPY_NAMES.get(name, name) in dimensions:
+            ATRIBUTES.lazy[name] = decode(name, dtype)
+
+    # THE SUMMARY ONLY LISTS THE NAMES, OTHERWISE EVERY FIELD WOULD BE PAGED IN
+    _print_summary(ATRIBUTES, ExtraBytes_name, t1_start, t2_start)
+
+    return ATRIBUTES
+
+
+READ_BACKENDS = {"ctypes": _read_ctypes, "laspy": _read_laspy, "memmap": _read_memmap}
+
+
+def _print_summary(ATRIBUTES, ExtraBytes_name, t1_start, t2_start):
     t1_stop = time.perf_counter()
     t2_stop = time.process_time()
     
-    fields=[f for f in dir(ATRIBUTES) if not callable(getattr(ATRIBUTES,f)) and not f.startswith('__')]
-    Default_atributes=[]
-    for i in fields:
-        if i != 'ExtraBytes_name':
-            TESTE=np.sum(getattr(ATRIBUTES,i))
-            if TESTE!=0:
-                Default_atributes.append(i)
-    
-    
+    # NAMES ONLY - THE FIELDS WITH DATA ARE GIVEN BY ATRIBUTES.present_fields WHEN NEEDED
+    content=ATRIBUTES.field_names
     
     print("\n Reading Elapsed time: %.1f [sec]" % ((t1_stop-t1_start)))
     print("CPU process time: %.1f [sec] \n" % ((t2_stop-t2_start)))
     
-    print ("LAZ CONTENT:", Default_atributes)   
+    print ("LAZ CONTENT:", content)   
     print ("LAZ EXTRA BYTES: ExtraBytes_name", ExtraBytes_name) 
-    
-    # This will give a segmentation fault if uncommented
-    # FREEMEMO(x, y , z, 
-    #         return_number, number_of_returns,
-    #         intensity, pm, attributes_names, number_attributes)
-    
-    gc.collect() 
-    del x, y, z, return_number, number_of_returns, intensity, classification, pm, attributes_names, extra
-    del x_arr, y_arr, z_arr, return_number_arr, number_of_returns_arr, intensity_arr, classification_arr, ExtraBytes_name   
-    del x_arr_F, y_arr_F, z_arr_F, return_number_arr_F, number_of_returns_arr_F, intensity_arr_F, classification_arr_F
-    del libCalc, DATA, npoints, number_attributes
-    
+
+
+"""
+OWNER OF THE BUFFERS ALLOCATED BY THE DLL
+
+Every array created by _c_array keeps a reference to the owner, so freeme is called
+exactly once: when the last of those arrays is garbage collected or when release()
+is called explicitly. With FREEMEMO None the buffers are never freed.
+"""
+
+
+class _CBuffers:
+    def __init__(self, FREEMEMO, *pointers):
+        self._finalizer = None
+        if FREEMEMO is not None:
+            self._finalizer = weakref.finalize(self, FREEMEMO, *pointers)
+
+    def release(self):
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+def _c_array(pointer, ctype, npoints, owner):
+    if npoints == 0:
+        return np.empty(0, dtype=ctype)
+    buffer = (ctype*npoints).from_address(addressof(pointer.contents))
+    buffer._owner = owner
+    return np.ctypeslib.as_array(buffer)
+
+
+"""
+READ A LAS/LAZ FILE IN FIXED-SIZE CHUNKS
+
+The DLL only exposes whole-file reads, so the chunks are decoded with the LASzip
+implementation of laspy (lazrs). Every chunk has the same fields and dtypes as the
+output of ReadLaz, so the processing functions can be applied chunk by chunk.
+
+MANDATORY: inputLas
+OPTIONAL: chunk_points - number of points per chunk (the last chunk may be smaller)
+          n_threads - more than one thread uses the parallel lazrs decompressor
+          fields - list of standard fields and extra bytes to return (default: all of them).
+                   For LAS 1.4 point formats 6-10 the layers of the other fields are not decompressed
+          quantized - see ReadLaz
+          E.G: for chunk in ReadLaz.iter_chunks(inputLas, chunk_points=5_000_000):
+                   x1, y1, z1 = Processing.RectifLaz(chunk.x, chunk.y, chunk.z, transformation)
+"""
+
+
+def iter_chunks(inputLas, chunk_points=10_000_000, n_threads=1, fields=None, quantized=False):
+    import laspy
+    import PointStore
+
+    if chunk_points < 1:
+        raise ValueError("chunk_points must be a positive integer")
+
+    if PointStore.is_store(inputLas):
+        ATRIBUTES = PointStore.read_store(inputLas, fields)
+        if quantized:
+            _quantize(ATRIBUTES)
+        for start in range(0, len(ATRIBUTES), chunk_points):
+            yield ATRIBUTES.take(slice(start, start + chunk_points))
+        return
+
+    if n_threads == 1:
+        laz_backend = laspy.LazBackend.Lazrs
+    else:
+        laz_backend = laspy.LazBackend.LazrsParallel
+
+    with laspy.open(
+        inputLas,
+        laz_backend=laz_backend,
+        decompression_selection=_decompression_selection(fields),
+    ) as reader:
+        check_fields(fields, reader.header.point_format.extra_dimension_names)
+        ExtraBytes_name = [
+            name
+            for name in reader.header.point_format.extra_dimension_names
+            if fields is None or name in fields
+        ]
+        for points in reader.chunk_iterator(chunk_points):
+            yield _points_to_atributes(points, ExtraBytes_name, fields, quantized)
+
+
+# LAYERS OF THE LAS 1.4 COMPRESSION THAT HOLD EACH FIELD (EXTRA BYTES ARE A SINGLE LAYER)
+LAZ_LAYERS = {
+    "x": "XY_RETURNS_CHANNEL",
+    "y": "XY_RETURNS_CHANNEL",
+    "z": "Z",
+    "intensity": "INTENSITY",
+    "return_number": "XY_RETURNS_CHANNEL",
+    "number_of_returns": "XY_RETURNS_CHANNEL",
+    "edge_of_flight_line": "FLAGS",
+    "scan_direction_flag": "FLAGS",
+    "classification": "CLASSIFICATION",
+    "scan_angle_rank": "SCAN_ANGLE",
+    "point_source_ID": "POINT_SOURCE_ID",
+    "gps_time": "GPS_TIME",
+}
+
+
+# THE NAMES THAT ARE NOT STANDARD FIELDS ARE EXTRA BYTES, check_fields REJECTS THE OTHERS
+def _decompression_selection(fields):
+    import laspy
+
+    if fields is None:
+        return laspy.DecompressionSelection.all()
+
+    selection = laspy.DecompressionSelection.base()
+    for name in fields:
+        layer = LAZ_LAYERS.get(name, "ALL_EXTRA_BYTES")
+        selection |= getattr(laspy.DecompressionSelection, layer)
+    return selection
+
+
+def check_fields(fields, extra_dimension_names):
+    if fields is None:
+        return
+    unknown = [name for name in fields if name not in LAZ_FIELDS and name not in extra_dimension_names]
+    if unknown:
+        raise ValueError(
+            f"Unknown fields {unknown}, use the standard fields {list(LAZ_FIELDS)}"
+            f" or the extra bytes of the file {list(extra_dimension_names)}"
+        )
+
+
+def _points_to_atributes(points, ExtraBytes_name, fields=None, quantized=False):
+    dimensions = set(points.point_format.dimension_names)
+
+    ATRIBUTES = PointCloud()
+    # THE SCALED INTEGERS OF THE FILE ARE KEPT WHEN THE THREE COORDINATES ARE READ
+    quantized = quantized and (fields is None or all(name in fields for name in ("x", "y", "z")))
+    if quantized:
+        ATRIBUTES.quantization = (np.asarray(points.scales, dtype=np.float64), np.asarray(points.offsets, dtype=np.float64))
+
+    for name, dtype in LAZ_FIELDS.items():
+        if fields is not None and name not in fields:
+            continue
+        laspy_name = LASPY_NAMES.get(name, name)
+        if quantized and laspy_name in ("x", "y", "z"):
+            ATRIBUTES.columns[name.upper()] = np.asarray(points.array[name.upper()], dtype=np.int32)
+            continue
+        if laspy_name in ("x", "y", "z"):
+            values = np.asarray(getattr(points, laspy_name), dtype=dtype)
+        elif laspy_name in dimensions:
+            values = np.asarray(points[laspy_name], dtype=dtype)
+        else:
+            values = np.zeros(len(points), dtype=dtype)
+        setattr(ATRIBUTES, name, values)
+
+    setattr(ATRIBUTES, "ExtraBytes_name", ExtraBytes_name)
+    if len(ExtraBytes_name) > 0:
+        ATRIBUTES.extra = _extra_block([points[name] for name in ExtraBytes_name], len(points))
+
     return ATRIBUTES
+
+
+"""
+EXTRA BYTES BLOCK
+
+The extra bytes are returned as a single C-contiguous float32 (NEB, NP) block, one row per
+name of ExtraBytes_name. LAZCONTENT.Reflectance is a view of its row (see PointCloud), so
+Processing.add_extra_bytes hands the block over without copying and the processing functions
+gather all the extra bytes with one fancy-index operation. The memory-mapped readers (memmap
+backend and .pcstore) keep the extra bytes as separate lazy columns instead.
+"""
+
+
+def _extra_block(rows, npoints):
+    block = np.empty((len(rows), npoints), dtype=np.float32)
+    for k, values in enumerate(rows):
+        block[k] = values
+    return block
+
+
+"""
+SPATIAL INDEX OF THE CHUNKS OF A LAS/LAZ FILE
+
+The index stores the first point, the number of points and the 3D bounding box of every
+chunk of the file. For LAZ files the chunks are the LASzip chunks, so a chunk can be
+decompressed on its own. The index is saved next to the file (inputLas + ".chunks.npz")
+and is rebuilt automatically when the file is newer than the index.
+
+MANDATORY: inputLas
+OUTPUT: dictionary with start, count, mins and maxs arrays (one row per chunk)
+"""
+
+CHUNK_INDEX_SUFFIX = ".chunks.npz"
+DEFAULT_CHUNK_POINTS = 50_000
+
+
+def build_chunk_index(inputLas, n_threads=1):
+    import laspy
+
+    if n_threads == 1:
+        laz_backend = laspy.LazBackend.Lazrs
+    else:
+        laz_backend = laspy.LazBackend.LazrsParallel
+
+    with laspy.open(
+        inputLas,
+        laz_backend=laz_backend,
+        decompression_selection=_decompression_selection(["x", "y", "z"]),
+    ) as reader:
+        chunk_points = _laz_chunk_size(reader.header)
+        start = []
+        count = []
+        mins = []
+        maxs = []
+        first = 0
+        for points in reader.chunk_iterator(chunk_points):
+            X = np.asarray(points.x)
+            Y = np.asarray(points.y)
+            Z = np.asarray(points.z)
+            start.append(first)
+            count.append(len(X))
+            mins.append((X.min(), Y.min(), Z.min()))
+            maxs.append((X.max(), Y.max(), Z.max()))
+            first += len(X)
+
+    index = {
+        "start": np.array(start, dtype=np.int64),
+        "count": np.array(count, dtype=np.int64),
+        "mins": np.array(mins, dtype=np.float64).reshape(-1, 3),
+        "maxs": np.array(maxs, dtype=np.float64).reshape(-1, 3),
+    }
+    np.savez(inputLas + CHUNK_INDEX_SUFFIX, **index)
+    return index
+
+
+def load_chunk_index(inputLas, n_threads=1):
+    import os
+
+    index_file = inputLas + CHUNK_INDEX_SUFFIX
+    if os.path.exists(index_file) and (
+        os.path.getmtime(index_file) >= os.path.getmtime(inputLas)
+    ):
+        with np.load(index_file) as data:
+            return {key: data[key] for key in data.files}
+    return build_chunk_index(inputLas, n_threads)
+
+
+def _laz_chunk_size(header):
+    import laspy
+    import lazrs
+
+    for vlr in header.vlrs:
+        if isinstance(vlr, laspy.vlrs.known.LasZipVlr):
+            laz_vlr = lazrs.LazVlr(vlr.record_data)
+            if not laz_vlr.uses_variable_size_chunks():
+                return laz_vlr.chunk_size()
+    return DEFAULT_CHUNK_POINTS
+
+
+"""
+READ THE POINTS INSIDE A BOUNDING BOX OR A POLYGON
+
+Only the chunks whose bounding box intersects the window are decompressed, so the cost of
+clipping a single tree from a plot is proportional to the tree and not to the plot.
+
+MANDATORY: inputLas and bbox or/and polygon (see ReadLaz)
+OPTIONAL: fields, n_threads, quantized (see ReadLaz)
+          E.G: TREE=ReadLaz.read_window(inputLas, bbox=[x-r, y-r, x+r, y+r])
+"""
+
+
+def read_window(inputLas, bbox=None, polygon=None, fields=None, n_threads=1, quantized=False):
+    import laspy
+
+    if bbox is None and polygon is None:
+        raise ValueError("Please inform a bbox or a polygon")
+
+    t1_start = time.perf_counter()
+
+    lower = np.full(3, -np.inf)
+    upper = np.full(3, np.inf)
+    if bbox is not None:
+        bbox = np.asarray(bbox, dtype=np.float64)
+        if len(bbox) == 4:
+            lower[:2], upper[:2] = bbox[:2], bbox[2:]
+        elif len(bbox) == 6:
+            lower, upper = bbox[:3], bbox[3:]
+        else:
+            raise ValueError("bbox must have 4 or 6 values")
+    if polygon is not None:
+        from matplotlib.path import Path
+
+        polygon = np.asarray(polygon, dtype=np.float64)
+        lower[:2] = np.maximum(lower[:2], polygon.min(axis=0))
+        upper[:2] = np.minimum(upper[:2], polygon.max(axis=0))
+        polygon = Path(polygon)
+
+    index = load_chunk_index(inputLas, n_threads)
+    selected = np.all((index["maxs"] >= lower) & (index["mins"] <= upper), axis=1)
+
+    if n_threads == 1:
+        laz_backend = laspy.LazBackend.Lazrs
+    else:
+        laz_backend = laspy.LazBackend.LazrsParallel
+
+    # XY AND Z ARE NEEDED FOR THE FILTER EVEN IF THEY WERE NOT REQUESTED
+    selection_fields = None if fields is None else list(fields) + ["x", "y", "z"]
+    parts = []
+    with laspy.open(
+        inputLas,
+        laz_backend=laz_backend,
+        decompression_selection=_decompression_selection(selection_fields),
+    ) as reader:
+        check_fields(fields, reader.header.point_format.extra_dimension_names)
+        ExtraBytes_name = [
+            name
+            for name in reader.header.point_format.extra_dimension_names
+            if fields is None or name in fields
+        ]
+        for start, count in _chunk_runs(index["start"][selected], index["count"][selected]):
+            reader.seek(start)
+            points = reader.read_points(count)
+            X = np.asarray(points.x)
+            Y = np.asarray(points.y)
+            Z = np.asarray(points.z)
+            inside = (
+                (X >= lower[0]) & (X <= upper[0])
+                & (Y >= lower[1]) & (Y <= upper[1])
+                & (Z >= lower[2]) & (Z <= upper[2])
+            )
+            if polygon is not None and np.any(inside):
+                inside[inside] = polygon.contains_points(
+                    np.column_stack((X[inside], Y[inside]))
+                )
+            parts.append(points.array[inside])
+
+        point_format = reader.header.point_format
+        points = laspy.ScaleAwarePointRecord(
+            np.concatenate(parts) if parts else np.zeros(0, point_format.dtype()),
+            point_format,
+            reader.header.scales,
+            reader.header.offsets,
+        )
+
+    print(
+        "\n Window reading Elapsed time: %.1f [sec], %d of %d chunks"
+        % (time.perf_counter() - t1_start, np.count_nonzero(selected), len(selected))
+    )
+    return _points_to_atributes(points, ExtraBytes_name, fields, quantized)
+
+
+def _chunk_runs(start, count):
+    # MERGE CONSECUTIVE CHUNKS SO THAT EACH RUN NEEDS A SINGLE SEEK
+    runs = []
+    for s, c in zip(start.tolist(), count.tolist()):
+        if runs and runs[-1][0] + runs[-1][1] == s:
+            runs[-1][1] += c
+        else:
+            runs.append([s, c])
+    return runs
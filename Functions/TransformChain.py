@@ -0,0 +1,157 @@
+"""
+THIS SCRIPT COMPOSES THE COORDINATE TRANSFORMATIONS OF THE WORKFLOW INTO A SINGLE 4x4 MATRIX
+
+Steps 01 and 02 transform the coordinates three times: rectification (Processing.RectifLaz),
+georeferencing (Processing.HELMERT3D) and the georef offsets subtracted before writing.
+A TransformChain composes them once, so every point is transformed by one matrix product:
+
+    [x1, y1, z1, 1] = M . [x, y, z, 1]      M = OFFSETS . HELMERT . RECTIFICATION
+
+The chain is applied in one pass by Processing.apply_affine (numba threads) and is saved
+as YAML, so the workflow config can point to it. offsets holds the georef offsets of the chain (the offsets of the output file).
+
+E.G: CHAIN = TransformChain().rectify(Transformation(config)).helmert(ReferencePoints).offset(offsets)
+     CHAIN.save("georef_chain.yml")
+     x1, y1, z1 = TransformChain.load("georef_chain.yml").apply(x, y, z, num_cores=8)
+
+     python TransformChain.py georef_chain.yml --rectification ../workflow/01/user_config.yml
+            --helmert reference_points_local.csv reference_points_global.csv
+            --offsets 357676.852 6860035.171 0
+"""
+import numpy as np
+
+
+class TransformChain:
+    def __init__(self, matrix=None, offsets=None, steps=None):
+        self.matrix = np.eye(4) if matrix is None else np.asarray(matrix, dtype=np.float64)
+        self.offsets = None if offsets is None else np.asarray(offsets, dtype=np.float64)
+        self.steps = list(steps or [])
+
+    def __repr__(self):
+        return f"TransformChain(steps={self.steps})"
+
+    """
+    ADD A TRANSFORMATION AFTER THE ONES ALREADY IN THE CHAIN (X1 = Rot.X + T)
+
+    then(Rot, T, name) - any affine transformation
+    rectify(transformation) - rotation and translation of Processing.RectifLaz
+    helmert(MatchPoints, parameters_file) - affine estimated (or read from the cache file) by
+                                            Processing.HELMERT3D_PARAMETERS
+    offset(offsets) - subtract the georef offsets, as written by the workflow (float32 offsets)
+    """
+
+    def then(self, Rot=None, T=None, name="affine"):
+        step = np.eye(4)
+        if Rot is not None:
+            step[:3, :3] = Rot
+        if T is not None:
+            step[:3, 3] = T
+        return TransformChain(step @ self.matrix, self.offsets, self.steps + [name])
+
+    def rectify(self, transformation):
+        import Processing
+
+        Rot, T = Processing.RECTIFY_MATRIX(transformation)
+        return self.then(Rot, T, "rectify")
+
+    def helmert(self, MatchPoints, parameters_file=None):
+        import Processing
+
+        AFIM_I, T = Processing.HELMERT3D_PARAMETERS(MatchPoints, parameters_file)
+        return self.then(AFIM_I, -AFIM_I.dot(T), "helmert")
+
+    def offset(self, offsets):
+        offsets = np.asarray(offsets, dtype=np.float32).astype(np.float64)
+        chain = self.then(None, -offsets, "offset")
+        chain.offsets = offsets if self.offsets is None else self.offsets + offsets
+        return chain
+
+    """
+    APPLY THE CHAIN - SAME OUTPUT AS Processing.rectify_point_cloud_parallel
+
+    OPTIONAL: num_cores - number of numba threads
+              in_place - write the result into x, y, z (writeable C-contiguous float64 arrays)
+    """
+
+    def apply(self, x, y, z, num_cores=1, in_place=False):
+        import Processing
+
+        Rot, T = self.matrix[:3, :3], self.matrix[:3, 3]
+        return Processing.apply_affine(x, y, z, Rot, T, num_cores, in_place)
+
+    """
+    YAML SERIALIZATION
+
+    to_config() / from_config(config) - plain dict with matrix, offsets and steps, e.g. to be
+                                        stored under a key of user_config.yml
+    save(path) / load(path) - the same dict in a YAML file
+    """
+
+    def to_config(self):
+        return {
+            "matrix": self.matrix.tolist(),
+            "offsets": None if self.offsets is None else self.offsets.tolist(),
+            "steps": self.steps,
+        }
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config["matrix"], config.get("offsets"), config.get("steps"))
+
+    def save(self, path):
+        import yaml
+
+        with open(path, "w") as f:
+            yaml.safe_dump(self.to_config(), f, default_flow_style=None, sort_keys=False)
+
+    @classmethod
+    def load(cls, path):
+        import yaml
+
+        with open(path, "r") as f:
+            return cls.from_config(yaml.safe_load(f))
+
+
+def read_reference_points(local_csv, global_csv):
+    import csv
+
+    points = []
+    for path in (local_csv, global_csv):
+        values = []
+        with open(path) as inputfile:
+            for row in csv.reader(inputfile, quoting=csv.QUOTE_NONNUMERIC):
+                values.extend(row)
+        points.append(values)
+    return np.array(points, dtype=np.float32)
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+
+    import yaml
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+    parser = argparse.ArgumentParser(
+        description="Compose the rectification, Helmert 3D and offsets of steps 01-02 into one chain"
+    )
+    parser.add_argument("chain", help="YAML file of the chain")
+    parser.add_argument("--rectification", help="user_config.yml with the transformation parameters")
+    parser.add_argument("--helmert", nargs=2, metavar=("LOCAL_CSV", "GLOBAL_CSV"), help="reference points")
+    parser.add_argument("--helmert-parameters", help=".npz cache of the Helmert 3D parameters")
+    parser.add_argument("--offsets", nargs=3, type=float, help="georef offsets of the output")
+    args = parser.parse_args()
+
+    CHAIN = TransformChain()
+    if args.rectification is not None:
+        with open(args.rectification, "r") as f:
+            transformation = type("Transformation", (), yaml.safe_load(f)["transformation"])
+        CHAIN = CHAIN.rectify(transformation)
+    if args.helmert is not None:
+        CHAIN = CHAIN.helmert(read_reference_points(*args.helmert), args.helmert_parameters)
+    if args.offsets is not None:
+        CHAIN = CHAIN.offset(args.offsets)
+    CHAIN.save(args.chain)
+    print(CHAIN, "saved to", args.chain)
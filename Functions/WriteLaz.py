@@ -33,9 +33,41 @@ from ctypes import *
 import numpy as np
 import time
 from numpy.ctypeslib import ndpointer
+from ReadLaz import resolve_backend
 import gc
 
-def WriteLaz (outputLas, DLLPATH, ATTRIBUTES, offsets, Value=[]):
+# STANDARD FIELDS WRITTEN BESIDES THE COORDINATES (LASPY NAME WHEN IT DIFFERS)
+LAZ_FIELDS = ["intensity", "return_number", "number_of_returns", "edge_of_flight_line", "scan_direction_flag", "classification", "scan_angle_rank", "point_source_ID", "gps_time"]
+LASPY_NAMES = {"point_source_ID": "point_source_id"}
+
+"""
+WRITE A LAS/LAZ FILE
+
+MANDATORY: outputLas, DLLPATH (may be None with the laspy backend), ATTRIBUTES, offsets
+OPTIONAL: Value - extra bytes matrix (NEB, NP) in the order of ATTRIBUTES.ExtraBytes_name
+          backend - "ctypes" (write with the DLL), "laspy" (write with LazWriter and the
+                    multi-threaded lazrs compressor) or "auto" (the DLL when DLLPATH exists,
+                    laspy otherwise)
+          n_threads - more than one thread uses the parallel lazrs compressor (laspy backend)
+A path ending with .pcstore is written to the columnar intermediate store (see PointStore),
+whatever the backend. compression (None or "zlib", for all columns or per column) is only
+used by the store.
+"""
+
+
+def WriteLaz (outputLas, DLLPATH, ATTRIBUTES, offsets, Value=[], backend="ctypes", compression=None, n_threads=1):
+    import PointStore
+
+    if PointStore.is_store(outputLas):
+        return PointStore.write_store(outputLas, ATTRIBUTES, offsets, Value, compression)
+
+    backend = resolve_backend(backend, DLLPATH)
+    if backend not in WRITE_BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, use one of {list(WRITE_BACKENDS)} or auto")
+    return WRITE_BACKENDS[backend](outputLas, DLLPATH, ATTRIBUTES, offsets, Value, n_threads)
+
+
+def _write_ctypes (outputLas, DLLPATH, ATTRIBUTES, offsets, Value=[], n_threads=1):
 
     t1_start = time.perf_counter()
     t2_start = time.process_time()
@@ -67,38 +99,38 @@ def WriteLaz (outputLas, DLLPATH, ATTRIBUTES, offsets, Value=[]):
                  ndpointer(c_float)] 
     
     
-    fields=[f for f in dir(ATTRIBUTES) if not callable(getattr(ATTRIBUTES,f)) and not f.startswith('__')]
-    LAZ_fields=["intensity", "return_number", "number_of_returns", "edge_of_flight_line", "scan_direction_flag", "classification", "scan_angle_rank", "point_source_ID", "gps_time"]
-    LAZ_fields=np.array(LAZ_fields); fields=np.array(fields)
-    
-    for att in LAZ_fields:
-        CheckFields=np.where(fields==att)
-        if np.shape(CheckFields)[1]==0:            
-            setattr (ATTRIBUTES, att, np.zeros((1, len(ATTRIBUTES.x))))            
-
+    # NAMES ONLY - GETTING EVERY ATTRIBUTE WOULD DECODE THE LAZY AND QUANTIZED COLUMNS
+    fields=getattr(ATTRIBUTES, 'field_names', None) or [f for f in dir(ATTRIBUTES) if not f.startswith('_')]
     
     DATAWRITE.restype = c_int
     string=(c_char_p)(FILE_NAME.encode('utf-8'))
-    x=np.array(ATTRIBUTES.x*1000, dtype=np.float64); 
-    y=np.array(ATTRIBUTES.y*1000, dtype=np.float64); 
-    z=np.array(ATTRIBUTES.z*1000, dtype=np.float64); 
-    intensity=np.array(ATTRIBUTES.intensity, dtype=np.float32);
-    return_number=np.array(ATTRIBUTES.return_number, dtype=np.int32); 
-    number_of_returns=np.array(ATTRIBUTES.number_of_returns, dtype=np.int32); 
-    edge_of_flight_line=np.array(ATTRIBUTES.edge_of_flight_line, dtype=np.int32); 
-    scan_direction_flag=np.array(ATTRIBUTES.scan_direction_flag, dtype=np.int32); 
-    classification=np.array(ATTRIBUTES.classification, dtype=np.int32);
-    scan_angle_rank=np.array(ATTRIBUTES.scan_angle_rank, dtype=np.short);
-    point_source_ID=np.array(ATTRIBUTES.point_source_ID, dtype=np.short);
-    gps_time=np.array(ATTRIBUTES.gps_time, dtype=np.float32);
+    
+    # THE DLL TAKES THE COORDINATES IN MILLIMETERS: ONE TEMPORARY PER COORDINATE
+    x=np.multiply(ATTRIBUTES.x, 1000, dtype=np.float64)
+    y=np.multiply(ATTRIBUTES.y, 1000, dtype=np.float64)
+    z=np.multiply(ATTRIBUTES.z, 1000, dtype=np.float64)
+    
+    # THE OTHER FIELDS ARE ONLY COPIED WHEN THEIR DTYPE OR LAYOUT DOES NOT MATCH
+    zeros={}
+    intensity=_c_buffer(ATTRIBUTES, 'intensity', np.float32, size, zeros)
+    return_number=_c_buffer(ATTRIBUTES, 'return_number', np.int32, size, zeros)
+    number_of_returns=_c_buffer(ATTRIBUTES, 'number_of_returns', np.int32, size, zeros)
+    edge_of_flight_line=_c_buffer(ATTRIBUTES, 'edge_of_flight_line', np.int32, size, zeros)
+    scan_direction_flag=_c_buffer(ATTRIBUTES, 'scan_direction_flag', np.int32, size, zeros)
+    classification=_c_buffer(ATTRIBUTES, 'classification', np.int32, size, zeros)
+    scan_angle_rank=_c_buffer(ATTRIBUTES, 'scan_angle_rank', np.short, size, zeros)
+    point_source_ID=_c_buffer(ATTRIBUTES, 'point_source_ID', np.short, size, zeros)
+    gps_time=_c_buffer(ATTRIBUTES, 'gps_time', np.float32, size, zeros)
+    offsets=np.ascontiguousarray(offsets, dtype=np.float32)
     
     #EXTRA PARAMETERS INFO
-    strArrayType=(c_char_p * 20)
+    strArrayType=(c_char_p * max(NEB, 1))
     strArray= strArrayType()
     
     if (NEB>0):
         for i in range (NEB):
             strArray[i] =  (EXTRABYTES[i].encode('utf-8'))
+        Value=np.ascontiguousarray(Value, dtype=np.float32)
         Value_pp = (Value.ctypes.data + np.arange(Value.shape[0]) * Value.strides[0]).astype(np.uintp)
     
     else:Value_pp=np.array(Value, dtype=np.uintp);
@@ -124,6 +156,149 @@ def WriteLaz (outputLas, DLLPATH, ATTRIBUTES, offsets, Value=[]):
     print ("LAZ CONTENT:", Default_atributes)   
     print ("LAZ EXTRA BYTES:", EXTRABYTES) 
     
-    del x, y, z, return_number, number_of_returns, intensity, size, NEB, strArray, Value, Value_pp
+    del x, y, z, zeros, size, NEB, strArray, Value, Value_pp
     gc.collect()
-    
+
+
+"""
+ARRAY PASSED TO THE DLL FOR ONE STANDARD FIELD
+
+The caller's array is passed as it is when it already has the dtype and the contiguous
+layout expected by the DLL. The DLL reads every field, so a missing field is sent as a
+buffer of zeros that is shared by all missing fields of the same dtype (np.zeros pages
+are only zero-filled by the system when they are touched).
+"""
+
+
+def _c_buffer(ATTRIBUTES, att, dtype, size, zeros):
+    if hasattr(ATTRIBUTES, att):
+        return np.ascontiguousarray(np.ravel(getattr(ATTRIBUTES, att)), dtype=dtype)
+    if dtype not in zeros:
+        zeros[dtype] = np.zeros(size, dtype=dtype)
+    return zeros[dtype]
+
+
+"""
+INCREMENTAL WRITER
+
+The DLL writes a whole point cloud in one call, so LazWriter writes through laspy (lazrs)
+instead. Points are appended chunk by chunk and the header bounds and point count are
+fixed up when the writer is closed, so the output can be larger than the memory.
+The file layout is the same as the one written by WriteLaz: LAS 1.4, point format 1,
+0.001 m scale, the given offsets and float32 extra bytes.
+
+MANDATORY: outputLas, offsets
+OPTIONAL: ExtraBytes_name, n_threads (more than one thread uses the parallel lazrs compressor)
+          E.G: with WriteLaz.LazWriter(outputLas, offsets, ExtraBytes_name) as writer:
+                   for chunk in ReadLaz.iter_chunks(inputLas):
+                       ...
+                       writer.write_chunk(MainContent, EXTRA)
+
+write_chunk takes the same ATTRIBUTES and Value arguments as WriteLaz, coordinates
+are relative to the offsets.
+"""
+
+
+class LazWriter:
+    def __init__(self, outputLas, offsets, ExtraBytes_name=[], n_threads=1):
+        import laspy
+
+        header = laspy.LasHeader(point_format=1, version="1.4")
+        header.scales = np.array([0.001, 0.001, 0.001])
+        header.offsets = np.array(offsets, dtype=np.float64)
+
+        # ONLY THE FIRST OF REPEATED EXTRA BYTES NAMES CAN BE STORED
+        self.extra_rows = []
+        for i, name in enumerate(ExtraBytes_name):
+            if name in header.point_format.extra_dimension_names:
+                print(f"Extra bytes {name} is repeated, skipping.")
+                continue
+            header.add_extra_dims([laspy.ExtraBytesParams(name, np.float32)])
+            self.extra_rows.append((i, name))
+
+        if n_threads == 1:
+            laz_backend = laspy.LazBackend.Lazrs
+        else:
+            laz_backend = laspy.LazBackend.LazrsParallel
+
+        self.header = header
+        self.npoints = 0
+        self.writer = laspy.open(outputLas, mode="w", header=header, laz_backend=laz_backend)
+        self.t1_start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_chunk(self, ATTRIBUTES, Value=[]):
+        import laspy
+
+        size = len(ATTRIBUTES.x) if getattr(ATTRIBUTES, "quantization", None) is None else len(ATTRIBUTES)
+        points = laspy.ScaleAwarePointRecord.zeros(size, header=self.header)
+        shift = self._grid_shift(ATTRIBUTES)
+        if shift is not None:
+            # QUANTIZED ON THE SAME GRID - THE INTEGERS ARE ONLY SHIFTED
+            points.X = ATTRIBUTES.X + shift[0]
+            points.Y = ATTRIBUTES.Y + shift[1]
+            points.Z = ATTRIBUTES.Z + shift[2]
+        else:
+            points.X = np.round(np.asarray(ATTRIBUTES.x) * 1000)
+            points.Y = np.round(np.asarray(ATTRIBUTES.y) * 1000)
+            points.Z = np.round(np.asarray(ATTRIBUTES.z) * 1000)
+
+        # BIT FIELDS HAVE NO DTYPE IN LASPY AND ONLY ACCEPT INTEGERS
+        for att in LAZ_FIELDS:
+            if hasattr(ATTRIBUTES, att):
+                name = LASPY_NAMES.get(att, att)
+                dtype = self.header.point_format.dimension_by_name(name).dtype
+                points[name] = np.asarray(getattr(ATTRIBUTES, att)).astype(dtype or np.uint8)
+
+        for i, name in self.extra_rows:
+            points[name] = Value[i]
+
+        self.writer.write_points(points)
+        self.npoints += size
+
+    def _grid_shift(self, ATTRIBUTES):
+        quantization = getattr(ATTRIBUTES, "quantization", None)
+        if quantization is None:
+            return None
+        scales, offsets = quantization
+        shift = offsets / self.header.scales
+        if not np.allclose(scales, self.header.scales) or not np.allclose(shift, np.round(shift), rtol=0, atol=1e-6):
+            return None
+        return np.round(shift).astype(np.int64)
+
+    def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
+        print("\n Writing Elapsed time: %.1f [sec]" % (time.perf_counter() - self.t1_start))
+        print("POINTS WRITTEN:", self.npoints)
+
+
+"""
+OPEN THE INCREMENTAL WRITER OF A PATH - StoreWriter FOR .pcstore, LazWriter OTHERWISE
+
+E.G: with WriteLaz.open_writer(outputLas, offsets, ExtraBytes_name, n_threads) as writer:
+         writer.write_chunk(MainContent, EXTRA)
+"""
+
+
+def open_writer(outputLas, offsets, ExtraBytes_name=[], n_threads=1, compression=None):
+    import PointStore
+
+    if PointStore.is_store(outputLas):
+        return PointStore.StoreWriter(outputLas, offsets, ExtraBytes_name, compression)
+    return LazWriter(outputLas, offsets, ExtraBytes_name, n_threads)
+
+
+def _write_laspy(outputLas, DLLPATH, ATTRIBUTES, offsets, Value=[], n_threads=1):
+    with LazWriter(outputLas, offsets, ATTRIBUTES.ExtraBytes_name, n_threads) as writer:
+        writer.write_chunk(ATTRIBUTES, Value)
+
+
+WRITE_BACKENDS = {"ctypes": _write_ctypes, "laspy": _write_laspy}
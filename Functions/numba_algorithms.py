@@ -1,9 +1,11 @@
 import numba as nb
 import math
 import numpy as np
+from contextlib import contextmanager
 from numba import jit
 
-@nb.njit(nb.types.UniTuple(nb.float64,2)(nb.float64[:]), fastmath=True)
+# FLOAT32 FOR THE LOCAL COORDINATES OF QUANTIZED POINT CLOUDS (PointCloud.local_xyz)
+@nb.njit([nb.types.UniTuple(nb.float64,2)(nb.float64[:]), nb.types.UniTuple(nb.float64,2)(nb.float32[:])], fastmath=True)
 def minmax(a):
     N = a.size
     odd = N % 2
@@ -29,65 +31,308 @@ def minmax(a):
     return minv, maxv
 
 
-mean_count_type = nb.core.types.Tuple((nb.float64, nb.float64, nb.float64, nb.uint32, nb.float32))
-#mean_count_type = nb.types.Tuple((nb.float64, nb.float64, nb.float64, nb.uint32))
+#VOXEL GRID ENGINE
+#The voxels of a grid of side voxel_size starting at the minimum of x, y, z are numbered with an
+#int64 key (ix + iy*nx + iz*nx*ny). The points are grouped by key with a stable sort and every
+#voxel is reduced by one thread, adding its points in their original order, so the sums are
+#exactly the ones of a sequential loop over the points.
+#   keys = voxel_keys(x, y, z, voxel_size)
+#   unique_keys, counts, xyz_sums, att_sums = voxel_reduce(keys, x, y, z, att)
+#The voxels are returned in increasing key order
+
+#Bins of one axis, np.arange computed by numba like in the original compute_grid_means
+@nb.njit
+def voxel_bins(vmin, vmax, voxel_size):
+    return np.arange(vmin, vmax, voxel_size, dtype = np.float64)
+
+#Voxel index of every value: np.searchsorted(bins, value, side = 'right') - 1, computed from
+#the voxel size and corrected against the bins so the result is the same at the bin edges
+@nb.njit(parallel=True)
+def voxel_index(values, vmin, voxel_size, bins):
+    n = len(bins)
+    index = np.empty(len(values), dtype = np.int64)
+    for i in nb.prange(len(values)):
+        v = values[i]
+        k = int(math.floor((v - vmin)/voxel_size))
+        k = min(max(k, -1), n - 1)
+        while k + 1 < n and bins[k + 1] <= v:
+            k += 1
+        while k >= 0 and bins[k] > v:
+            k -= 1
+        index[i] = k
+    return index
+
+#With return_bins the bin edges of the three axes are returned too
+def voxel_keys(x, y, z, voxel_size, return_bins = False):
+    index = []
+    edges = []
+    for values in (x, y, z):
+        vmin, vmax = minmax(values)
+        bins = voxel_bins(vmin, vmax, voxel_size)
+        index.append(voxel_index(values, vmin, voxel_size, bins))
+        edges.append(bins)
+    nx, ny = len(edges[0]), len(edges[1])
+    keys = index[0] + index[1]*nx + index[2]*(nx*ny)
+    if return_bins:
+        return keys, edges
+    return keys
+
+#Sums of the points of every group (order[starts[g]:starts[g+1]]), empty x or att are skipped
+#The sums are accumulated with the dtype of xyz_sums and att_sums
+@nb.njit(parallel=True)
+def voxel_sums(order, starts, x, y, z, att, counts, xyz_sums, att_sums):
+    N = len(order)
+    G = len(starts)
+    for g in nb.prange(G):
+        start = starts[g]
+        stop = starts[g + 1] if g + 1 < G else N
+        counts[g] = stop - start
+        if len(x) > 0:
+            for j in range(start, stop):
+                i = order[j]
+                xyz_sums[g, 0] = xyz_sums[g, 0] + x[i]
+                xyz_sums[g, 1] = xyz_sums[g, 1] + y[i]
+                xyz_sums[g, 2] = xyz_sums[g, 2] + z[i]
+        if len(att) > 0:
+            for j in range(start, stop):
+                att_sums[g] = att_sums[g] + att[order[j]]
+
+def _group_starts(sorted_keys):
+    if len(sorted_keys) == 0:
+        return np.empty(0, dtype = np.int64)
+    return np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+
+#order: stable argsort of keys, when the caller already has it
+#nogil: use the single-threaded kernel that releases the GIL (voxels reduced by a thread pool)
+def voxel_reduce(keys, x=None, y=None, z=None, att=None, att_dtype=np.float64, order=None, nogil=False):
+    if order is None:
+        order = np.argsort(keys, kind = 'stable')
+    sorted_keys = keys[order]
+    starts = _group_starts(sorted_keys)
+    G = len(starts)
+
+    empty = np.empty(0, dtype = np.float64)
+    counts = np.empty(G, dtype = np.int64)
+    xyz_sums = np.zeros((G if x is not None else 0, 3), dtype = np.float64)
+    att_sums = np.zeros(G if att is not None else 0, dtype = att_dtype)
+    kernel = voxel_sums_nogil if nogil else voxel_sums
+    kernel(order, starts,
+           empty if x is None else x, empty if y is None else y, empty if z is None else z,
+           empty if att is None else att, counts, xyz_sums, att_sums)
+    return sorted_keys[starts], counts, (xyz_sums if x is not None else None), (att_sums if att is not None else None)
+
+#Squared distance from p to the outside of the voxels lo..hi of one axis (bins are the lower edges)
+@nb.njit
+def _gap(p, bins, lo, hi):
+    d = np.inf
+    if lo > 0:
+        d = p - bins[lo]
+    if hi + 1 < len(bins):
+        d = min(d, bins[hi + 1] - p)
+    return d*d if d > 0 else 0.
+
+#Squared distance from p to the voxel a of one axis
+@nb.njit
+def _box_gap(p, bins, a):
+    if p < bins[a]:
+        return (bins[a] - p)**2
+    if a + 1 < len(bins) and p > bins[a + 1]:
+        return (p - bins[a + 1])**2
+    return 0.
+
+#Index of the point closest to the mean of every selected group (the lowest one when two are as close)
+#The members of the group are scanned first, then the rings of neighbouring voxels until no voxel
+#left can hold a closer point, so the result is the nearest point of the whole cloud (as a KD-tree)
+@nb.njit(parallel=True)
+def voxel_nearest(order, starts, unique_keys, bins_x, bins_y, bins_z, x, y, z, means, groups, nearest):
+    N = len(order)
+    G = len(starts)
+    nx, ny, nz = len(bins_x), len(bins_y), len(bins_z)
+    for s in nb.prange(len(groups)):
+        g = groups[s]
+        mx, my, mz = means[s, 0], means[s, 1], means[s, 2]
+        best = order[starts[g]]
+        best_d = np.inf
+        for j in range(starts[g], starts[g + 1] if g + 1 < G else N):
+            i = order[j]
+            d = (x[i] - mx)**2 + (y[i] - my)**2 + (z[i] - mz)**2
+            if d < best_d or (d == best_d and i < best):
+                best_d = d
+                best = i
+        if nx > 0 and ny > 0 and nz > 0:
+            key = unique_keys[g]
+            ix, iy, iz = key % nx, (key // nx) % ny, key // (nx*ny)
+            r = 1
+            while True:
+                #Closest distance of a point outside the voxels already scanned
+                gap = min(_gap(mx, bins_x, ix - r + 1, ix + r - 1),
+                          _gap(my, bins_y, iy - r + 1, iy + r - 1),
+                          _gap(mz, bins_z, iz - r + 1, iz + r - 1))
+                if gap > best_d or (ix - r < 0 and iy - r < 0 and iz - r < 0
+                                    and ix + r >= nx and iy + r >= ny and iz + r >= nz):
+                    break
+                for a in range(max(ix - r, 0), min(ix + r, nx - 1) + 1):
+                    ga = _box_gap(mx, bins_x, a)
+                    for b in range(max(iy - r, 0), min(iy + r, ny - 1) + 1):
+                        gb = _box_gap(my, bins_y, b)
+                        for c in range(max(iz - r, 0), min(iz + r, nz - 1) + 1):
+                            if max(abs(a - ix), abs(b - iy), abs(c - iz)) != r:
+                                continue
+                            #Voxels farther than the best point are not looked up
+                            if ga + gb + _box_gap(mz, bins_z, c) > best_d:
+                                continue
+                            k = a + b*nx + c*(nx*ny)
+                            h = np.searchsorted(unique_keys, k)
+                            if h == G or unique_keys[h] != k:
+                                continue
+                            for j in range(starts[h], starts[h + 1] if h + 1 < G else N):
+                                i = order[j]
+                                d = (x[i] - mx)**2 + (y[i] - my)**2 + (z[i] - mz)**2
+                                if d < best_d or (d == best_d and i < best):
+                                    best_d = d
+                                    best = i
+                r += 1
+        nearest[s] = best
 
 #Compute the mean x,y and z for given voxel size for voxels with at least pts_min points
+#The attribute is accumulated in float32 like in the original typed-dict implementation
+#With return_nearest the index of the point of each voxel closest to its mean is also returned,
+#found in the same grouping as the means (no KD-tree)
+def compute_grid_means(x,y,z, att ,voxel_size,pts_min, return_nearest = False): 
+    keys, bins = voxel_keys(x, y, z, voxel_size, return_bins = True)
+    return grid_means(keys, bins, x, y, z, att, pts_min, return_nearest)[1:]
+
+#compute_grid_means for keys and bins already given by voxel_keys (e.g. the points of a tile),
+#the keys of the voxels kept are returned first
+def grid_means(keys, bins, x, y, z, att, pts_min, return_nearest = False, nogil = False):
+    order = np.argsort(keys, kind = 'stable')
+    unique_keys, counts, xyz_sums, att_sums = voxel_reduce(keys, x, y, z, att, np.float32, order, nogil)
+    valid, means, MeanReflec = voxel_means(counts, xyz_sums, att_sums, pts_min)
+    if not return_nearest:
+        return unique_keys[valid], means, MeanReflec
+
+    nearest = np.empty(len(means), dtype = np.int64)
+    kernel = voxel_nearest_nogil if nogil else voxel_nearest
+    kernel(order, _group_starts(keys[order]), unique_keys, bins[0], bins[1], bins[2],
+           x, y, z, means, np.flatnonzero(valid), nearest)
+    return unique_keys[valid], means, MeanReflec, nearest
+
+#Means of the voxels that have more than pts_min points
+def voxel_means(counts, xyz_sums, att_sums, pts_min):
+    valid = counts > pts_min
+    means = xyz_sums[valid] / counts[valid, None]
+    #float32 division, as numba typed the original att_mean/count
+    MeanReflec = (att_sums[valid] / counts[valid].astype(np.float32)).astype(np.float64)
+    return valid, means, MeanReflec
+
+#Single-threaded copies of the voxel kernels that release the GIL, so several tiles can be
+#reduced at the same time by a thread pool without nesting the numba threads
+voxel_sums_nogil = nb.njit(nogil=True)(voxel_sums.py_func)
+voxel_nearest_nogil = nb.njit(nogil=True)(voxel_nearest.py_func)
+
+#LOD PYRAMID
+#The voxels of every size of voxel_sizes (increasing, each one a whole multiple m of the previous
+#one) from a single sort of the points. A voxel of level k+1 is made of m x m x m voxels of level
+#k (its bins are bins[::m]), so every coarser level only sorts the voxels of the finer one and
+#adds their sums, and its points are the point ranges of those voxels.
+#Yields for every level: bins, unique_keys, counts, xyz_sums, att_sums, order, starts
+#(the points of voxel g are order[starts[g]:starts[g+1]])
+def voxel_pyramid(x, y, z, att, voxel_sizes, att_dtype = np.float32):
+    ratios = [1]
+    for k in range(1, len(voxel_sizes)):
+        m = voxel_sizes[k] / voxel_sizes[k - 1]
+        if m < 1 or abs(m - round(m)) > 1e-6*m:
+            raise ValueError("Every voxel size must be a whole multiple of the previous one")
+        ratios.append(int(round(m)))
+
+    keys, bins = voxel_keys(x, y, z, voxel_sizes[0], return_bins = True)
+    order = np.argsort(keys, kind = 'stable')
+    unique_keys, counts, xyz_sums, att_sums = voxel_reduce(keys, x, y, z, att, att_dtype, order)
+    starts = _group_starts(keys[order])
+    del keys
+    for m in ratios:
+        if m > 1:
+            nx, ny = max(len(bins[0]), 1), max(len(bins[1]), 1)
+            ix, iy, iz = unique_keys % nx, (unique_keys // nx) % ny, unique_keys // (nx*ny)
+            bins = [b[::m] for b in bins]
+            cx, cy = max(len(bins[0]), 1), max(len(bins[1]), 1)
+            coarse = ix // m + (iy // m)*cx + (iz // m)*(cx*cy)
+            vorder = np.argsort(coarse, kind = 'stable')
+            vstarts = _group_starts(coarse[vorder])
+            order = regroup(order, starts, counts, vorder)
+            unique_keys = coarse[vorder][vstarts]
+            xyz_sums = np.add.reduceat(xyz_sums[vorder], vstarts, axis = 0)
+            att_sums = np.add.reduceat(att_sums[vorder], vstarts)
+            counts = np.add.reduceat(counts[vorder], vstarts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        yield bins, unique_keys, counts, xyz_sums, att_sums, order, starts
+
+#Points of the voxels taken in the order vorder (the points of voxel v are
+#order[starts[v]:starts[v] + counts[v]])
 @nb.njit
+def regroup(order, starts, counts, vorder):
+    points = np.empty(len(order), dtype = np.int64)
+    n = 0
+    for v in vorder:
+        for j in range(starts[v], starts[v] + counts[v]):
+            points[n] = order[j]
+            n += 1
+    return points
 
-def compute_grid_means(x,y,z, att ,voxel_size,pts_min): 
-    N = len(x)
-    #divide the space into uniform cubes (voxels) with side length voxel_size meters
-    min_x, max_x = minmax(x)
-    min_y, max_y = minmax(y)
-    min_z, max_z = minmax(z)
-    
-#    voxel_sizez=0.5
-    
-    bins_x = np.arange(min_x, max_x, voxel_size, dtype = np.float64)
-    bins_y = np.arange(min_y, max_y, voxel_size, dtype = np.float64)
-    bins_z = np.arange(min_z, max_z, voxel_size, dtype = np.float64)
-
-    nx = len(bins_x)
-    ny = len(bins_y)
-    nz = len(bins_z)
-    #Hold the (linear) voxel indices and the sum of x,y,z of all points in the voxel
-    #as well as the amount points
-    d = nb.typed.Dict.empty(
-            key_type = nb.types.uint32,
-            value_type = mean_count_type) 
-    #Loop over data and accumulate the dictionary
-    for i in range(N):
-        xx = x[i]
-        yy = y[i]
-        zz = z[i]
-        att_voxel=att[i]
-        x_voxel = np.searchsorted(bins_x, xx, side = 'right') - 1
-        y_voxel = np.searchsorted(bins_y, yy, side = 'right') - 1
-        z_voxel = np.searchsorted(bins_z, zz, side = 'right') - 1
-        linear_index = x_voxel + y_voxel*nx + z_voxel*nx*ny
-        try:
-            old = d[linear_index]
-            d[linear_index] = (old[0] + xx, old[1] + yy, old[2] + zz, old[3] + 1, old[4]+att_voxel) 
-        except:
-            d[linear_index] = (xx, yy, zz, 1, att_voxel)
-    #Determine voxels that have more than pts_min points
+#XY TILES OF THE VOXEL GRID
+#A tile holds tx by ty voxels (whole columns of the grid), numbered ix//tx + (iy//ty)*ntx
+
+#Tile of every key
+def voxel_tile(keys, nx, ny, tx, ty):
+    ntx = -(-nx // tx)
+    return (keys % nx) // tx + ((keys // nx) % ny) // ty * ntx
+
+#Points of every tile, counting sort of the tile of each key (stable): the points of tile t are
+#order[starts[t]:starts[t+1]], in increasing index
+@nb.njit
+def voxel_tiles(keys, nx, ny, tx, ty):
+    ntx = -(-nx // tx)
+    nty = -(-ny // ty)
+    tiles = np.empty(len(keys), dtype = np.int64)
+    starts = np.zeros(ntx*nty + 1, dtype = np.int64)
+    for i in range(len(keys)):
+        t = (keys[i] % nx) // tx + ((keys[i] // nx) % ny) // ty * ntx
+        tiles[i] = t
+        starts[t + 1] += 1
+    for t in range(ntx*nty):
+        starts[t + 1] += starts[t]
+    fill = starts[:-1].copy()
+    order = np.empty(len(keys), dtype = np.int64)
+    for i in range(len(keys)):
+        order[fill[tiles[i]]] = i
+        fill[tiles[i]] += 1
+    return order, starts
+
+#Points of tile t and of the voxels of the neighbouring tiles closer than halo voxels to it,
+#in increasing index (whole voxels, so their means are the ones of the whole cloud)
+@nb.njit(nogil=True)
+def tile_points(order, starts, keys, nx, ny, tx, ty, t, halo):
+    ntx = -(-nx // tx)
+    nty = -(-ny // ty)
+    tix, tiy = t % ntx, t // ntx
+    x0, x1 = tix*tx - halo, (tix + 1)*tx + halo
+    y0, y1 = tiy*ty - halo, (tiy + 1)*ty + halo
     n = 0
-    nonzeros = set()
-    for key, value in d.items():
-        if value[3] > pts_min:
-            n+=1
-            nonzeros.add(key)
-    i = 0
-    means = np.zeros((n,3), dtype = np.float64)
-    MeanReflec = np.zeros((n,), dtype = np.float64)
-    #Calculate mean x,y,z for each voxel with enough points
-    for key in nonzeros:
-        xx, yy, zz, count, att_mean = d[key]
-        means[i] = np.array([xx, yy, zz])/count
-        MeanReflec[i] = np.array(att_mean)/count
-        i += 1
-    return means, MeanReflec
+    for a in range(max(tix - 1, 0), min(tix + 1, ntx - 1) + 1):
+        for b in range(max(tiy - 1, 0), min(tiy + 1, nty - 1) + 1):
+            n += starts[a + b*ntx + 1] - starts[a + b*ntx]
+    points = np.empty(n, dtype = np.int64)
+    n = 0
+    for a in range(max(tix - 1, 0), min(tix + 1, ntx - 1) + 1):
+        for b in range(max(tiy - 1, 0), min(tiy + 1, nty - 1) + 1):
+            for j in range(starts[a + b*ntx], starts[a + b*ntx + 1]):
+                i = order[j]
+                ix = keys[i] % nx
+                iy = (keys[i] // nx) % ny
+                if ix >= x0 and ix < x1 and iy >= y0 and iy < y1:
+                    points[n] = i
+                    n += 1
+    return np.sort(points[:n])
 
 @nb.njit
 def rot_fi_k(x, y, z, fi, k):
@@ -111,3 +356,55 @@ def rot_fi_k(x, y, z, fi, k):
     #Rotate first by fi and then by k
     result = np.dot(Rot, np.vstack((x,y,z)))
     return result
+
+#Number of numba threads inside a with block, the previous (process-wide) number is restored
+#when the block exits, also on errors
+#   with num_threads(num_cores):
+#       rigid_transform(x, y, z, Rot, T, x1, y1, z1)
+@contextmanager
+def num_threads(n):
+    previous = nb.get_num_threads()
+    nb.set_num_threads(max(1, min(n, nb.config.NUMBA_NUM_THREADS)))
+    try:
+        yield
+    finally:
+        nb.set_num_threads(previous)
+
+#Rigid body transformation X1 = Rot.X + T of every point, written to x1,y1,z1
+#The points are split between the numba threads (num_threads), nothing is copied
+#x1,y1,z1 may be x,y,z themselves to transform in place
+@nb.njit(parallel=True)
+def rigid_transform(x, y, z, Rot, T, x1, y1, z1):
+    for i in nb.prange(len(x)):
+        xx = x[i]
+        yy = y[i]
+        zz = z[i]
+        x1[i] = Rot[0, 0]*xx + Rot[0, 1]*yy + Rot[0, 2]*zz + T[0]
+        y1[i] = Rot[1, 0]*xx + Rot[1, 1]*yy + Rot[1, 2]*zz + T[1]
+        z1[i] = Rot[2, 0]*xx + Rot[2, 1]*yy + Rot[2, 2]*zz + T[2]
+
+#Range, Theta and Phi (degrees) of every point seen from the origin of the scanner, written to
+#Range, Theta, Phi (e.g. rows of the extra bytes block). Theta and Phi are clamped to the
+#angular setup of the scanner (radians). No temporary array is created
+@nb.njit(parallel=True, error_model="numpy")
+def range_theta_phi(x, y, z, thetaStart, thetaStop, phiStart, phiStop, Range, Theta, Phi):
+    for i in nb.prange(len(x)):
+        r = math.sqrt(x[i]*x[i] + y[i]*y[i] + z[i]*z[i])
+
+        phi = math.atan2(y[i], x[i])
+        if phi < 0:
+            phi = 2*math.pi + phi
+        if phi < phiStart:
+            phi = phiStart
+        if phi > phiStop:
+            phi = phiStop
+
+        theta = math.acos(z[i] / r)
+        if theta < thetaStart:
+            theta = thetaStart
+        if theta > thetaStop:
+            theta = thetaStop
+
+        Range[i] = r
+        Theta[i] = theta*180/math.pi
+        Phi[i] = phi*180/math.pi
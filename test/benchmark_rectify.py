@@ -0,0 +1,64 @@
+"""
+BENCHMARK OF THE RECTIFICATION OF STEP 01 (Processing.RectifLaz and rectify_point_cloud_parallel)
+
+Prints the time of each implementation and the speedup of the parallel one for 1, 2, 4, ...
+threads, up to the number of cores of the machine (or config["cores"]).
+
+E.G: python test/benchmark_rectify.py 20000000
+     python test/benchmark_rectify.py 20000000 8
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Functions"))
+import Processing
+
+
+class Transformation:
+    w = 12.5
+    fi = -3.2
+    k = 97.0
+    x = 100.0
+    y = 200.0
+    z = 5.0
+
+
+def best_time(function, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == "__main__":
+    npoints = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    max_cores = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    rng = np.random.default_rng(0)
+    x, y, z = rng.uniform(-50, 50, (3, npoints))
+    print(f"{npoints} points")
+
+    # FIRST CALL COMPILES THE NUMBA KERNEL
+    Processing.rectify_point_cloud_parallel(x[:10], y[:10], z[:10], Transformation, 1)
+
+    serial, reference = best_time(lambda: Processing.RectifLaz(x, y, z, Transformation))
+    print(f"RectifLaz: {serial:.3f} s")
+
+    cores = 1
+    while True:
+        elapsed, result = best_time(
+            lambda: Processing.rectify_point_cloud_parallel(x, y, z, Transformation, cores)
+        )
+        error = max(np.abs(a - b).max() for a, b in zip(result, reference))
+        print(
+            f"rectify_point_cloud_parallel, {cores} cores: {elapsed:.3f} s, "
+            f"speedup {serial / elapsed:.1f}x, max difference {error:.1e} m"
+        )
+        if cores >= max_cores:
+            break
+        cores = min(2 * cores, max_cores)
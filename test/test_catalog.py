@@ -0,0 +1,117 @@
+"""
+TESTS OF THE HEADER-ONLY CATALOG (Functions/Catalog.py)
+
+E.G: python -m pytest test/test_catalog.py
+"""
+import json
+import os
+import sys
+
+import laspy
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Functions"))
+import Catalog
+import PointStore
+from PointCloud import PointCloud
+
+# LOWER LEFT CORNER OF EACH 10 x 10 m TREE FILE
+TREES = {11744: (0, 0), 11754: (20, 0), 11772: (0, 20), 11790: (20, 20)}
+
+
+def write_tree(path, corner, npoints=200, seed=0):
+    rng = np.random.default_rng(seed)
+    header = laspy.LasHeader(point_format=1, version="1.4")
+    header.offsets = [0, 0, 0]
+    header.scales = [0.001, 0.001, 0.001]
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Reflectance", type=np.float32))
+    las = laspy.LasData(header)
+    las.x = corner[0] + rng.uniform(0, 10, npoints)
+    las.y = corner[1] + rng.uniform(0, 10, npoints)
+    las.z = rng.uniform(0, 20, npoints)
+    las.Reflectance = rng.normal(size=npoints).astype(np.float32)
+    las.write(path)
+
+
+def build_catalog(tmp_path):
+    trees = tmp_path / "single_trees"
+    trees.mkdir()
+    for seed, (tree_id, corner) in enumerate(TREES.items()):
+        extension = "laz" if seed % 2 == 0 else "las"
+        write_tree(str(trees / f"Sample_R_GeorefTREE_{tree_id}.{extension}"), corner, seed=seed)
+
+    CHUNK = PointCloud({"x": np.array([50.0, 55.0]), "y": np.array([50.0, 52.0]), "z": np.array([1.0, 2.0])})
+    PointStore.write_store(str(tmp_path / "plot.pcstore"), CHUNK, [0, 0, 0])
+
+    catalog = str(tmp_path / "catalog.sqlite")
+    records = Catalog.scan_headers([str(trees), str(tmp_path / "plot.pcstore")], n_jobs=2)
+    Catalog.write_catalog(catalog, records)
+    return catalog, str(trees)
+
+
+def test_scan_headers(tmp_path):
+    catalog, trees = build_catalog(tmp_path)
+
+    TREE = Catalog.query_catalog(catalog, directory=trees)[0]
+
+    assert TREE["name"] == "Sample_R_GeorefTREE_11744.laz"
+    assert TREE["format"] == "laz"
+    assert TREE["point_format"] == 1
+    assert TREE["point_count"] == 200
+    assert TREE["tree_id"] == 11744
+    assert TREE["extra_bytes"] == ["Reflectance"]
+    assert 0 <= TREE["min_x"] <= TREE["max_x"] <= 10
+    assert 0 <= TREE["min_y"] <= TREE["max_y"] <= 10
+
+
+def test_query_catalog_bbox(tmp_path):
+    catalog, trees = build_catalog(tmp_path)
+
+    def tree_ids(bbox, **kwargs):
+        return sorted(TREE["tree_id"] for TREE in Catalog.query_catalog(catalog, bbox=bbox, **kwargs))
+
+    assert tree_ids([-5, -5, 5, 5]) == [11744]
+    # ACROSS TWO FILES ALONG X, THEN IN THE GAP BETWEEN THE FILES
+    assert tree_ids([5, 2, 25, 8]) == [11744, 11754]
+    assert tree_ids([12, 12, 18, 18]) == []
+    assert tree_ids([-100, -100, 100, 100], directory=trees) == sorted(TREES)
+    assert tree_ids([-100, -100, 100, 100], formats=["las"]) == [11754, 11790]
+
+    STORES = Catalog.query_catalog(catalog, bbox=[49, 49, 51, 51])
+    assert [STORE["format"] for STORE in STORES] == ["pcstore"]
+    assert STORES[0]["point_count"] == 2
+
+
+def test_write_catalog_replaces_files(tmp_path):
+    catalog, trees = build_catalog(tmp_path)
+    path = os.path.join(trees, "Sample_R_GeorefTREE_11744.laz")
+    write_tree(path, (80, 80), npoints=10)
+
+    Catalog.write_catalog(catalog, Catalog.scan_headers(path))
+
+    assert len(Catalog.query_catalog(catalog)) == len(TREES) + 1
+    assert [TREE["tree_id"] for TREE in Catalog.query_catalog(catalog, bbox=[75, 75, 95, 95])] == [11744]
+    assert Catalog.query_catalog(catalog, min_points=100, bbox=[75, 75, 95, 95]) == []
+
+
+RESULTS_04 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results_04")
+
+
+def test_scan_header_of_written_tree_files():
+    # LAZ FILES WRITTEN BY STEP 04 OF THE WORKFLOW (DLL WRITER)
+    records = Catalog.scan_headers(RESULTS_04, n_jobs=2)
+
+    assert [record["tree_id"] for record in records] == [11744, 11754, 11772]
+    for record in records:
+        las = laspy.read(record["path"])
+        assert record["format"] == "laz"
+        assert record["version"] == str(las.header.version)
+        assert record["point_format"] == las.header.point_format.id
+        assert record["point_count"] == len(las.points) > 0
+        assert json.loads(record["extra_bytes"]) == list(las.point_format.extra_dimension_names)
+        # THE HEADER BOUNDS ENCLOSE THE POINTS, TO THE SCALE OF THE FILE
+        for k, name in enumerate("xyz"):
+            values = np.asarray(getattr(las, name))
+            scale = las.header.scales[k]
+            assert abs(record[f"min_{name}"] - values.min()) <= scale
+            assert abs(record[f"max_{name}"] - values.max()) <= scale
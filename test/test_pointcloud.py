@@ -0,0 +1,155 @@
+"""
+TESTS OF THE POINT CLOUD CONTAINER (Functions/PointCloud.py)
+
+E.G: python -m pytest test/test_pointcloud.py
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Functions"))
+from PointCloud import PointCloud
+
+
+def random_cloud(npoints=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    columns = {
+        "x": rng.uniform(357600, 357700, npoints),
+        "y": rng.uniform(6860000, 6860100, npoints),
+        "z": rng.uniform(180, 220, npoints),
+        "intensity": rng.uniform(0, 1000, npoints).astype(np.float32),
+        "return_number": rng.integers(1, 4, npoints).astype(np.int32),
+    }
+    extra = rng.normal(size=(2, npoints)).astype(np.float32)
+    return PointCloud(columns, extra, ["Reflectance", "Deviation"])
+
+
+def test_take_gathers_columns_and_extra_block():
+    cloud = random_cloud()
+    indices = np.array([5, 0, 999, 5, 42])
+
+    subset = cloud.take(indices)
+
+    assert len(subset) == len(indices)
+    for name in cloud.columns:
+        assert np.array_equal(getattr(subset, name), getattr(cloud, name)[indices])
+    assert subset.extra.shape == (2, len(indices))
+    assert np.array_equal(subset.extra, cloud.extra[:, indices])
+    assert np.array_equal(subset.Reflectance, cloud.Reflectance[indices])
+    assert subset.ExtraBytes_name == ["Reflectance", "Deviation"]
+
+
+def test_mask_equals_take_of_the_selected_points():
+    cloud = random_cloud()
+    mask = cloud.z > 200
+
+    subset = cloud.mask(mask)
+
+    expected = cloud.take(np.flatnonzero(mask))
+    for name in cloud.columns:
+        assert np.array_equal(getattr(subset, name), getattr(expected, name))
+    assert np.array_equal(subset.extra, expected.extra)
+
+
+def test_take_without_extra_bytes():
+    cloud = random_cloud()
+    cloud = PointCloud(cloud.columns)
+
+    subset = cloud.take(np.arange(10))
+
+    assert subset.extra is None
+    assert subset.ExtraBytes_name == []
+    assert np.array_equal(subset.x, cloud.x[:10])
+
+
+def test_assigning_extra_bytes_does_not_modify_the_callers_block():
+    cloud = random_cloud()
+    EXTRA = cloud.extra.copy()
+    first = PointCloud.from_attributes(cloud, cloud.extra, cloud.ExtraBytes_name)
+    second = PointCloud.from_attributes(cloud, cloud.extra, cloud.ExtraBytes_name)
+    view = first.take(slice(0, 10))
+
+    first.Reflectance = np.zeros(len(cloud), dtype=np.float32)
+    view.Deviation = np.ones(10, dtype=np.float32)
+
+    assert not np.any(first.Reflectance)
+    assert np.array_equal(first.Deviation, EXTRA[1])
+    assert np.array_equal(view.Deviation, np.ones(10))
+    for CLOUD in (cloud, second):
+        assert np.array_equal(CLOUD.extra, EXTRA)
+
+    # THE BLOCK GATHERED BY take IS ITS OWN AND IS NOT COPIED AGAIN
+    subset = first.take(np.arange(10))
+    block = subset.extra
+    subset.Reflectance = np.ones(10, dtype=np.float32)
+    assert subset.extra is block
+
+
+def test_len_without_x():
+    cloud = random_cloud()
+
+    assert len(PointCloud({"intensity": cloud.intensity})) == len(cloud)
+    assert len(PointCloud({}, cloud.extra, cloud.ExtraBytes_name)) == len(cloud)
+    assert len(PointCloud(lazy={"Reflectance": lambda: cloud.Reflectance}, ExtraBytes_name=["Reflectance"])) == len(cloud)
+    assert len(PointCloud()) == 0
+
+
+def test_quantize_round_trip():
+    cloud = random_cloud()
+    x, y, z = cloud.x.copy(), cloud.y.copy(), cloud.z.copy()
+
+    cloud.quantize()
+
+    assert cloud.quantization is not None
+    assert cloud.columns["X"].dtype == np.int32
+    assert "x" not in cloud.columns
+    assert sorted(dir(cloud)) == sorted(set(dir(random_cloud())))
+    # MILLIMETRE GRID: HALF A MILLIMETRE AT MOST
+    for before, after in ((x, cloud.x), (y, cloud.y), (z, cloud.z)):
+        assert np.max(np.abs(after - before)) <= 0.0005 + 1e-9
+
+    subset = cloud.take(np.arange(10))
+    assert subset.quantization is cloud.quantization
+    assert np.array_equal(subset.x, cloud.x[:10])
+
+    cloud.dequantize()
+    assert cloud.quantization is None
+    assert np.max(np.abs(cloud.x - x)) <= 0.0005 + 1e-9
+
+
+def test_local_xyz_matches_float_path():
+    cloud = random_cloud()
+    origin = np.floor(cloud.bounds[0])
+    xf, yf, zf, origin_f = cloud.local_xyz()
+
+    cloud.quantize()
+    xq, yq, zq, origin_q = cloud.local_xyz()
+
+    assert np.array_equal(origin_f, origin)
+    assert np.array_equal(origin_q, origin)
+    for values in (xq, yq, zq):
+        assert values.dtype == np.float32
+    # THE QUANTIZED VALUES ARE ON THE MILLIMETRE GRID, THE FLOAT32 ROUNDING IS SMALLER
+    for float_values, quantized_values in ((xf, xq), (yf, yq), (zf, zq)):
+        assert np.max(np.abs(quantized_values - float_values)) <= 0.0005 + 1e-5
+
+    # ORIGIN OFF THE GRID OF THE OFFSETS
+    shifted = origin + 0.25
+    xq, _, _, _ = cloud.local_xyz(shifted)
+    assert np.allclose(xq, cloud.x - shifted[0], atol=1e-5)
+
+
+def test_box_mask_matches_float_path():
+    cloud = random_cloud()
+    lower = [357620.0004, -np.inf, 190.0]
+    upper = [357680.5, np.inf, 210.0]
+
+    quantized = random_cloud()
+    quantized.quantize(offsets=[357600, 6860000, 180])
+    # THE FLOAT PATH ON THE DECODED COORDINATES GIVES THE SAME POINTS
+    decoded = PointCloud({"x": quantized.x, "y": quantized.y, "z": quantized.z})
+
+    assert np.array_equal(quantized.box_mask(lower, upper), decoded.box_mask(lower, upper))
+    assert np.any(cloud.box_mask(lower, upper))
+    assert not np.all(cloud.box_mask(lower, upper))
@@ -0,0 +1,147 @@
+"""
+TESTS OF THE COLUMNAR INTERMEDIATE STORE (Functions/PointStore.py)
+
+E.G: python -m pytest test/test_pointstore.py
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Functions"))
+import PointStore
+from PointCloud import PointCloud
+
+OFFSETS = [357600.0, 6860000.0, 150.0]
+EXTRA_BYTES = ["Reflectance", "Deviation"]
+
+
+def random_chunk(npoints, seed):
+    rng = np.random.default_rng(seed)
+    columns = {
+        "x": rng.uniform(0, 100, npoints),
+        "y": rng.uniform(0, 100, npoints),
+        "z": rng.uniform(30, 70, npoints),
+        "intensity": rng.uniform(0, 1000, npoints).astype(np.float32),
+        "return_number": rng.integers(1, 4, npoints).astype(np.int32),
+        "gps_time": rng.uniform(0, 100, npoints).astype(np.float32),
+    }
+    extra = rng.normal(size=(len(EXTRA_BYTES), npoints)).astype(np.float32)
+    return PointCloud(columns), extra
+
+
+def write_chunks(outputStore, chunks, compression=None):
+    with PointStore.StoreWriter(outputStore, OFFSETS, EXTRA_BYTES, compression) as writer:
+        for chunk, extra in chunks:
+            writer.write_chunk(chunk, extra)
+
+
+def expected_columns(chunks):
+    expected = {}
+    for name in ("x", "y", "z", "intensity", "return_number", "gps_time"):
+        expected[name] = np.concatenate([getattr(chunk, name) for chunk, _ in chunks])
+    for k, name in enumerate(("x", "y", "z")):
+        expected[name] = expected[name] + OFFSETS[k]
+    for i, name in enumerate(EXTRA_BYTES):
+        expected[name] = np.concatenate([extra[i] for _, extra in chunks])
+    return expected
+
+
+@pytest.mark.parametrize("compression", [None, "zlib", {"gps_time": "zlib", "Reflectance": "zlib"}])
+def test_round_trip(tmp_path, compression):
+    chunks = [random_chunk(1000, 0), random_chunk(500, 1), random_chunk(0, 2)]
+    outputStore = str(tmp_path / "tile.pcstore")
+
+    write_chunks(outputStore, chunks, compression)
+    STORE = PointStore.read_store(outputStore)
+
+    expected = expected_columns(chunks)
+    assert len(STORE) == 1500
+    assert STORE.ExtraBytes_name == EXTRA_BYTES
+    for name, values in expected.items():
+        assert getattr(STORE, name).dtype == values.dtype
+        assert np.array_equal(getattr(STORE, name), values), name
+    # STANDARD FIELDS THAT WERE NOT WRITTEN ARE ZEROS
+    assert not np.any(STORE.classification)
+
+    mins, maxs = STORE.header_bounds
+    assert np.allclose(mins, [expected[name].min() for name in ("x", "y", "z")])
+    assert np.allclose(maxs, [expected[name].max() for name in ("x", "y", "z")])
+
+
+def test_zlib_columns_are_written_in_frames(tmp_path):
+    chunks = [random_chunk(1000, 0), random_chunk(500, 1)]
+    outputStore = str(tmp_path / "tile.pcstore")
+
+    write_chunks(outputStore, chunks, {"gps_time": "zlib"})
+    schema = PointStore.read_schema(outputStore)
+
+    assert schema["columns"]["gps_time"]["file"] == "gps_time.zlib"
+    assert len(schema["columns"]["gps_time"]["frames"]) == 2
+    assert schema["columns"]["x"]["compression"] is None
+    assert schema["columns"]["x"]["frames"] == []
+
+
+def test_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        write_chunks(str(tmp_path / "tile.pcstore"), [random_chunk(10, 0)], "gzip")
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_window_reads(tmp_path, compression):
+    chunks = [random_chunk(1000, 0), random_chunk(500, 1)]
+    outputStore = str(tmp_path / "tile.pcstore")
+    write_chunks(outputStore, chunks, compression)
+    expected = expected_columns(chunks)
+    x, y, z = expected["x"], expected["y"], expected["z"]
+
+    bbox = [OFFSETS[0] + 20, OFFSETS[1] + 10, OFFSETS[0] + 60, OFFSETS[1] + 50]
+    inside = (x >= bbox[0]) & (x <= bbox[2]) & (y >= bbox[1]) & (y <= bbox[3])
+    WINDOW = PointStore.read_store(outputStore, bbox=bbox)
+    assert 0 < len(WINDOW) < len(x)
+    assert np.array_equal(WINDOW.x, x[inside])
+    assert np.array_equal(WINDOW.Reflectance, expected["Reflectance"][inside])
+
+    bbox = bbox[:2] + [OFFSETS[2] + 40] + bbox[2:] + [OFFSETS[2] + 60]
+    inside &= (z >= bbox[2]) & (z <= bbox[5])
+    WINDOW = PointStore.read_store(outputStore, bbox=bbox)
+    assert np.array_equal(WINDOW.z, z[inside])
+
+    # TRIANGLE: LOWER LEFT HALF OF THE 100 x 100 m SQUARE
+    polygon = np.array([[0, 0], [100, 0], [0, 100]]) + OFFSETS[:2]
+    inside = (x - OFFSETS[0]) + (y - OFFSETS[1]) < 100
+    WINDOW = PointStore.read_store(outputStore, polygon=polygon)
+    assert np.array_equal(WINDOW.x, x[inside])
+    assert np.array_equal(WINDOW.gps_time, expected["gps_time"][inside])
+
+
+def test_fields_projection(tmp_path):
+    outputStore = str(tmp_path / "tile.pcstore")
+    write_chunks(outputStore, [random_chunk(100, 0)])
+
+    STORE = PointStore.read_store(outputStore, fields=["x", "y", "z", "Deviation"])
+
+    assert STORE.ExtraBytes_name == ["Deviation"]
+    assert sorted(STORE.field_names) == ["Deviation", "x", "y", "z"]
+
+
+def test_failed_write_keeps_the_previous_store(tmp_path):
+    outputStore = str(tmp_path / "tile.pcstore")
+    chunks = [random_chunk(100, 0)]
+    write_chunks(outputStore, chunks)
+
+    with pytest.raises(RuntimeError):
+        with PointStore.StoreWriter(outputStore, OFFSETS, EXTRA_BYTES) as writer:
+            writer.write_chunk(*random_chunk(50, 1))
+            raise RuntimeError("step failed")
+
+    STORE = PointStore.read_store(outputStore)
+    assert len(STORE) == 100
+    assert np.array_equal(STORE.x, expected_columns(chunks)["x"])
+    # NO PARTIAL STORE IS LEFT NEXT TO IT
+    assert os.listdir(str(tmp_path)) == ["tile.pcstore"]
+
+    write_chunks(outputStore, [random_chunk(30, 2)])
+    assert len(PointStore.read_store(outputStore)) == 30
+    assert os.listdir(str(tmp_path)) == ["tile.pcstore"]
@@ -0,0 +1,163 @@
+"""
+TESTS OF THE COORDINATE KERNELS OF Functions/Processing.py AND Functions/numba_algorithms.py
+
+E.G: python -m pytest test/test_processing.py
+"""
+import math
+import os
+import sys
+from types import SimpleNamespace
+
+import numba as nb
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Functions"))
+import Processing
+import numba_algorithms as na
+
+TRANSFORMATION = SimpleNamespace(w=12.5, fi=-3.2, k=97.0, x=100.0, y=200.0, z=5.0)
+# TRANSFORMATION OF workflow/01/user_config.yml
+LIPHE = SimpleNamespace(w=0, fi=-60, k=-90, x=0, y=0, z=0)
+
+
+def random_points(npoints=10000, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-30, 30, npoints), rng.uniform(-30, 30, npoints), rng.uniform(-40, 10, npoints)
+
+
+def test_apply_affine_in_place():
+    x, y, z = random_points()
+    Rot, T = Processing.RECTIFY_MATRIX(TRANSFORMATION)
+    expected = Processing.apply_affine(x, y, z, Rot, T)
+
+    x1, y1, z1 = Processing.apply_affine(x, y, z, Rot, T, in_place=True)
+
+    assert x1 is x and y1 is y and z1 is z
+    for values, expected_values in zip((x, y, z), expected):
+        assert np.array_equal(values, expected_values)
+
+
+@pytest.mark.parametrize(
+    "convert", [lambda v: v.astype(np.float32), lambda v: v[::2], lambda v: list(v)], ids=["float32", "strided", "list"]
+)
+def test_apply_affine_in_place_rejects_arrays_it_would_copy(convert):
+    x, y, z = random_points(100)
+    Rot, T = Processing.RECTIFY_MATRIX(TRANSFORMATION)
+
+    with pytest.raises(TypeError):
+        Processing.apply_affine(convert(x), y, z, Rot, T, in_place=True)
+    # THE CONVERSION IS FINE WHEN THE RESULT GOES TO NEW ARRAYS
+    Processing.apply_affine(convert(x), y, z, Rot, T)
+
+
+def test_apply_affine_restores_the_numba_threads():
+    x, y, z = random_points(100)
+    Rot, T = Processing.RECTIFY_MATRIX(TRANSFORMATION)
+    previous = nb.get_num_threads()
+
+    Processing.apply_affine(x, y, z, Rot, T, num_cores=nb.config.NUMBA_NUM_THREADS + 4)
+    assert nb.get_num_threads() == previous
+
+    with pytest.raises(TypeError):
+        Processing.apply_affine(x.astype(np.float32), y, z, Rot, T, num_cores=2, in_place=True)
+    assert nb.get_num_threads() == previous
+
+    with pytest.raises(ValueError):
+        with na.num_threads(1):
+            raise ValueError
+    assert nb.get_num_threads() == previous
+
+
+def baseline_rectify(x, y, z, transformation, dtype="float32"):
+    # THE ORIGINAL RectifLaz: THREE (FLOAT32) MATRICES APPLIED POINT BY POINT
+    w = transformation.w * math.pi / 180
+    fi = transformation.fi * math.pi / 180
+    k = transformation.k * math.pi / 180
+    Rotfi = np.array([[math.cos(fi), 0, math.sin(fi)], [0, 1, 0], [-math.sin(fi), 0, math.cos(fi)]], dtype=dtype)
+    Rotw = np.array([[1, 0, 0], [0, math.cos(w), -math.sin(w)], [0, math.sin(w), math.cos(w)]], dtype=dtype)
+    Rotk = np.array([[math.cos(k), -math.sin(k), 0], [math.sin(k), math.cos(k), 0], [0, 0, 1]], dtype=dtype)
+
+    x1, y1, z1 = [], [], []
+    for X in zip(x, y, z):
+        X = Rotw.dot(X)
+        X = Rotfi.dot(X)
+        X = Rotk.dot(X)
+        x1.append(X[0] + transformation.x)
+        y1.append(X[1] + transformation.y)
+        z1.append(X[2] + transformation.z)
+    return np.array(x1, dtype=np.float64), np.array(y1, dtype=np.float64), np.array(z1, dtype=np.float64)
+
+
+@pytest.mark.parametrize("transformation", [TRANSFORMATION, LIPHE])
+@pytest.mark.parametrize("block_points", [7, 1_000_000])
+def test_rectify_matches_the_baseline_loop(transformation, block_points):
+    x, y, z = random_points(2000)
+
+    rectified = Processing.RectifLaz(x, y, z, transformation, block_points)
+
+    # SAME ROTATIONS IN THE SAME ORDER: EQUAL UP TO THE FLOAT64 ROUNDING
+    for values, expected in zip(rectified, baseline_rectify(x, y, z, transformation, "float64")):
+        assert np.allclose(values, expected, rtol=0, atol=1e-12)
+    # THE OLD FLOAT32 MATRICES MOVE POINTS UP TO 50 m AWAY BY ABOUT A MICROMETRE
+    for values, expected in zip(rectified, baseline_rectify(x, y, z, transformation)):
+        assert np.allclose(values, expected, rtol=0, atol=2e-6)
+
+
+@pytest.mark.parametrize("num_cores", [1, 4])
+@pytest.mark.parametrize("in_place", [False, True])
+def test_rigid_transform_is_rot_times_xyz_plus_t(num_cores, in_place):
+    x, y, z = random_points()
+    Rot, T = Processing.RECTIFY_MATRIX(TRANSFORMATION)
+    expected = Rot @ np.vstack((x, y, z)) + T[:, None]
+
+    transformed = Processing.apply_affine(x, y, z, Rot, T, num_cores=num_cores, in_place=in_place)
+
+    for values, expected_values in zip(transformed, expected):
+        assert np.allclose(values, expected_values, rtol=0, atol=1e-12)
+
+    x, y, z = random_points()
+    x1, y1, z1 = np.empty_like(x), np.empty_like(y), np.empty_like(z)
+    na.rigid_transform(x, y, z, Rot, T, x1, y1, z1)
+    for values, expected_values in zip((x1, y1, z1), expected):
+        assert np.allclose(values, expected_values, rtol=0, atol=1e-12)
+
+
+def baseline_range_theta_phi(x, y, z, thetaStart, thetaStop, phiStart, phiStop):
+    # THE ORIGINAL NUMPY FORMULAS OF COMPUTE_EXTRA_PARAMETERS
+    Range = np.sqrt(x**2 + y**2 + z**2)
+    phi = np.arctan2(y, x)
+    phi[phi < 0] = 2 * math.pi + phi[phi < 0]
+    phi[phi < phiStart * math.pi / 180] = phiStart * math.pi / 180
+    phi[phi > phiStop * math.pi / 180] = phiStop * math.pi / 180
+    theta = np.arccos(z / Range)
+    theta[theta < thetaStart * math.pi / 180] = thetaStart * math.pi / 180
+    theta[theta > thetaStop * math.pi / 180] = thetaStop * math.pi / 180
+    return Range, theta * 180 / math.pi, phi * 180 / math.pi
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_extra_parameters_match_the_numpy_formulas(dtype):
+    x, y, z = (values.astype(dtype) for values in random_points(100000))
+    # ANGULAR SETUP OF workflow/01/user_config.yml
+    setup = (40, 127, 103.0, 254.0)
+    EXTRA = np.arange(2 * len(x), dtype=np.float32).reshape(2, -1)
+    # THE KERNEL WORKS IN FLOAT64 ALSO WITH FLOAT32 COORDINATES
+    expected = baseline_range_theta_phi(x.astype(np.float64), y.astype(np.float64), z.astype(np.float64), *setup)
+
+    LAZCONTENT, EXTRA_TREE = Processing.COMPUTE_EXTRA_PARAMETERS(
+        SimpleNamespace(x=x, y=y, z=z), EXTRA, setup[0], setup[1], 0.006, setup[2], setup[3], 0.006
+    )
+
+    assert EXTRA_TREE.dtype == np.float32 and EXTRA_TREE.shape == (5, len(x))
+    assert np.array_equal(EXTRA_TREE[:2], EXTRA)
+    for row, name, expected_values in zip((2, 3, 4), ("Range", "Theta", "Phi"), expected):
+        assert np.array_equal(EXTRA_TREE[row], expected_values.astype(np.float32)), name
+        assert np.shares_memory(getattr(LAZCONTENT, name), EXTRA_TREE[row]), name
+    if dtype == np.float32:
+        # THE ORIGINAL FORMULAS RAN IN FLOAT32 ON FLOAT32 COORDINATES: A FEW ULPS AWAY
+        for row, expected_values in zip((2, 3, 4), baseline_range_theta_phi(x, y, z, *setup)):
+            assert np.allclose(EXTRA_TREE[row], expected_values, rtol=5e-7, atol=0)
+    # THE CLAMPING KEEPS THE ANGLES INSIDE THE SETUP OF THE SCANNER
+    assert EXTRA_TREE[3].min() >= np.float32(40) and EXTRA_TREE[3].max() <= np.float32(127)
+    assert EXTRA_TREE[4].min() >= np.float32(103) and EXTRA_TREE[4].max() <= np.float32(254)
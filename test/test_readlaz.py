@@ -0,0 +1,344 @@
+"""
+TESTS OF THE LAS/LAZ READERS (Functions/ReadLaz.py)
+
+E.G: python -m pytest test/test_readlaz.py
+"""
+import os
+import sys
+
+import laspy
+import numpy as np
+import pytest
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Functions"))
+import ReadLaz
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workflow", "01", "user_config.yml")) as f:
+    DLLPATH = yaml.safe_load(f)["DLLPATH"]
+
+
+def write_las(path, npoints=5000, seed=0, point_format=1):
+    rng = np.random.default_rng(seed)
+    header = laspy.LasHeader(point_format=point_format, version="1.4")
+    header.offsets = [357600, 6860000, 180]
+    header.scales = [0.001, 0.001, 0.001]
+    # FLOAT32, SCALED INTEGER AND PLAIN INTEGER EXTRA BYTES
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Reflectance", type=np.float32))
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Deviation", type=np.int16, scales=[0.01], offsets=[0]))
+    header.add_extra_dim(laspy.ExtraBytesParams(name="Flag", type=np.uint8))
+    las = laspy.LasData(header)
+    las.x = rng.uniform(357600, 357700, npoints)
+    las.y = rng.uniform(6860000, 6860100, npoints)
+    las.z = rng.uniform(180, 220, npoints)
+    las.intensity = rng.integers(0, 65535, npoints)
+    las.return_number = rng.integers(1, 4, npoints)
+    las.number_of_returns = np.maximum(las.return_number, rng.integers(1, 4, npoints))
+    las.classification = rng.integers(0, 8, npoints)
+    las.gps_time = rng.uniform(0, 1000, npoints)
+    las.point_source_id = rng.integers(0, 100, npoints)
+    las.Reflectance = rng.normal(-5, 3, npoints).astype(np.float32)
+    las.Deviation = np.round(rng.uniform(0, 20, npoints), 2)
+    las.Flag = rng.integers(0, 255, npoints)
+    las.write(path)
+    return las
+
+
+def assert_same_content(A, B, names=None):
+    assert A.ExtraBytes_name == B.ExtraBytes_name
+    assert A.field_names == B.field_names
+    assert len(A) == len(B)
+    for name in names or A.field_names:
+        a, b = getattr(A, name), getattr(B, name)
+        assert a.dtype == b.dtype, name
+        assert np.array_equal(a, b), name
+
+
+def concatenate(CHUNKS):
+    from PointCloud import PointCloud
+
+    ExtraBytes_name = CHUNKS[0].ExtraBytes_name
+    columns = {
+        name: np.concatenate([getattr(CHUNK, name) for CHUNK in CHUNKS])
+        for name in CHUNKS[0].field_names
+        if name not in ExtraBytes_name
+    }
+    # THE STORE AND THE MEMMAP BACKEND GIVE THE EXTRA BYTES AS COLUMNS, THE OTHERS AS ONE BLOCK
+    extra = None
+    if ExtraBytes_name:
+        extra = np.array([np.concatenate([getattr(CHUNK, name) for CHUNK in CHUNKS]) for name in ExtraBytes_name])
+    return PointCloud(columns, extra, ExtraBytes_name)
+
+
+def backends():
+    names = ["laspy", "memmap"]
+    if DLLPATH is not None and os.path.exists(DLLPATH):
+        names.append("ctypes")
+    return names
+
+
+def test_backends_return_the_same_fields_dtypes_and_values(tmp_path):
+    inputLas = str(tmp_path / "plot.las")
+    las = write_las(inputLas)
+
+    CONTENTS = {backend: ReadLaz.ReadLaz(inputLas, DLLPATH, backend=backend) for backend in backends()}
+
+    for backend, CONTENT in CONTENTS.items():
+        assert CONTENT.ExtraBytes_name == ["Reflectance", "Deviation", "Flag"], backend
+        for name in CONTENT.ExtraBytes_name:
+            assert getattr(CONTENT, name).dtype == np.float32, (backend, name)
+        assert_same_content(CONTENT, CONTENTS["laspy"])
+    assert np.allclose(CONTENTS["memmap"].Deviation, las.Deviation, rtol=0, atol=1e-6)
+    assert np.array_equal(CONTENTS["memmap"].x, np.asarray(las.x))
+
+
+class FakeFreeme:
+    # STANDS IN FOR THE freeme OF THE DLL, RECORDS THE POINTERS IT IS CALLED WITH
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, *pointers):
+        self.calls.append(pointers)
+
+
+def c_buffer(values):
+    import ctypes
+
+    buffer = (ctypes.c_double * len(values))(*values)
+    return buffer, ctypes.cast(buffer, ctypes.POINTER(ctypes.c_double))
+
+
+def test_dll_buffers_are_freed_once_the_last_view_is_gone():
+    import ctypes
+    import gc
+
+    values = np.arange(10, dtype=np.float64)
+    buffer, pointer = c_buffer(values)
+    FREEMEMO = FakeFreeme()
+    owner = ReadLaz._CBuffers(FREEMEMO, pointer)
+
+    x = ReadLaz._c_array(pointer, ctypes.c_double, len(values), owner)
+    view = x[::2]
+    del owner, x
+    gc.collect()
+
+    # THE VIEW STILL READS THE C BUFFER, SO IT IS NOT FREED YET
+    assert FREEMEMO.calls == []
+    assert np.array_equal(view, values[::2])
+    buffer[2] = -1.0
+    assert view[1] == -1.0
+
+    del view
+    gc.collect()
+    assert len(FREEMEMO.calls) == 1
+    assert FREEMEMO.calls[0][0] is pointer
+
+
+def test_dll_buffers_are_freed_once_after_copying():
+    import ctypes
+    import gc
+
+    values = np.arange(10, dtype=np.float64)
+    buffer, pointer = c_buffer(values)
+    FREEMEMO = FakeFreeme()
+    owner = ReadLaz._CBuffers(FREEMEMO, pointer)
+
+    # THE COPYING PATH OF _read_ctypes: COPY, THEN RELEASE BEFORE RETURNING
+    x = np.array(ReadLaz._c_array(pointer, ctypes.c_double, len(values), owner))
+    owner.release()
+    assert len(FREEMEMO.calls) == 1
+    del owner
+    gc.collect()
+    assert len(FREEMEMO.calls) == 1
+    assert np.array_equal(x, values)
+
+
+
+@pytest.mark.parametrize("point_format, extension", [(1, "las"), (6, "laz")])
+def test_fields_projection_returns_only_the_requested_fields(tmp_path, point_format, extension):
+    inputLas = str(tmp_path / f"plot.{extension}")
+    write_las(inputLas, point_format=point_format)
+    fields = ["x", "z", "intensity", "Deviation"]
+    FULL = ReadLaz.ReadLaz(inputLas, None, backend="laspy")
+
+    CHUNKS = list(ReadLaz.iter_chunks(inputLas, 1000, fields=fields))
+    PROJECTIONS = [
+        ReadLaz.ReadLaz(inputLas, None, fields=fields, backend="laspy"),
+        ReadLaz.read_window(inputLas, bbox=[0, 0, 1e7, 1e7], fields=fields),
+        concatenate(CHUNKS),
+    ]
+    if extension == "las":
+        PROJECTIONS.append(ReadLaz.ReadLaz(inputLas, None, fields=fields, backend="memmap"))
+
+    for CHUNK in CHUNKS:
+        assert CHUNK.ExtraBytes_name == ["Deviation"]
+        assert CHUNK.field_names == sorted(fields)
+    for PROJECTION in PROJECTIONS:
+        assert PROJECTION.ExtraBytes_name == ["Deviation"]
+        assert PROJECTION.field_names == sorted(fields)
+        for name in fields:
+            assert np.array_equal(getattr(PROJECTION, name), getattr(FULL, name)), name
+
+
+@pytest.mark.parametrize("backend", ["laspy", "memmap", "iter_chunks", "read_window", "store"])
+def test_unknown_fields_are_rejected(tmp_path, backend):
+    import PointStore
+
+    inputLas = str(tmp_path / "plot.las")
+    write_las(inputLas)
+    if backend == "store":
+        inputLas = str(tmp_path / "plot.pcstore")
+        LAZCONTENT = ReadLaz.ReadLaz(str(tmp_path / "plot.las"), None, backend="laspy")
+        PointStore.write_store(inputLas, LAZCONTENT, [0, 0, 0], LAZCONTENT.extra)
+    # A MISSPELLED EXTRA BYTES NAME
+    fields = ["x", "y", "z", "Reflectence"]
+
+    with pytest.raises(ValueError, match="Reflectence"):
+        if backend == "iter_chunks":
+            list(ReadLaz.iter_chunks(inputLas, 1000, fields=fields))
+        elif backend == "read_window":
+            ReadLaz.read_window(inputLas, bbox=[0, 0, 1e7, 1e7], fields=fields)
+        else:
+            ReadLaz.ReadLaz(inputLas, None, fields=fields, backend="laspy" if backend == "store" else backend)
+
+
+@pytest.mark.parametrize("extension", ["las", "laz"])
+@pytest.mark.parametrize("chunk_points", [1, 999, 5000, 10**6])
+def test_iter_chunks_concatenated_equals_readlaz(tmp_path, extension, chunk_points):
+    inputLas = str(tmp_path / f"plot.{extension}")
+    write_las(inputLas, npoints=5000 if chunk_points > 1 else 20)
+    FULL = ReadLaz.ReadLaz(inputLas, None, backend="laspy")
+
+    CHUNKS = list(ReadLaz.iter_chunks(inputLas, chunk_points))
+
+    assert all(len(CHUNK) <= chunk_points for CHUNK in CHUNKS)
+    assert len(CHUNKS) == -(-len(FULL) // chunk_points)
+    assert_same_content(concatenate(CHUNKS), FULL)
+
+
+def test_iter_chunks_of_a_store_and_quantized(tmp_path):
+    import PointStore
+
+    inputLas = str(tmp_path / "plot.laz")
+    write_las(inputLas)
+    FULL = ReadLaz.ReadLaz(inputLas, None, backend="laspy")
+    inputStore = str(tmp_path / "plot.pcstore")
+    PointStore.write_store(inputStore, FULL, [0, 0, 0], FULL.extra)
+
+    assert_same_content(concatenate(list(ReadLaz.iter_chunks(inputStore, 1234))), FULL)
+
+    QUANTIZED = ReadLaz.ReadLaz(inputLas, None, backend="laspy", quantized=True)
+    CHUNKS = list(ReadLaz.iter_chunks(inputLas, 1234, quantized=True))
+    for name in ("X", "Y", "Z"):
+        assert np.array_equal(np.concatenate([CHUNK.columns[name] for CHUNK in CHUNKS]), QUANTIZED.columns[name])
+    assert np.array_equal(np.concatenate([CHUNK.x for CHUNK in CHUNKS]), FULL.x)
+
+
+def write_sorted_laz(path, npoints=120_000):
+    # SORTED ALONG X, SO EVERY 50 000-POINT LASZIP CHUNK COVERS ITS OWN STRIP OF THE PLOT
+    las = write_las(path, npoints=npoints)
+    order = np.argsort(np.asarray(las.x))
+    las.points = las.points[order]
+    las.write(path)
+
+
+@pytest.mark.parametrize("with_index", [False, True])
+def test_read_window_equals_a_mask_of_the_full_read(tmp_path, with_index):
+    inputLas = str(tmp_path / "plot.laz")
+    write_sorted_laz(inputLas)
+    FULL = ReadLaz.ReadLaz(inputLas, None, backend="laspy")
+    x, y, z = FULL.x, FULL.y, FULL.z
+    if with_index:
+        ReadLaz.build_chunk_index(inputLas)
+    assert os.path.exists(inputLas + ReadLaz.CHUNK_INDEX_SUFFIX) == with_index
+
+    # 2D AND 3D BOXES IN THE FIRST STRIP, ACROSS TWO STRIPS AND OUTSIDE THE PLOT
+    for bbox in ([357610, 6860010, 357630, 6860090], [357640, 6860000, 185, 357660, 6860050, 200], [0, 0, 1, 1]):
+        if len(bbox) == 4:
+            inside = (x >= bbox[0]) & (x <= bbox[2]) & (y >= bbox[1]) & (y <= bbox[3])
+        else:
+            inside = (x >= bbox[0]) & (x <= bbox[3]) & (y >= bbox[1]) & (y <= bbox[4]) & (z >= bbox[2]) & (z <= bbox[5])
+        WINDOW = ReadLaz.read_window(inputLas, bbox=bbox)
+        assert_same_content(WINDOW, FULL.mask(inside))
+
+    index = ReadLaz.load_chunk_index(inputLas)
+    assert len(index["start"]) == 3
+    assert np.all(index["maxs"][:-1, 0] <= index["mins"][1:, 0])
+
+
+def test_read_window_polygon_and_fields(tmp_path):
+    from matplotlib.path import Path
+
+    inputLas = str(tmp_path / "plot.laz")
+    write_sorted_laz(inputLas)
+    FULL = ReadLaz.ReadLaz(inputLas, None, backend="laspy")
+
+    polygon = np.array([[357600, 6860000], [357650, 6860000], [357600, 6860050]])
+    inside = Path(polygon).contains_points(np.column_stack((FULL.x, FULL.y)))
+    WINDOW = ReadLaz.ReadLaz(inputLas, None, polygon=polygon, fields=["z", "Reflectance"])
+
+    assert WINDOW.field_names == ["Reflectance", "z"]
+    assert np.array_equal(WINDOW.z, FULL.z[inside])
+    assert np.array_equal(WINDOW.Reflectance, FULL.Reflectance[inside])
+
+
+def test_chunk_index_is_rebuilt_for_a_newer_file(tmp_path):
+    inputLas = str(tmp_path / "plot.laz")
+    write_sorted_laz(inputLas)
+    ReadLaz.build_chunk_index(inputLas)
+    index_file = inputLas + ReadLaz.CHUNK_INDEX_SUFFIX
+    os.utime(index_file, (0, 0))
+
+    # THE FILE IS REWRITTEN WITH OTHER POINTS AFTER THE INDEX
+    write_sorted_laz(inputLas, npoints=60_000)
+    FULL = ReadLaz.ReadLaz(inputLas, None, backend="laspy")
+    bbox = [357600, 6860000, 357700, 6860100]
+
+    assert len(ReadLaz.read_window(inputLas, bbox=bbox)) == len(FULL) == 60_000
+    assert len(ReadLaz.load_chunk_index(inputLas)["start"]) == 2
+
+
+def test_auto_backend_order(tmp_path):
+    write_las(str(tmp_path / "plot.las"), npoints=10)
+    write_las(str(tmp_path / "plot.laz"), npoints=10)
+    existing = str(tmp_path / "plot.las")
+    missing = str(tmp_path / "missing.so")
+
+    # UNCOMPRESSED LAS: MEMMAP, THEN THE DLL WHEN IT EXISTS, THEN LASPY
+    assert ReadLaz.resolve_backend("auto", existing, str(tmp_path / "plot.las")) == "memmap"
+    assert ReadLaz.resolve_backend("auto", existing, str(tmp_path / "plot.laz")) == "ctypes"
+    assert ReadLaz.resolve_backend("auto", missing, str(tmp_path / "plot.laz")) == "laspy"
+    assert ReadLaz.resolve_backend("auto", None, str(tmp_path / "plot.laz")) == "laspy"
+    # WRITING: NO FILE TO READ
+    assert ReadLaz.resolve_backend("auto", existing) == "ctypes"
+    assert ReadLaz.resolve_backend("auto", None) == "laspy"
+    assert ReadLaz.resolve_backend("laspy", existing, str(tmp_path / "plot.las")) == "laspy"
+
+    CONTENT = ReadLaz.ReadLaz(str(tmp_path / "plot.laz"), missing, backend="auto")
+    assert len(CONTENT) == 10
+    with pytest.raises(ValueError):
+        ReadLaz.ReadLaz(str(tmp_path / "plot.laz"), None, backend="pdal")
+
+
+@pytest.mark.parametrize("extension", ["las", "laz"])
+def test_extra_bytes_block(tmp_path, extension):
+    import Processing
+
+    inputLas = str(tmp_path / f"plot.{extension}")
+    las = write_las(inputLas)
+    CONTENT = ReadLaz.ReadLaz(inputLas, None, backend="laspy")
+
+    EXTRA = CONTENT.extra
+    assert EXTRA.shape == (3, len(las.points))
+    assert EXTRA.dtype == np.float32 and EXTRA.flags.c_contiguous
+    for k, name in enumerate(CONTENT.ExtraBytes_name):
+        assert np.shares_memory(getattr(CONTENT, name), EXTRA)
+        assert np.array_equal(EXTRA[k], np.asarray(las[name], dtype=np.float32)), name
+
+    # ALL THE ROWS IN ORDER: THE BLOCK ITSELF, OTHERWISE ONE GATHER OF THE ROWS
+    assert Processing.add_extra_bytes(CONTENT, ["Reflectance", "Deviation", "Flag"]) is EXTRA
+    SUBSET = Processing.add_extra_bytes(CONTENT, ["Flag", "Reflectance"])
+    assert np.array_equal(SUBSET, EXTRA[[2, 0]])
+    # A NAME MISSING FROM THE BLOCK FALLS BACK TO THE ROW BY ROW COPY
+    MIXED = Processing.add_extra_bytes(CONTENT, ["Deviation", "intensity"])
+    assert np.array_equal(MIXED, np.array([EXTRA[1], CONTENT.intensity]))
@@ -0,0 +1,287 @@
+"""
+PARITY TESTS OF THE VOXEL ENGINE (Functions/numba_algorithms.py) AND OF THE SPATIAL RESAMPLES
+OF Functions/Processing.py ON SMALL RANDOM CLOUDS
+
+E.G: python -m pytest test/test_spatial_sample.py
+"""
+import os
+import sys
+
+import numba as nb
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Functions"))
+import numba_algorithms as na
+
+
+def random_xyz(npoints, extent=(6, 5, 3), dtype=np.float64, seed=0, on_edges=True):
+    rng = np.random.default_rng(seed)
+    x, y, z = [rng.uniform(0, e, npoints).astype(dtype) for e in extent]
+    # POINTS ON THE VOXEL EDGES
+    if on_edges:
+        x[: npoints // 10] = np.round(x[: npoints // 10] * 10) / 10
+    return x, y, z
+
+
+"""
+REFERENCE: THE ORIGINAL compute_grid_means, A TYPED DICT OF (SUM X, SUM Y, SUM Z, COUNT, SUM ATT)
+FILLED POINT BY POINT IN INPUT ORDER (X, Y, Z SUMS IN FLOAT64, ATT SUM IN FLOAT32)
+"""
+
+
+def typed_dict_grid_means(x, y, z, att, voxel_size, pts_min):
+    # minmax RETURNED FLOAT64 BOUNDS, ALSO FOR FLOAT32 COORDINATES
+    bins = [np.arange(np.float64(v.min()), np.float64(v.max()), voxel_size) for v in (x, y, z)]
+    nx, ny = len(bins[0]), len(bins[1])
+    index = [np.searchsorted(bins[k], v, side="right") - 1 for k, v in enumerate((x, y, z))]
+    keys = index[0] + index[1] * nx + index[2] * nx * ny
+
+    d = {}
+    for i in range(len(x)):
+        xx, yy, zz = np.float64(x[i]), np.float64(y[i]), np.float64(z[i])
+        if keys[i] in d:
+            old = d[keys[i]]
+            d[keys[i]] = (old[0] + xx, old[1] + yy, old[2] + zz, old[3] + 1, np.float32(old[4] + att[i]))
+        else:
+            d[keys[i]] = (xx, yy, zz, 1, np.float32(att[i]))
+
+    means, MeanReflec = [], []
+    for xx, yy, zz, count, att_sum in d.values():
+        if count > pts_min:
+            means.append(np.array([xx, yy, zz]) / count)
+            MeanReflec.append(np.float64(att_sum / np.float32(count)))
+    return np.array(means).reshape(-1, 3), np.array(MeanReflec)
+
+
+@pytest.mark.parametrize("dtype, att_dtype", [(np.float64, np.float32), (np.float32, np.float32), (np.float64, np.float64)])
+@pytest.mark.parametrize("voxel_size, pts_min", [(0.5, 0), (0.5, 3), (0.2, 1)])
+def test_grid_means_are_bit_identical_to_the_typed_dict(dtype, att_dtype, voxel_size, pts_min):
+    x, y, z = random_xyz(5000, dtype=dtype)
+    att = np.random.default_rng(1).normal(-5, 3, len(x)).astype(att_dtype)
+
+    means, MeanReflec = na.compute_grid_means(x, y, z, att, voxel_size, pts_min)
+    expected_means, expected_MeanReflec = typed_dict_grid_means(x, y, z, att, voxel_size, pts_min)
+
+    # THE TYPED DICT RETURNS THE VOXELS IN HASH ORDER
+    order, expected_order = np.lexsort(means.T), np.lexsort(expected_means.T)
+    assert len(means) == len(expected_means) > 0
+    assert np.array_equal(means[order], expected_means[expected_order])
+    assert np.array_equal(MeanReflec[order], expected_MeanReflec[expected_order])
+
+
+def squared_distances(x, y, z, means):
+    return (x[None, :] - means[:, 0:1]) ** 2 + (y[None, :] - means[:, 1:2]) ** 2 + (z[None, :] - means[:, 2:3]) ** 2
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("voxel_size, pts_min", [(0.5, 0), (1.0, 2), (0.2, 0)])
+def test_voxel_nearest_is_the_closest_point_lowest_index_on_ties(dtype, voxel_size, pts_min):
+    x, y, z = random_xyz(2000, dtype=dtype)
+    # REPEATED POINTS: TIES BETWEEN POINTS OF THE SAME VOXEL
+    x, y, z = [np.concatenate((v, v[::7])) for v in (x, y, z)]
+    att = np.zeros(len(x), dtype=np.float32)
+
+    means, _, nearest = na.compute_grid_means(x, y, z, att, voxel_size, pts_min, return_nearest=True)
+
+    # BRUTE FORCE OVER ALL THE POINTS, np.argmin GIVES THE LOWEST INDEX ON TIES
+    expected = np.argmin(squared_distances(x, y, z, means), axis=1)
+    assert np.array_equal(nearest, expected)
+
+
+def test_voxel_nearest_matches_the_kdtree_except_on_ties():
+    from pykdtree.kdtree import KDTree
+
+    x, y, z = random_xyz(20000, extent=(20, 10, 5), seed=2)
+    att = np.zeros(len(x), dtype=np.float32)
+
+    for voxel_size in (0.3, 1.0):
+        means, _, nearest = na.compute_grid_means(x, y, z, att, voxel_size, 0, return_nearest=True)
+        _, indices = KDTree(np.vstack([x, y, z]).T, leafsize=256).query(means, k=1)
+
+        P = np.vstack([x, y, z]).T
+        # THE MEAN OF A 2-POINT VOXEL IS AS CLOSE TO BOTH POINTS
+        differ = np.flatnonzero(indices.astype(np.int64) != nearest)
+        assert np.array_equal(
+            ((P[nearest[differ]] - means[differ]) ** 2).sum(1),
+            ((P[indices[differ]] - means[differ]) ** 2).sum(1),
+        )
+
+
+def random_cloud(npoints=30000, seed=3, on_edges=True):
+    from PointCloud import PointCloud
+
+    rng = np.random.default_rng(seed)
+    x, y, z = random_xyz(npoints, extent=(12, 9, 4), seed=seed, on_edges=on_edges)
+    columns = {"x": x, "y": y, "z": z, "intensity": rng.integers(0, 60000, npoints).astype(np.float32)}
+    # Deviation NUMBERS THE POINTS, SO THE REPRESENTATIVES CAN BE COMPARED
+    EXTRA = np.vstack([rng.normal(-5, 3, npoints), np.arange(npoints)]).astype(np.float32)
+    return PointCloud(columns), EXTRA, ["Reflectance", "Deviation"]
+
+
+def assert_same_resample(A, B):
+    (CLOUD_A, EXTRA_A), (CLOUD_B, EXTRA_B) = A, B
+    assert len(CLOUD_A) == len(CLOUD_B) > 0
+    for name in ("x", "y", "z", "intensity"):
+        assert np.array_equal(getattr(CLOUD_A, name), getattr(CLOUD_B, name)), name
+    assert np.array_equal(EXTRA_A, EXTRA_B)
+
+
+def assert_same_except_on_ties(A, B, LAZCONTENT, vs, pts_min):
+    # THE ROWS ARE THE VOXELS IN KEY ORDER, THE REPRESENTATIVES MAY ONLY DIFFER ON TIES
+    (CLOUD_A, EXTRA_A), (CLOUD_B, EXTRA_B) = A, B
+    x, y, z = LAZCONTENT.x, LAZCONTENT.y, LAZCONTENT.z
+    keys, bins = na.voxel_keys(x, y, z, vs, return_bins=True)
+    _, means, _ = na.grid_means(keys, bins, x, y, z, np.zeros(len(x), dtype=np.float32), pts_min)
+
+    assert len(CLOUD_A) == len(CLOUD_B) == len(means)
+    a, b = EXTRA_A[1].astype(np.int64), EXTRA_B[1].astype(np.int64)
+    differ = np.flatnonzero(a != b)
+    P = np.vstack([x, y, z]).T
+    assert np.array_equal(
+        ((P[a[differ]] - means[differ]) ** 2).sum(1), ((P[b[differ]] - means[differ]) ** 2).sum(1)
+    )
+    return differ
+
+
+@pytest.mark.parametrize(
+    "useroption, selection", [("neighbour", "voxel"), ("mean", "voxel"), ("dist", "kdtree")]
+)
+@pytest.mark.parametrize("vs, pts_min", [(0.3, 1), (1.0, 0)])
+def test_tiled_resample_equals_untiled(useroption, selection, vs, pts_min):
+    import Processing
+
+    LAZCONTENT, EXTRA, ExtraBytes_name = random_cloud()
+
+    untiled = Processing.Spatial_sample(LAZCONTENT, useroption, pts_min, vs, 1, EXTRA, ExtraBytes_name, selection=selection)
+    previous = nb.get_num_threads()
+    tiled = Processing.Spatial_sample(
+        LAZCONTENT, useroption, pts_min, vs, 1, EXTRA, ExtraBytes_name, n_jobs=3, selection=selection
+    )
+
+    assert nb.get_num_threads() == previous
+    assert_same_resample(tiled, untiled)
+
+
+@pytest.mark.parametrize("vs, pts_min", [(0.3, 1), (1.0, 0)])
+def test_tiled_kdtree_resample_equals_untiled_except_on_ties(vs, pts_min):
+    import Processing
+
+    LAZCONTENT, EXTRA, ExtraBytes_name = random_cloud()
+
+    # THE KD-TREE OF EACH TILE CAN BREAK A TIE BETWEEN TWO POINTS THE OTHER WAY
+    untiled = Processing.Spatial_sample(LAZCONTENT, "neighbour", pts_min, vs, 1, EXTRA, ExtraBytes_name)
+    tiled = Processing.Spatial_sample(LAZCONTENT, "neighbour", pts_min, vs, 1, EXTRA, ExtraBytes_name, n_jobs=3)
+
+    assert_same_except_on_ties(tiled, untiled, LAZCONTENT, vs, pts_min)
+
+
+def write_las(path, LAZCONTENT, EXTRA, ExtraBytes_name):
+    import laspy
+
+    header = laspy.LasHeader(point_format=1, version="1.4")
+    header.offsets = [0, 0, 0]
+    header.scales = [0.001, 0.001, 0.001]
+    for name in ExtraBytes_name:
+        header.add_extra_dim(laspy.ExtraBytesParams(name=name, type=np.float32))
+    las = laspy.LasData(header)
+    las.x, las.y, las.z = LAZCONTENT.x, LAZCONTENT.y, LAZCONTENT.z
+    las.intensity = LAZCONTENT.intensity.astype(np.uint16)
+    for name, values in zip(ExtraBytes_name, EXTRA):
+        setattr(las, name, values)
+    las.write(path)
+
+
+def rows(CLOUD, ExtraBytes_name):
+    return {
+        tuple(row)
+        for row in np.column_stack(
+            [CLOUD.x, CLOUD.y, CLOUD.z, CLOUD.intensity] + [getattr(CLOUD, name) for name in ExtraBytes_name]
+        )
+    }
+
+
+@pytest.mark.parametrize(
+    "useroption, selection", [("neighbour", "voxel"), ("neighbour", "kdtree"), ("mean", "voxel"), ("dist", "kdtree")]
+)
+def test_out_of_core_resample_equals_in_memory(tmp_path, useroption, selection):
+    import Processing
+    import PointStore
+    import ReadLaz
+
+    vs, pts_min = 0.3, 1
+    inputLas = str(tmp_path / "plot.las")
+    write_las(inputLas, *random_cloud())
+
+    # SMALL TILES AND CHUNKS: EVERY VOXEL IS SPLIT OVER SEVERAL CHUNKS AND MANY TILES
+    outputStore = str(tmp_path / "resample.pcstore")
+    previous = nb.get_num_threads()
+    Processing.Spatial_sample_out_of_core(
+        inputLas, outputStore, [0, 0, 0], useroption, pts_min, vs, tile_size=1.5, chunk_points=7000, selection=selection
+    )
+    assert nb.get_num_threads() == previous
+    OUT_OF_CORE = PointStore.read_store(outputStore)
+
+    LAZCONTENT = ReadLaz.ReadLaz(inputLas, None, backend="laspy")
+    ExtraBytes_name = LAZCONTENT.ExtraBytes_name
+    IN_MEMORY, _ = Processing.Spatial_sample(
+        LAZCONTENT, useroption, pts_min, vs, 1, Processing.add_extra_bytes(LAZCONTENT, ExtraBytes_name),
+        ExtraBytes_name, selection=selection,
+    )
+    assert OUT_OF_CORE.ExtraBytes_name == ExtraBytes_name
+    assert len(OUT_OF_CORE) == len(IN_MEMORY) > 0
+
+    if selection == "kdtree" and useroption == "neighbour":
+        # THE TREES OF THE TILES CAN BREAK TIES THE OTHER WAY:
+        # EVERY VOXEL MEAN HAS A POINT OF THE OUTPUT AT THE DISTANCE OF ITS NEAREST POINT
+        from pykdtree.kdtree import KDTree
+
+        x, y, z = LAZCONTENT.x, LAZCONTENT.y, LAZCONTENT.z
+        keys, bins = na.voxel_keys(x, y, z, vs, return_bins=True)
+        _, means, _ = na.grid_means(keys, bins, x, y, z, np.zeros(len(x), dtype=np.float32), pts_min)
+        P = np.vstack([x, y, z]).T
+        Q = np.vstack([OUT_OF_CORE.x, OUT_OF_CORE.y, OUT_OF_CORE.z]).T
+        _, nearest = KDTree(P).query(means, k=1)
+        _, chosen = KDTree(Q).query(means, k=1)
+        assert np.array_equal(((P[nearest] - means) ** 2).sum(1), ((Q[chosen] - means) ** 2).sum(1))
+        return
+
+    A, B = rows(OUT_OF_CORE, ExtraBytes_name), rows(IN_MEMORY, ExtraBytes_name)
+    if useroption != "dist":
+        # TWO VOXELS WITH THE SAME NEAREST POINT: THE MEAN REFLECTANCE OF ONE OF THEM IS KEPT
+        ids, counts = np.unique(IN_MEMORY.Deviation, return_counts=True)
+        shared = set(ids[counts > 1])
+        A = {row for row in A if row[-1] not in shared}
+        B = {row for row in B if row[-1] not in shared}
+    assert A == B
+
+
+@pytest.mark.parametrize(
+    "useroption, selection",
+    [("neighbour", "voxel"), ("neighbour", "kdtree"), ("mean", "voxel"), ("mean", "kdtree"), ("dist", "kdtree")],
+)
+def test_pyramid_levels_equal_separate_runs(useroption, selection):
+    import Processing
+
+    # A COARSER VOXEL IS MADE OF WHOLE FINER VOXELS, SO ONLY POINTS OFF THE VOXEL EDGES
+    # ARE IN THE SAME VOXEL AS IN A SEPARATE RUN
+    LAZCONTENT, EXTRA, ExtraBytes_name = random_cloud(seed=4, on_edges=False)
+    voxel_sizes = [0.1, 0.3, 1.2]
+
+    LEVELS = Processing.Spatial_sample_pyramid(
+        LAZCONTENT, useroption, 1, voxel_sizes, EXTRA, ExtraBytes_name, selection=selection
+    )
+
+    assert len(LEVELS) == len(voxel_sizes)
+    for level, (vs, PYRAMID) in enumerate(zip(voxel_sizes, LEVELS)):
+        SEPARATE = Processing.Spatial_sample(LAZCONTENT, useroption, 1, vs, 1, EXTRA, ExtraBytes_name, selection=selection)
+        if level == 0 or useroption != "mean":
+            assert_same_resample(PYRAMID, SEPARATE)
+            continue
+        # THE MEANS OF THE COARSER LEVELS ADD THE SUMS OF THE FINER VOXELS: SAME UP TO THE LAST BITS
+        (CLOUD_A, EXTRA_A), (CLOUD_B, EXTRA_B) = PYRAMID, SEPARATE
+        assert len(CLOUD_A) == len(CLOUD_B) > 0
+        for name in ("x", "y", "z"):
+            assert np.allclose(getattr(CLOUD_A, name), getattr(CLOUD_B, name), rtol=0, atol=1e-12)
+        assert np.array_equal(CLOUD_A.intensity, CLOUD_B.intensity)
+        assert np.array_equal(EXTRA_A, EXTRA_B)
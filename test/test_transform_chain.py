@@ -0,0 +1,128 @@
+"""
+TESTS OF THE COMPOSED COORDINATE TRANSFORMATIONS (Functions/TransformChain.py)
+
+E.G: python -m pytest test/test_transform_chain.py
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Functions"))
+import Processing
+from TransformChain import TransformChain, read_reference_points
+
+WORKFLOW_02 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workflow", "02")
+OFFSETS = [357676.852, 6860035.171, 0]
+
+
+class Transformation:
+    w = 12.5
+    fi = -3.2
+    k = 97.0
+    x = 100.0
+    y = 200.0
+    z = 5.0
+
+
+def reference_points():
+    return read_reference_points(
+        os.path.join(WORKFLOW_02, "reference_points_local.csv"),
+        os.path.join(WORKFLOW_02, "reference_points_global.csv"),
+    )
+
+
+def random_points(npoints=10000, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-30, 30, npoints), rng.uniform(-30, 30, npoints), rng.uniform(-40, 10, npoints)
+
+
+def test_chain_matches_rectify_helmert_offset():
+    x, y, z = random_points()
+    MatchPoints = reference_points()
+
+    # STEP 01 RECTIFIES, STEP 02 APPLIES HELMERT3D AND SUBTRACTS THE (FLOAT32) OFFSETS
+    x1, y1, z1 = Processing.RectifLaz(x, y, z, Transformation)
+    x2, y2, z2 = Processing.HELMERT3D(SimpleNamespace(x=x1, y=y1, z=z1), MatchPoints)
+    offsets = np.asarray(OFFSETS, dtype=np.float32)
+
+    CHAIN = TransformChain().rectify(Transformation).helmert(MatchPoints).offset(OFFSETS)
+    x3, y3, z3 = CHAIN.apply(x, y, z)
+
+    assert CHAIN.steps == ["rectify", "helmert", "offset"]
+    assert np.array_equal(CHAIN.offsets, offsets.astype(np.float64))
+    assert np.allclose(x3, x2 - offsets[0], rtol=0, atol=1e-6)
+    assert np.allclose(y3, y2 - offsets[1], rtol=0, atol=1e-6)
+    assert np.allclose(z3, z2 - offsets[2], rtol=0, atol=1e-6)
+
+
+def test_chain_in_place_and_threads():
+    x, y, z = random_points()
+    CHAIN = TransformChain().rectify(Transformation).offset(OFFSETS)
+    expected = CHAIN.apply(x, y, z)
+
+    x3, y3, z3 = CHAIN.apply(x, y, z, num_cores=2, in_place=True)
+
+    assert x3 is x
+    assert np.array_equal(x3, expected[0])
+    assert np.array_equal(y3, expected[1])
+    assert np.array_equal(z3, expected[2])
+
+
+def test_chain_save_and_load(tmp_path):
+    CHAIN = TransformChain().rectify(Transformation).helmert(reference_points()).offset(OFFSETS)
+    path = str(tmp_path / "georef_chain.yml")
+
+    CHAIN.save(path)
+    LOADED = TransformChain.load(path)
+
+    assert np.array_equal(LOADED.matrix, CHAIN.matrix)
+    assert np.array_equal(LOADED.offsets, CHAIN.offsets)
+    assert LOADED.steps == CHAIN.steps
+
+
+def test_helmert_parameters_are_the_least_squares_solution():
+    MatchPoints = reference_points()
+    Lb = MatchPoints[0].astype(np.float64)
+    Ref = MatchPoints[1].astype(np.float64).reshape(-1, 3)
+
+    # DESIGN MATRIX OF THE ORIGINAL HELMERT3D, ONE POINT AND ONE ROW AT A TIME
+    A = np.zeros((3 * len(Ref), 12))
+    for i, (X, Y, Z) in enumerate(Ref):
+        for r in range(3):
+            A[3 * i + r, 3 * r : 3 * r + 3] = [X, Y, Z]
+            A[3 * i + r, 9 + r] = 1
+    # THE NORMAL EQUATIONS OF THE ORIGINAL SOLVE ARE ILL-CONDITIONED WITH GLOBAL COORDINATES
+    X_normal = np.linalg.inv(A.T.dot(A)).dot(A.T.dot(Lb))
+
+    AFIM_I, T = Processing.HELMERT3D_PARAMETERS(MatchPoints)
+    X = np.concatenate((np.linalg.inv(AFIM_I).ravel(), T))
+
+    residuals = A.dot(X) - Lb
+    assert np.linalg.norm(residuals) <= np.linalg.norm(A.dot(X_normal) - Lb) + 1e-9
+    # THE RESIDUALS ARE ORTHOGONAL TO THE COLUMNS OF THE (SCALED) DESIGN MATRIX
+    scaled = A / np.linalg.norm(A, axis=0)
+    assert np.max(np.abs(scaled.T.dot(residuals))) < 1e-6 * np.linalg.norm(residuals) + 1e-9
+
+
+def test_cached_helmert_parameters_equal_a_fresh_solve(tmp_path):
+    MatchPoints = reference_points()
+    parameters_file = str(tmp_path / "helmert3d.npz")
+
+    AFIM_I, T = Processing.HELMERT3D_PARAMETERS(MatchPoints)
+    Processing.HELMERT3D_PARAMETERS(MatchPoints, parameters_file)
+    assert os.path.exists(parameters_file)
+    AFIM_I_cached, T_cached = Processing.HELMERT3D_PARAMETERS(MatchPoints, parameters_file)
+
+    assert np.array_equal(AFIM_I_cached, AFIM_I)
+    assert np.array_equal(T_cached, T)
+
+    # OTHER MATCH POINTS: THE CACHE IS NOT USED AND IS REPLACED
+    Moved = MatchPoints.copy()
+    Moved[1] += np.float32(1.0)
+    AFIM_I_moved, T_moved = Processing.HELMERT3D_PARAMETERS(Moved, parameters_file)
+    assert np.array_equal(AFIM_I_moved, Processing.HELMERT3D_PARAMETERS(Moved)[0])
+    assert not np.allclose(T_moved, T)
+    with np.load(parameters_file) as cache:
+        assert np.array_equal(cache["MatchPoints"], Moved)
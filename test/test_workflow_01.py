@@ -0,0 +1,68 @@
+"""
+TESTS OF THE STEP 01 SCRIPT (workflow/01/01_add_parameters_and_normalize.py)
+
+E.G: python -m pytest test/test_workflow_01.py
+"""
+import os
+import runpy
+import sys
+
+import laspy
+import numpy as np
+import pytest
+import yaml
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+WORKFLOW_01 = os.path.join(REPO, "workflow", "01")
+sys.path.append(os.path.join(REPO, "Functions"))
+import ReadLaz
+
+
+def write_scan(path, npoints=5000, seed=0):
+    # SCANNER COORDINATES WITH THE EXTRA BYTES READ BY STEP 01
+    rng = np.random.default_rng(seed)
+    header = laspy.LasHeader(point_format=1, version="1.4")
+    header.offsets = [0, 0, 0]
+    header.scales = [0.001, 0.001, 0.001]
+    for name in ("Amplitude", "Reflectance", "Deviation"):
+        header.add_extra_dim(laspy.ExtraBytesParams(name=name, type=np.float32))
+    las = laspy.LasData(header)
+    las.x = rng.uniform(-30, 30, npoints)
+    las.y = rng.uniform(-30, 30, npoints)
+    las.z = rng.uniform(-40, 10, npoints)
+    las.intensity = rng.integers(0, 65535, npoints)
+    las.return_number = rng.integers(1, 4, npoints)
+    las.number_of_returns = np.maximum(las.return_number, rng.integers(1, 4, npoints))
+    las.Amplitude = rng.uniform(0, 40, npoints).astype(np.float32)
+    las.Reflectance = rng.normal(-5, 3, npoints).astype(np.float32)
+    las.Deviation = rng.uniform(0, 20, npoints).astype(np.float32)
+    las.write(path)
+
+
+def run_step_01(monkeypatch, inputLas, outputLas, **options):
+    with open(os.path.join(WORKFLOW_01, "user_config.yml"), "r") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    config.update(function_path=REPO, io_backend="laspy", **options)
+
+    monkeypatch.chdir(os.path.dirname(inputLas))
+    monkeypatch.setattr(yaml, "load", lambda *args, **kwargs: config)
+    monkeypatch.setattr(sys, "argv", ["01_add_parameters_and_normalize.py", inputLas, outputLas])
+    runpy.run_path(os.path.join(WORKFLOW_01, "01_add_parameters_and_normalize.py"), run_name="__main__")
+    return ReadLaz.ReadLaz(outputLas, None, backend="laspy")
+
+
+@pytest.mark.parametrize("chunk_points, cores", [(700, 1), (700, 2), (100000, 1)])
+def test_streamed_step_01_equals_the_whole_file(monkeypatch, tmp_path, chunk_points, cores):
+    inputLas = str(tmp_path / "scan.laz")
+    write_scan(inputLas)
+
+    WHOLE = run_step_01(monkeypatch, inputLas, str(tmp_path / "whole.laz"), chunk_points=None, cores=1)
+    STREAMED = run_step_01(
+        monkeypatch, inputLas, str(tmp_path / "streamed.laz"), chunk_points=chunk_points, cores=cores
+    )
+
+    assert len(WHOLE) == len(STREAMED) == 5000
+    assert WHOLE.ExtraBytes_name == STREAMED.ExtraBytes_name == ["Reflectance", "Deviation", "Range", "Theta", "Phi"]
+    assert WHOLE.field_names == STREAMED.field_names
+    for name in WHOLE.field_names:
+        assert np.array_equal(getattr(WHOLE, name), getattr(STREAMED, name)), name
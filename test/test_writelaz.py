@@ -0,0 +1,153 @@
+"""
+TESTS OF THE LAS/LAZ WRITERS (Functions/WriteLaz.py)
+
+E.G: python -m pytest test/test_writelaz.py
+"""
+import os
+import sys
+
+import laspy
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Functions"))
+import PointStore
+import ReadLaz
+import WriteLaz
+from PointCloud import PointCloud
+
+OFFSETS = [357600.0, 6860000.0, 150.0]
+EXTRA_BYTES = ["Reflectance", "Deviation", "Deviation", "Range"]
+
+
+def random_chunk(npoints, seed):
+    # COORDINATES RELATIVE TO OFFSETS, ON THE MILLIMETRE GRID OF THE FILE
+    rng = np.random.default_rng(seed)
+    columns = {
+        "x": np.round(rng.uniform(0, 100, npoints), 3),
+        "y": np.round(rng.uniform(0, 100, npoints), 3),
+        "z": np.round(rng.uniform(30, 70, npoints), 3),
+        "intensity": rng.integers(0, 65535, npoints).astype(np.float32),
+        "return_number": rng.integers(1, 4, npoints).astype(np.int32),
+        "number_of_returns": np.full(npoints, 3, dtype=np.int32),
+        "classification": rng.integers(0, 8, npoints).astype(np.float32),
+        "gps_time": rng.uniform(0, 100, npoints).astype(np.float32),
+    }
+    extra = rng.normal(size=(len(EXTRA_BYTES), npoints)).astype(np.float32)
+    return PointCloud(columns), extra
+
+
+def expected_column(chunks, name):
+    values = np.concatenate([getattr(chunk, name) for chunk, _ in chunks])
+    if name in ("x", "y", "z"):
+        values = values + OFFSETS["xyz".index(name)]
+    return values
+
+
+@pytest.mark.parametrize("extension, n_threads", [("laz", 1), ("laz", 2), ("las", 1)])
+def test_open_writer_round_trip(tmp_path, extension, n_threads):
+    outputLas = str(tmp_path / f"tile.{extension}")
+    chunks = [random_chunk(3000, 0), random_chunk(0, 1), random_chunk(1000, 2)]
+
+    with WriteLaz.open_writer(outputLas, OFFSETS, EXTRA_BYTES, n_threads) as writer:
+        assert isinstance(writer, WriteLaz.LazWriter)
+        for chunk, extra in chunks:
+            writer.write_chunk(chunk, extra)
+    CONTENT = ReadLaz.ReadLaz(outputLas, None, backend="laspy")
+
+    assert len(CONTENT) == 4000
+    # REPEATED EXTRA BYTES NAMES ARE STORED ONCE, THE FIRST ROW WINS
+    assert CONTENT.ExtraBytes_name == ["Reflectance", "Deviation", "Range"]
+    for name in ("x", "y", "z"):
+        assert np.allclose(getattr(CONTENT, name), expected_column(chunks, name), rtol=0, atol=1e-6), name
+    for name in ("intensity", "return_number", "number_of_returns", "classification", "gps_time"):
+        assert np.array_equal(getattr(CONTENT, name), expected_column(chunks, name)), name
+    for row, name in ((0, "Reflectance"), (1, "Deviation"), (3, "Range")):
+        assert np.array_equal(getattr(CONTENT, name), np.concatenate([extra[row] for _, extra in chunks])), name
+
+    with laspy.open(outputLas) as reader:
+        header = reader.header
+    assert header.point_count == 4000
+    assert np.allclose(header.offsets, OFFSETS)
+    assert np.allclose(header.mins, [expected_column(chunks, name).min() for name in "xyz"], atol=1e-6)
+    assert np.allclose(header.maxs, [expected_column(chunks, name).max() for name in "xyz"], atol=1e-6)
+
+
+@pytest.mark.parametrize("offsets", [OFFSETS, [357000.0, 6859000.0, 0.0], [357600.0004, 6860000.0, 150.0]])
+def test_quantized_input_round_trip(tmp_path, offsets):
+    inputLas = str(tmp_path / "input.laz")
+    chunk, extra = random_chunk(2000, 3)
+    with WriteLaz.LazWriter(inputLas, OFFSETS, EXTRA_BYTES) as writer:
+        writer.write_chunk(chunk, extra)
+
+    # THE SAME POINTS WRITTEN FROM A QUANTIZED CLOUD (INTEGERS SHIFTED WHEN THE OFFSETS ARE ON
+    # THE GRID) AND FROM FLOAT64 COORDINATES, BOTH RELATIVE TO offsets
+    def write(outputLas, quantized):
+        CLOUD = ReadLaz.ReadLaz(inputLas, None, backend="laspy", quantized=quantized).translate(offsets)
+        with WriteLaz.open_writer(outputLas, offsets, CLOUD.ExtraBytes_name) as writer:
+            writer.write_chunk(CLOUD, CLOUD.extra)
+        return ReadLaz.ReadLaz(outputLas, None, backend="laspy", quantized=True)
+
+    QUANTIZED = write(str(tmp_path / "quantized.laz"), True)
+    FLOAT = write(str(tmp_path / "float.laz"), False)
+    INPUT = ReadLaz.ReadLaz(inputLas, None, backend="laspy")
+
+    assert QUANTIZED.field_names == FLOAT.field_names == INPUT.field_names
+    for name in ("X", "Y", "Z"):
+        assert np.array_equal(QUANTIZED.columns[name], FLOAT.columns[name]), name
+    for name in ("x", "y", "z"):
+        # OFFSETS OFF THE MILLIMETRE GRID MOVE THE POINTS BY LESS THAN HALF A MILLIMETRE
+        assert np.allclose(getattr(QUANTIZED, name), getattr(INPUT, name), rtol=0, atol=0.0005 + 1e-9), name
+    for name in INPUT.field_names:
+        if name not in ("x", "y", "z"):
+            assert np.array_equal(getattr(QUANTIZED, name), getattr(INPUT, name)), name
+
+
+def test_open_writer_of_a_store(tmp_path):
+    outputStore = str(tmp_path / "tile.pcstore")
+    chunk, extra = random_chunk(100, 4)
+
+    with WriteLaz.open_writer(outputStore, OFFSETS, EXTRA_BYTES) as writer:
+        assert isinstance(writer, PointStore.StoreWriter)
+        writer.write_chunk(chunk, extra)
+
+    STORE = ReadLaz.ReadLaz(outputStore, None)
+    assert np.array_equal(STORE.x, chunk.x + OFFSETS[0])
+    assert np.array_equal(STORE.Range, extra[3])
+
+
+def test_dll_buffers_are_the_callers_arrays_when_they_match():
+    chunk, _ = random_chunk(100, 5)
+    zeros = {}
+
+    intensity = WriteLaz._c_buffer(chunk, "intensity", np.float32, len(chunk), zeros)
+    classification = WriteLaz._c_buffer(chunk, "classification", np.int32, len(chunk), zeros)
+    point_source_ID = WriteLaz._c_buffer(chunk, "point_source_ID", np.short, len(chunk), zeros)
+    scan_angle_rank = WriteLaz._c_buffer(chunk, "scan_angle_rank", np.short, len(chunk), zeros)
+    strided = WriteLaz._c_buffer(PointCloud({"intensity": chunk.intensity[::2]}), "intensity", np.float32, 50, {})
+
+    # SAME DTYPE AND LAYOUT: NO COPY
+    assert np.shares_memory(intensity, chunk.intensity)
+    # OTHER DTYPE OR LAYOUT: A CONTIGUOUS COPY WITH THE VALUES
+    assert classification.dtype == np.int32 and classification.flags.c_contiguous
+    assert np.array_equal(classification, chunk.classification)
+    assert strided.flags.c_contiguous and np.array_equal(strided, chunk.intensity[::2])
+    # MISSING FIELDS OF THE SAME DTYPE SHARE ONE BUFFER OF ZEROS
+    assert point_source_ID is scan_angle_rank
+    assert len(point_source_ID) == len(chunk) and not np.any(point_source_ID)
+
+
+@pytest.mark.parametrize("backend", ["laspy", "auto"])
+def test_writelaz_without_the_dll(tmp_path, backend):
+    outputLas = str(tmp_path / "tile.laz")
+    chunk, extra = random_chunk(500, 6)
+    chunk.ExtraBytes_name = EXTRA_BYTES
+
+    WriteLaz.WriteLaz(outputLas, None, chunk, OFFSETS, extra, backend=backend, n_threads=2)
+    CONTENT = ReadLaz.ReadLaz(outputLas, None, backend="laspy")
+
+    assert CONTENT.ExtraBytes_name == ["Reflectance", "Deviation", "Range"]
+    assert np.allclose(CONTENT.x, chunk.x + OFFSETS[0], rtol=0, atol=1e-6)
+    assert np.array_equal(CONTENT.Range, extra[3])
+    with pytest.raises(ValueError):
+        WriteLaz.WriteLaz(outputLas, None, chunk, OFFSETS, extra, backend="memmap")
@@ -8,6 +8,9 @@ os.chdir(os.path.dirname(os.path.abspath(__file__)))
 with open("user_config.yml", "r") as f:
     config = yaml.load(f, Loader=yaml.FullLoader)
 
+# ctypes (DLLPATH), laspy or auto - see ReadLaz.ReadLaz
+io_backend = config.get("io_backend", "ctypes")
+
 # add functions to path
 sys.path.append(os.path.join(config["function_path"], "Functions"))
 
@@ -15,6 +18,7 @@ sys.path.append(os.path.join(config["function_path"], "Functions"))
 import ReadLaz
 import Processing
 import WriteLaz
+import TransformChain
 
 # other python libraries
 import numpy as np
@@ -23,7 +27,9 @@ import numpy as np
 input_las_filename = sys.argv[1]
 output_las_filename = sys.argv[2]
 
-las_content = ReadLaz.ReadLaz(input_las_filename, config["DLLPATH"], int(config["cores"]))
+# Only the fields used below are read
+las_fields = ["x", "y", "z", "return_number", "number_of_returns", "intensity"]
+las_fields = las_fields + ["Amplitude", "Reflectance", "Deviation"]
 
 # Normalize point cloud local reference system
 # create class from transformation parameters in configuration file
@@ -32,52 +38,92 @@ class Transformation:
         for k, v in config["transformation"].items():
             setattr(self, k, v)
 
-if int(config["cores"]) == 1:
-    x1, y1, z1 = Processing.RectifLaz(
-        las_content.x, las_content.y, las_content.z, Transformation(config)
-    )
-else:
-    x1, y1, z1 = Processing.rectify_point_cloud_parallel(
-        las_content.x, las_content.y, las_content.z, Transformation(config), int(config["cores"])
-    )
+# A transform chain (rectification, Helmert 3D and georef offsets composed in one matrix,
+# see Functions/TransformChain.py) writes the georeferenced cloud directly, without step 02
+chain = None
+if config.get("transform_chain"):
+    chain = TransformChain.TransformChain.load(config["transform_chain"])
 
-# Add extrabytes
-extra_bytes_names = ["Reflectance", "Deviation"]
-extra_bytes_array = Processing.add_extra_bytes(las_content, extra_bytes_names)
-
-# Rename attributes
-if hasattr(las_content, "Amplitude"):
-    setattr(las_content, "Intensity", getattr(las_content, "Amplitude"))
-
-# Compute extra bytes
-# Add more extra bytes based on configuration file
-extra_bytes_names = extra_bytes_names + ["Range", "Theta", "Phi"]
-las_content, extra_bytes_array = Processing.COMPUTE_EXTRA_PARAMETERS(
-    las_content,
-    extra_bytes_array,
-    config["thetaStart"],
-    config["thetaStop"],
-    config["thetaIncrement"],
-    config["phiStart"],
-    config["phiStop"],
-    config["phiIncrement"],
-)
-
-# Write pointcloud to file
 # offset is 0 for local coordinate system
 zero_offsets = np.zeros((3), dtype=np.float32)
+# the transform chain already subtracted its georef offsets, they only go to the header
+output_offsets = zero_offsets
+if chain is not None and chain.offsets is not None:
+    output_offsets = chain.offsets.astype(np.float32)
 
+# Add extrabytes, then the ones computed below
+extra_bytes_names = ["Reflectance", "Deviation"]
+output_extra_bytes_names = extra_bytes_names + ["Range", "Theta", "Phi"]
+
+
+# Rectify, compute the extra bytes and return what is written for the points of las_content
+# (the whole file or one chunk)
+def add_parameters_and_normalize(las_content):
+    if chain is not None:
+        x1, y1, z1 = chain.apply(las_content.x, las_content.y, las_content.z, int(config["cores"]))
+    elif int(config["cores"]) == 1:
+        x1, y1, z1 = Processing.RectifLaz(
+            las_content.x, las_content.y, las_content.z, Transformation(config)
+        )
+    else:
+        x1, y1, z1 = Processing.rectify_point_cloud_parallel(
+            las_content.x, las_content.y, las_content.z, Transformation(config), int(config["cores"])
+        )
+
+    extra_bytes_array = Processing.add_extra_bytes(las_content, extra_bytes_names)
+
+    # Rename attributes
+    if hasattr(las_content, "Amplitude"):
+        setattr(las_content, "Intensity", getattr(las_content, "Amplitude"))
+
+    # Compute extra bytes
+    # Add more extra bytes based on configuration file
+    las_content, extra_bytes_array = Processing.COMPUTE_EXTRA_PARAMETERS(
+        las_content,
+        extra_bytes_array,
+        config["thetaStart"],
+        config["thetaStop"],
+        config["thetaIncrement"],
+        config["phiStart"],
+        config["phiStop"],
+        config["phiIncrement"],
+    )
 
-class MainContent:
-    x = x1 - zero_offsets[0]
-    y = y1 - zero_offsets[1]
-    z = z1 - zero_offsets[2]
-    return_number = las_content.return_number
-    number_of_returns = las_content.number_of_returns
-    intensity = las_content.intensity
-    ExtraBytes_name = extra_bytes_names
-
+    class MainContent:
+        x = x1 - zero_offsets[0]
+        y = y1 - zero_offsets[1]
+        z = z1 - zero_offsets[2]
+        return_number = las_content.return_number
+        number_of_returns = las_content.number_of_returns
+        intensity = las_content.intensity
+        ExtraBytes_name = output_extra_bytes_names
+
+    return MainContent, extra_bytes_array
+
+
+# Streaming: with chunk_points set the file is read chunk by chunk (laspy, decompressed with
+# config["cores"] threads) and every chunk is written as soon as it is processed, so the memory
+# used is proportional to the chunk and not to the file
+chunk_points = config.get("chunk_points")
+
+if chunk_points:
+    with WriteLaz.open_writer(
+        output_las_filename, output_offsets, output_extra_bytes_names, int(config["cores"])
+    ) as writer:
+        for las_content in ReadLaz.iter_chunks(
+            input_las_filename, int(chunk_points), int(config["cores"]), fields=las_fields
+        ):
+            MainContent, extra_bytes_array = add_parameters_and_normalize(las_content)
+            writer.write_chunk(MainContent, extra_bytes_array)
+else:
+    las_content = ReadLaz.ReadLaz(
+        input_las_filename, config["DLLPATH"], int(config["cores"]), fields=las_fields,
+        backend=io_backend,
+    )
+    MainContent, extra_bytes_array = add_parameters_and_normalize(las_content)
 
-WriteLaz.WriteLaz(
-    output_las_filename, config["DLLPATH"], MainContent, zero_offsets, extra_bytes_array
-)
+    # Write pointcloud to file
+    WriteLaz.WriteLaz(
+        output_las_filename, config["DLLPATH"], MainContent, output_offsets, extra_bytes_array,
+        backend=io_backend, n_threads=int(config["cores"]),
+    )
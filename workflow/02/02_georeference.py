@@ -8,6 +8,9 @@ os.chdir(os.path.dirname(os.path.abspath(__file__)))
 with open("user_config.yml", "r") as f:
     config = yaml.load(f, Loader=yaml.FullLoader)
 
+# ctypes (DLLPATH), laspy or auto - see ReadLaz.ReadLaz
+io_backend = config.get("io_backend", "ctypes")
+
 # add functions to path
 # os.chdir(config["function_path"])
 sys.path.append(os.path.join(config["function_path"], "Functions"))
@@ -16,6 +19,7 @@ sys.path.append(os.path.join(config["function_path"], "Functions"))
 import ReadLaz
 import Processing
 import WriteLaz
+import TransformChain
 
 
 # other python libraries
@@ -26,7 +30,15 @@ import csv
 input_las_filename = sys.argv[1]
 output_las_filename = sys.argv[2]
 
-las_content = ReadLaz.ReadLaz(input_las_filename, config["DLLPATH"])
+# Add extrabytes
+extra_bytes_names = ["Reflectance", "Deviation", "Deviation", "Range", "Theta", "Phi"]
+
+# Only the fields used below are read
+las_fields = ["x", "y", "z", "return_number", "number_of_returns", "intensity"]
+las_content = ReadLaz.ReadLaz(
+    input_las_filename, config["DLLPATH"], fields=las_fields + extra_bytes_names,
+    backend=io_backend,
+)
 
 ## Georeference based on ground control points
 
@@ -52,22 +64,26 @@ with open("reference_points_global.csv") as inputfile:
         global_reference_points.extend(row)
 
 ReferencePoints = np.array([local_reference_points, global_reference_points], dtype=np.float32)
-x1, y1, z1 = Processing.HELMERT3D(las_content, ReferencePoints)
 
-# Add extrabytes
-extra_bytes_names = ["Reflectance", "Deviation", "Deviation", "Range", "Theta", "Phi"]
+# Helmert 3D and the offsets in one pass
+# The estimated parameters are cached in config["helmert_parameters"] (.npz) when it is set
+chain = TransformChain.TransformChain().helmert(ReferencePoints, config.get("helmert_parameters"))
+chain = chain.offset(offsets)
+x1, y1, z1 = chain.apply(las_content.x, las_content.y, las_content.z, int(config.get("cores", 1)))
+
 extra_bytes_array = Processing.add_extra_bytes(las_content, extra_bytes_names)
 
 # Write pointcloud to file
 class MainContent:
-    x = x1 - offsets[0]
-    y = y1 - offsets[1]
-    z = z1 - offsets[2]
+    x = x1
+    y = y1
+    z = z1
     return_number = las_content.return_number
     number_of_returns = las_content.number_of_returns
     intensity = las_content.intensity
     ExtraBytes_name = extra_bytes_names
 
 WriteLaz.WriteLaz(
-    output_las_filename, config["DLLPATH"], MainContent, offsets, extra_bytes_array
+    output_las_filename, config["DLLPATH"], MainContent, offsets, extra_bytes_array,
+    backend=io_backend, n_threads=int(config.get("cores", 1)),
 )
@@ -3,7 +3,9 @@
 #SBATCH --account=project_2008498
 #SBATCH --time=00:15:00
 #SBATCH --ntasks=1
-#SBATCH --mem-per-cpu=160G
+#SBATCH --cpus-per-task=8
+#SBATCH --mem=160G
+# With out_of_core: true in user_config.yml the memory depends on tile_size and chunk_points only
 #SBATCH --partition=small
 
 module purge
@@ -8,6 +8,15 @@ os.chdir(os.path.dirname(os.path.abspath(__file__)))
 with open("user_config.yml", "r") as f:
     config = yaml.load(f, Loader=yaml.FullLoader)
 
+# ctypes (DLLPATH), laspy or auto - see ReadLaz.ReadLaz
+io_backend = config.get("io_backend", "ctypes")
+
+# kdtree or voxel (nearest point found with the voxel means, no KD-tree) - see Processing.Spatial_sample
+selection = config.get("selection", "kdtree")
+
+# threads of Spatial_sample: the cores given by SLURM (--cpus-per-task) unless set in the config
+n_jobs = config.get("n_jobs") or int(os.environ.get("SLURM_CPUS_PER_TASK", 1))
+
 # add functions to path
 # os.chdir(config["function_path"])
 sys.path.append(os.path.join(config["function_path"], "Functions"))
@@ -25,37 +34,86 @@ import numpy as np
 input_las_filename = sys.argv[1]
 output_las_filename = sys.argv[2]
 
-las_content = ReadLaz.ReadLaz(input_las_filename, config["DLLPATH"])
-
 # Add extrabytes
 extra_bytes_names = ["Reflectance", "Deviation", "Deviation", "Range", "Theta", "Phi"]
-extra_bytes_array = Processing.add_extra_bytes(las_content, extra_bytes_names)
 
-## spatial resample
-spatial_resample, extra_resample = Processing.Spatial_sample(
-    las_content,
-    useroption="neighbour",
-    pts_min=1,
-    vs=0.1,
-    npoints=1,
-    EXTRA=extra_bytes_array,
-    ExtraBytes_name=extra_bytes_names,
-    n_jobs=1,
-)
+# Only the fields used below are read
+las_fields = ["x", "y", "z", "return_number", "number_of_returns", "intensity"]
 
-# Write pointcloud to file
 # Defining offset - Local coordinate system
 offsets = np.array([357676.852, 6860035.171, 0], dtype=np.float32)
 
-class MainContent:
-    x = spatial_resample.x - offsets[0]
-    y = spatial_resample.y - offsets[1]
-    z = spatial_resample.z - offsets[2]
-    return_number = spatial_resample.return_number
-    number_of_returns = spatial_resample.number_of_returns
-    intensity = spatial_resample.intensity
-    ExtraBytes_name = extra_bytes_names
-
-WriteLaz.WriteLaz(
-    output_las_filename, config["DLLPATH"], MainContent, offsets, extra_resample
+# Out-of-core: the file is bucketed in XY tiles of tile_size meters on disk (next to the output)
+# and resampled tile by tile, so the memory used does not depend on the size of the plot
+if config.get("out_of_core", False):
+    Processing.Spatial_sample_out_of_core(
+        input_las_filename,
+        output_las_filename,
+        offsets,
+        useroption="neighbour",
+        pts_min=1,
+        vs=0.1,
+        ExtraBytes_name=extra_bytes_names,
+        fields=las_fields,
+        tile_size=config.get("tile_size", 20.0),
+        chunk_points=int(config.get("chunk_points") or 10_000_000),
+        n_threads=n_jobs,
+        selection=selection,
+    )
+    sys.exit(0)
+
+las_content = ReadLaz.ReadLaz(
+    input_las_filename, config["DLLPATH"], fields=las_fields + extra_bytes_names,
+    backend=io_backend,
 )
+
+extra_bytes_array = Processing.add_extra_bytes(las_content, extra_bytes_names)
+
+# LOD pyramid: with pyramid_voxel_sizes set, one file per voxel size is written from a single
+# sort of the points, the voxel size is added to the output name (e.g. plot_resampled_vs0.4.las)
+pyramid_voxel_sizes = config.get("pyramid_voxel_sizes")
+
+## spatial resample
+if pyramid_voxel_sizes:
+    levels = Processing.Spatial_sample_pyramid(
+        las_content,
+        useroption="neighbour",
+        pts_min=1,
+        voxel_sizes=pyramid_voxel_sizes,
+        EXTRA=extra_bytes_array,
+        ExtraBytes_name=extra_bytes_names,
+        selection=selection,
+    )
+    root, ext = os.path.splitext(output_las_filename.rstrip("/\\"))
+    outputs = [(f"{root}_vs{vs:g}{ext}", level) for vs, level in zip(pyramid_voxel_sizes, levels)]
+else:
+    outputs = [(
+        output_las_filename,
+        Processing.Spatial_sample(
+            las_content,
+            useroption="neighbour",
+            pts_min=1,
+            vs=0.1,
+            npoints=1,
+            EXTRA=extra_bytes_array,
+            ExtraBytes_name=extra_bytes_names,
+            n_jobs=n_jobs,
+            selection=selection,
+        ),
+    )]
+
+# Write pointcloud to file
+for output, (spatial_resample, extra_resample) in outputs:
+    class MainContent:
+        x = spatial_resample.x - offsets[0]
+        y = spatial_resample.y - offsets[1]
+        z = spatial_resample.z - offsets[2]
+        return_number = spatial_resample.return_number
+        number_of_returns = spatial_resample.number_of_returns
+        intensity = spatial_resample.intensity
+        ExtraBytes_name = extra_bytes_names
+
+    WriteLaz.WriteLaz(
+        output, config["DLLPATH"], MainContent, offsets, extra_resample,
+        backend=io_backend, n_threads=n_jobs,
+    )
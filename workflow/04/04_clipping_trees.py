@@ -8,6 +8,10 @@ os.chdir(os.path.dirname(os.path.abspath(__file__)))
 with open("user_config.yml", "r") as f:
     config = yaml.load(f, Loader=yaml.FullLoader)
 
+# ctypes (DLLPATH), laspy or auto - see ReadLaz.ReadLaz
+io_backend = config.get("io_backend", "ctypes")
+tree_extension = config.get("tree_extension", ".laz")
+
 # add functions to path
 # os.chdir(config['function_path'])
 sys.path.append(os.path.join(config["function_path"], "Functions"))
@@ -26,11 +30,21 @@ import pandas as pd
 input_las_filename = sys.argv[1]
 output_dir = sys.argv[2]
 
-las_content = ReadLaz.ReadLaz(input_las_filename, config["DLLPATH"])
-
 # Add extrabytes
 extra_bytes_names = ["Reflectance", "Deviation", "Deviation", "Range", "Theta", "Phi"]
-extra_bytes_array = Processing.add_extra_bytes(las_content, extra_bytes_names)
+
+# Only the fields used below are read
+las_fields = ["x", "y", "z", "return_number", "number_of_returns", "intensity"]
+
+# With window_read every tree is read on its own from the chunks around the stem,
+# otherwise the whole plot is read once
+window_read = config.get("window_read", False)
+if not window_read:
+    las_content = ReadLaz.ReadLaz(
+        input_las_filename, config["DLLPATH"], fields=las_fields + extra_bytes_names,
+        backend=io_backend,
+    )
+    extra_bytes_array = Processing.add_extra_bytes(las_content, extra_bytes_names)
 
 # Load stem map
 df = pd.read_excel(config["tree_map"])
@@ -56,6 +70,17 @@ CYLINDER = np.dstack((x_stem,y_stem, z_stem, RAIO))[0]
 offsets = np.array([357676.852, 6860035.171, 0], dtype=np.float32)
 
 for k in range(N_trees):
+    if window_read:
+        x_min, x_max = x_stem[k] - RAIO[k], x_stem[k] + RAIO[k]
+        y_min, y_max = y_stem[k] - RAIO[k], y_stem[k] + RAIO[k]
+        las_content = ReadLaz.ReadLaz(
+            input_las_filename,
+            config["DLLPATH"],
+            fields=las_fields + extra_bytes_names,
+            bbox=[x_min, y_min, x_max, y_max],
+        )
+        extra_bytes_array = Processing.add_extra_bytes(las_content, extra_bytes_names)
+
     # clip the tree
     tree, extra_tree = Processing.ClippingTree(
         las_content,
@@ -72,7 +97,7 @@ for k in range(N_trees):
         + os.path.split(input_las_filename)[-1].split(".")[0]
         + "_"
         + str(ID[k])
-        + ".laz"
+        + tree_extension
     )
 
     # Write single tree pointcloud to file
@@ -86,5 +111,6 @@ for k in range(N_trees):
         ExtraBytes_name = extra_bytes_names
 
     WriteLaz.WriteLaz(
-        output_las_filename, config["DLLPATH"], MainContent, offsets, extra_tree
+        output_las_filename, config["DLLPATH"], MainContent, offsets, extra_tree,
+        backend=io_backend, n_threads=int(config.get("cores", 1)),
     )
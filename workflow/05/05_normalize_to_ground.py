@@ -8,6 +8,9 @@ os.chdir(os.path.dirname(os.path.abspath(__file__)))
 with open("user_config.yml", "r") as f:
     config = yaml.load(f, Loader=yaml.FullLoader)
 
+# ctypes (DLLPATH), laspy or auto - see ReadLaz.ReadLaz
+io_backend = config.get("io_backend", "ctypes")
+
 # add functions to path
 # os.chdir(config["function_path"])
 sys.path.append(os.path.join(config["function_path"], "Functions"))
@@ -27,7 +30,16 @@ from scipy.interpolate import griddata
 
 input_las_dir = sys.argv[1]
 output_dir = sys.argv[2]
-input_files_list = glob.glob(input_las_dir + "/*.laz")
+if config.get("catalog"):
+    # FILES AND TREE IDS FROM THE HEADER CATALOG (see Functions/Catalog.py)
+    import Catalog
+
+    trees = Catalog.query_catalog(config["catalog"], directory=input_las_dir)
+    input_files_list = [tree["path"] for tree in trees]
+    tree_ids = {tree["path"]: tree["tree_id"] for tree in trees}
+else:
+    input_files_list = glob.glob(input_las_dir + "/*" + config.get("tree_extension", ".laz"))
+    tree_ids = {}
 
 # Load stem map
 df = pd.read_excel(config["tree_map"])
@@ -49,21 +61,41 @@ offsets_local = np.zeros((3), dtype=np.float32)
 
 for i, input_file in enumerate(input_files_list):
     # I guess tree_id == the number at the end of the filename of single tree las
-    tree_id = int(
-        os.path.basename(input_file).split(".")[0].split("_")[-1]
-    )
-
-    las_content = ReadLaz.ReadLaz(input_file, config["DLLPATH"])
+    tree_id = tree_ids.get(input_file)
+    if tree_id is None:
+        tree_id = int(
+            os.path.basename(input_file).split(".")[0].split("_")[-1]
+        )
 
     # Add extrabytes
     extra_bytes_names = ["Reflectance", "Deviation", "Range", "Theta", "Phi"]
-    extra_bytes_array = Processing.add_extra_bytes(las_content, extra_bytes_names)
 
-    DTM = ReadLaz.ReadLaz(config["DTM_NAME"], config["DLLPATH"])
+    # Only the fields used below are read
+    las_fields = ["x", "y", "z", "return_number", "number_of_returns", "intensity"]
+    las_content = ReadLaz.ReadLaz(
+        input_file, config["DLLPATH"], fields=las_fields + extra_bytes_names,
+        backend=io_backend,
+    )
+    extra_bytes_array = Processing.add_extra_bytes(las_content, extra_bytes_names)
 
     # If the min height is unkown it can be searched in the DTM
     x_stem = stem_map[stem_map.ID == tree_id].x_stem
     y_stem = stem_map[stem_map.ID == tree_id].y_stem
+
+    # With window_read only the DTM around the stem is read
+    if config.get("window_read", False):
+        r = config.get("dtm_window", 5)
+        x, y = float(x_stem.iloc[0]), float(y_stem.iloc[0])
+        DTM = ReadLaz.ReadLaz(
+            config["DTM_NAME"], config["DLLPATH"], fields=["x", "y", "z"],
+            bbox=[x - r, y - r, x + r, y + r],
+        )
+    else:
+        DTM = ReadLaz.ReadLaz(
+            config["DTM_NAME"], config["DLLPATH"], fields=["x", "y", "z"],
+            backend=io_backend,
+        )
+
     offsets_norm[2] = griddata(
         (DTM.x, DTM.y), DTM.z, (x_stem, y_stem), method="nearest"
     )
@@ -80,8 +112,11 @@ for i, input_file in enumerate(input_files_list):
     # We should just save the same file, but in different directory
     # Warning! This will not work if the directory does not exist!
     output_las_filename = (
-        output_dir + os.path.split(input_file)[-1]
+        output_dir + os.path.split(input_file.rstrip("/"))[-1]
     )
+    if output_las_filename.endswith(".pcstore"):
+        # STEP 06 READS THE TREES WITH LASPY
+        output_las_filename = output_las_filename[: -len(".pcstore")] + ".laz"
 
     # Write single tree pointcloud to file
     class MainContent:
@@ -94,5 +129,6 @@ for i, input_file in enumerate(input_files_list):
         ExtraBytes_name = extra_bytes_names
 
     WriteLaz.WriteLaz(
-        output_las_filename, config["DLLPATH"], MainContent, offsets_local, extra_tree
+        output_las_filename, config["DLLPATH"], MainContent, offsets_local, extra_tree,
+        backend=io_backend, n_threads=int(config.get("cores", 1)),
     )
@@ -23,13 +23,24 @@ import glob
 input_las_dir = sys.argv[1]
 output_las_dir = sys.argv[2]
 output_noise_dir = sys.argv[3]
-input_files_list = glob.glob(input_las_dir + "/*.laz")
+if config.get("catalog"):
+    # FILES AND TREE IDS FROM THE HEADER CATALOG (see Functions/Catalog.py)
+    import Catalog
+
+    trees = Catalog.query_catalog(config["catalog"], directory=input_las_dir)
+    input_files_list = [tree["path"] for tree in trees]
+    tree_ids = {tree["path"]: tree["tree_id"] for tree in trees}
+else:
+    input_files_list = glob.glob(input_las_dir + "/*.laz")
+    tree_ids = {}
 
 for input_file in input_files_list:
     # I guess tree_id == the number at the end of the filename of single tree las
-    tree_id = int(
-        os.path.basename(input_file).split(".")[0].split("_")[-1]
-    )
+    tree_id = tree_ids.get(input_file)
+    if tree_id is None:
+        tree_id = int(
+            os.path.basename(input_file).split(".")[0].split("_")[-1]
+        )
     output_pc = output_las_dir + os.path.basename(input_file)
     output_noise = output_noise_dir + os.path.basename(input_file)
 
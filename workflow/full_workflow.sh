@@ -14,21 +14,41 @@ export PATH="/projappl/project_2003180/samantha/bin:$PATH"
 BASE_PATH="/scratch/project_2008498/antongoo/fgi/snakemake/"
 BASE_NAME="200406_100502_Sample_resample005_"
 
+# Extension of the files passed between the steps: .las, .laz or .pcstore (columnar store
+# read with mmap, see Functions/PointStore.py). Final products are always written as LAZ
+INTERMEDIATE_EXT=".las"
+
+# Optional header catalog of the single tree files (Functions/Catalog.py), used by steps 05
+# and 06 when "catalog" is set to the same file in their user_config.yml
+CATALOG=""
+
+# Set to 1 when "transform_chain" is set in 01/user_config.yml: step 01 then applies the
+# rectification, Helmert 3D and offsets in one pass and writes the georeferenced file itself
+# (build the chain with: python ../Functions/TransformChain.py --help)
+CHAIN_IN_STEP_01=0
+
 input_las="${BASE_PATH}${BASE_NAME}.laz"
-output_las="${BASE_PATH}output/${BASE_NAME}/${BASE_NAME}_normalized.las"
-python 01/01_add_parameters_and_normalize.py $input_las $output_las
+if [ "$CHAIN_IN_STEP_01" = "1" ]; then
+    output_las="${BASE_PATH}output/${BASE_NAME}/${BASE_NAME}_georef${INTERMEDIATE_EXT}"
+    python 01/01_add_parameters_and_normalize.py $input_las $output_las
+else
+    output_las="${BASE_PATH}output/${BASE_NAME}/${BASE_NAME}_normalized${INTERMEDIATE_EXT}"
+    python 01/01_add_parameters_and_normalize.py $input_las $output_las
 
-input_las="${BASE_PATH}output/${BASE_NAME}/${BASE_NAME}_normalized.las"
-output_las="${BASE_PATH}output/${BASE_NAME}/${BASE_NAME}_georef.las"
-python 02/02_georeference.py $input_las $output_las
+    input_las="${BASE_PATH}output/${BASE_NAME}/${BASE_NAME}_normalized${INTERMEDIATE_EXT}"
+    output_las="${BASE_PATH}output/${BASE_NAME}/${BASE_NAME}_georef${INTERMEDIATE_EXT}"
+    python 02/02_georeference.py $input_las $output_las
+fi
 
-input_las="${BASE_PATH}output/${BASE_NAME}/${BASE_NAME}_georef.las"
+input_las="${BASE_PATH}output/${BASE_NAME}/${BASE_NAME}_georef${INTERMEDIATE_EXT}"
 output_dir="${BASE_PATH}output/${BASE_NAME}/single_trees/"
 python 04/04_clipping_trees.py $input_las $output_dir
+if [ -n "$CATALOG" ]; then python ../Functions/Catalog.py $CATALOG $output_dir; fi
 
 input_las_dir="${BASE_PATH}output/${BASE_NAME}/single_trees/"
 output_dir="${BASE_PATH}output/${BASE_NAME}/single_trees_normalized_to_ground/"
 python 05/05_normalize_to_ground.py $input_las_dir $output_dir
+if [ -n "$CATALOG" ]; then python ../Functions/Catalog.py $CATALOG $output_dir; fi
 
 input_las_dir="${BASE_PATH}output/${BASE_NAME}/single_trees_normalized_to_ground/"
 output_las_dir=/"${BASE_PATH}output/${BASE_NAME}/fine_segmentation/"